@@ -0,0 +1,6 @@
+#!/bin/sh
+
+# Stops the running sync gracefully, its progress is kept for `sync.sh -r`.
+# force_crawl_stop.sh is the last resort, the progress since the last
+# checkpoint is lost.
+cd "$(dirname "$0")/../src" && exec python3 -m book_bot stop
@@ -0,0 +1,125 @@
+"""Peak RSS against the number of concurrent large downloads.
+
+Each measurement runs in a fresh process, since the peak RSS of a process
+never goes down. Files are served by a local twisted server reading a
+sparse file, so the server side memory stays flat.
+
+    python -m benchmarks.bench_download_memory [--size-mb 64] [--concurrency 1 4 16]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+
+MODES = ('buffered', 'streamed')
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def serve_file(size):
+    from twisted.internet import reactor
+    from twisted.web import server, static
+    from twisted.web.resource import Resource
+
+    handle, path = tempfile.mkstemp(suffix='.bin')
+    os.ftruncate(handle, size)
+    os.close(handle)
+    root = Resource()
+    root.putChild(b'file', static.File(path, defaultType='application/octet-stream'))
+    port = reactor.listenTCP(0, server.Site(root), interface='127.0.0.1')
+    return path, f'http://127.0.0.1:{port.getHost().port}/file'
+
+
+def measure(mode, concurrency, size):
+    """Downloads `concurrency` files at once, returns the measurement."""
+    from twisted.internet import reactor, defer
+    from scrapy import Spider
+    from scrapy.http import Request
+    from scrapy.utils.misc import create_instance
+    from scrapy.utils.test import get_crawler
+    from book_bot.handlers import StreamingDownloadHandler
+
+    path, url = serve_file(size)
+    workdir = tempfile.mkdtemp()
+    crawler = get_crawler(Spider, {'DOWNLOAD_MAXSIZE': 0, 
+                                   'DOWNLOAD_WARNSIZE': 0,
+                                   'STREAM_BUFFER_SIZE': 256 * 1024,
+                                   'STREAM_MEMORY_BUDGET': 64 * 1024 * 1024})
+    crawler.spider = Spider('bench')
+    handler = create_instance(StreamingDownloadHandler, crawler.settings, crawler)
+    result = {'mode': mode, 'concurrency': concurrency, 'size_mb': size / 2 ** 20,
+              'baseline_rss_mb': peak_rss_mb()}
+
+    def request(index):
+        meta = {'download_timeout': 600}
+        if mode == 'streamed':
+            meta['download_part'] = os.path.join(workdir, f'{index}.part')
+        return Request(url, meta=meta)
+
+    def done(results):
+        result['seconds'] = time.monotonic() - started
+        result['peak_rss_mb'] = peak_rss_mb()
+        result['ok'] = all(ok and r.status == 200 for ok, r in results)
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+        os.remove(path)
+        reactor.stop()
+
+    def start():
+        downloads = [handler.download_request(request(i), crawler.spider) 
+                     for i in range(concurrency)]
+        defer.DeferredList(downloads, consumeErrors=True).addCallback(done)
+
+    started = time.monotonic()
+    reactor.callWhenRunning(start)
+    reactor.run()
+    return result
+
+
+def run_worker(mode, concurrency, size):
+    command = [sys.executable, '-m', 'benchmarks.bench_download_memory', '--worker',
+               mode, str(concurrency), str(size)]
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--output', help='Writes the results as JSON to this file')
+    parser.add_argument('--worker', nargs=3, help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+
+    if options.worker:
+        mode, concurrency, size = options.worker
+        print(json.dumps(measure(mode, int(concurrency), int(size))))
+        return 0
+
+    results = []
+    print(f'{"mode":<10} {"concurrency":>11} {"size MB":>8} {"peak RSS MB":>12} {"seconds":>8}')
+    for concurrency in options.concurrency:
+        for mode in MODES:
+            r = run_worker(mode, concurrency, options.size_mb * 2 ** 20)
+            results.append(r)
+            print(f'{r["mode"]:<10} {r["concurrency"]:>11} {r["size_mb"]:>8.0f} '
+                  f'{r["peak_rss_mb"]:>12.1f} {r["seconds"]:>8.2f}')
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Listing extraction with the compiled loaders against per field selectors.
+
+Each page is generated with the number of rows asked, then parsed once;
+only the extraction of the items is timed.
+
+    python -m benchmarks.bench_extraction [--rows 1000 10000] [--repeat 3]
+"""
+import sys
+import json
+import time
+import argparse
+
+from book_bot.items import Book, BookLoader, Subject, SubjectLoader
+from book_bot.spiders.max_spider import MaxBook, MaxBookLoader
+from benchmarks import pages
+
+
+def selector_subjects(response):
+    subjects = []
+    for tree in response.xpath("//div[@id='grad']/div[1]/div[1]/div[1]/div"):
+        s = Subject()
+        s['class_id'] = tree.xpath('.//a/@data-turma_id')
+        s['name'] = tree.xpath('.//p/text()')
+        subjects.append(s)
+    return subjects
+
+
+def selector_books(response):
+    books = []
+    for tree in response.xpath("//div[@id='insereEspaco']/div"):
+        b = Book(subject=None)
+        b['name'] = tree.xpath('.//small//text()')
+        b['download_url'] = tree.xpath(".//a[@title='Download']/@href")
+        books.append(b)
+    return books
+
+
+def selector_max_books(response):
+    books = []
+    for tree in response.xpath('/html/body/table/tbody/tr')[1:]:
+        b = MaxBook(subject=None)
+        b['download_url'] = tree.xpath('.//td[last()]/a[1]/@href')
+        b['name'] = tree.xpath('.//td[last()]/a[1]/text()')
+        if b['download_url']:
+            books.append(b)
+    return books
+
+
+def compiled(loader):
+    def extract(response):
+        for index, row in enumerate(loader.get_tree(response)):
+            loader(index, row)
+        return loader.subjects if hasattr(loader, 'subjects') else loader.books
+    return extract
+
+
+LISTINGS = {
+    'eva_subjects': (pages.eva_subjects, selector_subjects, lambda: SubjectLoader()),
+    'eva_books': (pages.eva_books, selector_books, lambda: BookLoader(subject=None)),
+    'max_books': (pages.max_books, selector_max_books, lambda: MaxBookLoader(subject=None)),
+}
+
+
+def timed(fn, response, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(response)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(listing, rows, repeat):
+    generate, selector, loader = LISTINGS[listing]
+    response = pages.response(generate(rows))
+    response.selector  # the page is parsed once, by both
+    assert selector(response) == compiled(loader())(response)
+    return {'listing': listing, 'rows': rows,
+            'selector_seconds': timed(selector, response, repeat),
+            'compiled_seconds': timed(lambda r: compiled(loader())(r), response, repeat)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Writes the results as JSON to this file')
+    options = parser.parse_args(argv)
+
+    results = []
+    print(f'{"listing":<14} {"rows":>8} {"selector s":>11} {"compiled s":>11} {"speedup":>8}')
+    for rows in options.rows:
+        for listing in LISTINGS:
+            r = measure(listing, rows, options.repeat)
+            results.append(r)
+            print(f'{r["listing"]:<14} {r["rows"]:>8} {r["selector_seconds"]:>11.3f} '
+                  f'{r["compiled_seconds"]:>11.3f} '
+                  f'{r["selector_seconds"] / r["compiled_seconds"]:>7.1f}x')
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
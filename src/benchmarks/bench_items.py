@@ -0,0 +1,88 @@
+"""Cost of building and reading books, on 100k of them.
+
+Measures the three ways books are used by the spiders: parsed from a
+listing (raw values), loaded back from the sync state (clean values) and
+read by the downloader. Memory is the size of the loaded books.
+
+    python -m benchmarks.bench_items [--books 100000] [--repeat 3]
+"""
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+from book_bot.items import Book, BookLoader, Subject
+
+
+def raw_books(count):
+    # values as extracted from html, lists of strings
+    subject = Subject(name=['Turma 1 - Subject'], class_id=['1'])
+    for i in range(count):
+        yield subject, dict(name=[f'  Book {i}  '],
+                            download_url=[f'/download?id={i}&{Book.qs_file_arg}=book{i}.pdf'])
+
+
+def clean_books(count):
+    subject = dict(name='Subject', class_id='1')
+    for i in range(count):
+        yield dict(name=f'Book {i}', download_url=f'/download?id={i}&{Book.qs_file_arg}=book{i}.pdf',
+                   filename=f'book{i}.pdf', subject=subject)
+
+
+def parse(count):
+    return [Book(subject=subject, **values) for subject, values in raw_books(count)]
+
+
+def load(count):
+    return [BookLoader.from_dict(data) for data in clean_books(count)]
+
+
+def read(books):
+    for book in books:
+        book['download_url'], book['filename'], book['name'], book['subject']['name']
+
+
+def timed(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def loaded_size_mb(count):
+    tracemalloc.start()
+    books = load(count)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del books
+    return size / 2 ** 20
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Writes the results as JSON to this file')
+    options = parser.parse_args(argv)
+
+    books = load(options.books)
+    result = {'books': options.books,
+              'parse_seconds': timed(parse, options.books, repeat=options.repeat),
+              'load_seconds': timed(load, options.books, repeat=options.repeat),
+              'read_seconds': timed(read, books, repeat=options.repeat),
+              'loaded_mb': loaded_size_mb(options.books)}
+
+    for key, value in result.items():
+        print(f'{key:<14} {value:>10.3f}' if isinstance(value, float) else f'{key:<14} {value:>10}')
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(result, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
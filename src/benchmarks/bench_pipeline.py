@@ -0,0 +1,128 @@
+"""Throughput and latency of whole syncs against the local mock server.
+
+Starts benchmarks.mock_server with the given shape, then syncs twice from
+a clean directory: the first run downloads every file, the second one
+only revalidates them. Each sync runs in its own process.
+
+    python -m benchmarks.bench_pipeline [--max] [--subjects 5] [--books 10] [--file-size-kb 256] [--latency 0.05]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+from benchmarks import mock_server
+
+
+def sync_worker(max_run, auth_file, destination):
+    """Runs a whole sync in this process, returns its measurements."""
+    from twisted.internet import reactor
+    from scrapy.utils.log import configure_logging
+    from scrapy.utils.project import get_project_settings
+    from book_bot.runner import SyncRunner
+
+    settings = get_project_settings()
+    configure_logging(settings)
+    runner = SyncRunner(settings, max_run=max_run, auth_file=auth_file, destination=destination)
+    failures = []
+
+    def start():
+        d = runner.run()
+        d.addErrback(failures.append)
+        d.addBoth(lambda _: reactor.stop())
+
+    started = time.perf_counter()
+    reactor.callWhenRunning(start)
+    reactor.run()
+    files = [os.path.join(root, name) for root, _, names in os.walk(destination) for name in names]
+    return {'seconds': time.perf_counter() - started,
+            'phases': dict(runner.timings),
+            'files': len(files),
+            'bytes': sum(os.path.getsize(path) for path in files),
+            'failed': bool(failures)}
+
+
+def run_sync(env, workdir, max_run):
+    command = [sys.executable, '-m', 'benchmarks.bench_pipeline', '--worker', workdir]
+    if max_run:
+        command.append('--max')
+    output = subprocess.run(command, check=True, env=env, stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def start_server(args):
+    command = [sys.executable, '-m', 'benchmarks.mock_server', '--port', '0',
+               '--subjects', str(args.subjects), '--books', str(args.books),
+               '--file-size-kb', str(args.file_size_kb), '--latency', str(args.latency),
+               '--bandwidth-kbps', str(args.bandwidth_kbps),
+               '--error-rate', str(args.error_rate), '--drop-rate', str(args.drop_rate)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    urls = dict(process.stdout.readline().decode().strip().split('=', 1) for _ in range(2))
+    return process, urls
+
+
+def server_stats(urls):
+    stats_url = urls['EVA_BASE_URL'].replace('/eadv4/', '/_stats')
+    with urllib.request.urlopen(stats_url) as response:
+        return json.loads(response.read().decode())
+
+
+def main(argv=None):
+    parser = mock_server.build_parser()
+    parser.description = __doc__.splitlines()[0]
+    parser.add_argument('--max', action='store_true', help='Syncs Max instead of EVA')
+    parser.add_argument('--output', help='Writes the results as JSON to this file')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        os.chdir(args.worker)
+        print(json.dumps(sync_worker(args.max, os.path.join(args.worker, 'auth'),
+                                     os.path.join(args.worker, 'downloads'))))
+        return 0
+
+    process, urls = start_server(args)
+    workdir = tempfile.mkdtemp()
+    try:
+        options = mock_server.Options()
+        with open(os.path.join(workdir, 'auth'), 'w') as file:
+            file.write(f'{options.username}\n{options.password}\n')
+        env = dict(os.environ, **urls,
+                   EVA_COOKIEJAR=os.path.join(workdir, 'cookies'),
+                   SCRAPY_SETTINGS_MODULE='book_bot.settings',
+                   PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])))
+
+        results = []
+        for name in ('cold', 'warm'):
+            sent = server_stats(urls).get('bytes_sent', 0)
+            r = dict(run_sync(env, workdir, args.max), run=name)
+            r['bytes_transferred'] = server_stats(urls).get('bytes_sent', 0) - sent
+            results.append(r)
+            phases = ' '.join(f'{phase}={elapsed:.2f}s' for phase, elapsed in r['phases'].items())
+            print(f'{name:<5} {r["seconds"]:>7.2f}s {r["files"]:>6} files '
+                  f'{r["bytes_transferred"] / 2 ** 20 / r["seconds"]:>8.1f} MB/s  {phases}'
+                  f'{"  FAILED" if r["failed"] else ""}')
+        stats = server_stats(urls)
+        print('server:', ' '.join(f'{k}={v}' for k, v in stats.items() if k != 'options'))
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'runs': results, 'server': stats}, file, indent=2)
+    failed = [r['run'] for r in results if r['failed']]
+    if failed:
+        print('failed:', ' '.join(failed), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,334 @@
+"""Local stand-in for EVA and Max, to run whole syncs offline.
+
+Mimics the login, subject and book listings, downloads and logout of EVA,
+plus the schedule and listings of Max. Subject and book counts, file
+sizes, latency, bandwidth and injected errors are configurable, and
+the counters of what was served are available at /_stats.
+
+    python -m benchmarks.mock_server [--port 8080] [--subjects 5] [--books 10] [--file-size-kb 256]
+
+Then point the spiders to it, the credentials are aluno/senha by default:
+
+    EVA_BASE_URL=http://127.0.0.1:8080/eadv4/ MAX_BASE_URL=http://127.0.0.1:8080/max.pereira/ \\
+        python3 -m book_bot sync -x auth_file
+"""
+import sys
+import json
+import random
+import argparse
+import collections
+from dataclasses import dataclass, asdict
+
+from twisted.internet import reactor
+from twisted.web import resource, server
+from twisted.web.http import datetimeToString
+
+
+SESSION_COOKIE = b'JSESSIONID'
+LAST_MODIFIED = datetimeToString(1569798060).decode()
+
+
+@dataclass
+class Options:
+    subjects: int = 5
+    books: int = 10
+    file_size: int = 256 * 1024
+    latency: float = 0.0
+    bandwidth: int = 0  # bytes per second of each response, 0 is unlimited
+    error_rate: float = 0.0  # downloads answered with 503
+    drop_rate: float = 0.0  # downloads dropped halfway
+    session_requests: int = 0  # requests a session lasts, 0 is forever
+    username: str = 'aluno'
+    password: str = 'senha'
+    seed: int = 0
+
+
+class MockServer:
+    """Site serving EVA under /eadv4/ and Max under /max.pereira/."""
+
+    def __init__(self, options=None):
+        self.options = options or Options()
+        self.random = random.Random(self.options.seed)
+        self.sessions = collections.Counter()  # requests made by each session
+        self.stats = collections.Counter()
+        self.body = b'%PDF-1.4\n' + b'0' * max(self.options.file_size - 9, 0)
+
+        root = resource.Resource()
+        root.putChild(b'robots.txt', _Endpoint(self, lambda request: b''))
+        eva = resource.Resource()
+        root.putChild(b'eadv4', eva)
+        for name, render in [(b'', self.home),
+                             (b'login.processa', self.login),
+                             (b'logout.processa', self.logout),
+                             (b'listaDisciplina.processa', self.subjects),
+                             (b'listaMidiatecas.processa', self.books),
+                             (b'midiateca.download', self.download)]:
+            eva.putChild(name, _Endpoint(self, render))
+        root.putChild(b'max.pereira', _Max(self))
+        root.putChild(b'_stats', _Endpoint(self, self.dump_stats, delayed=False))
+        self.site = server.Site(root)
+
+    def listen(self, port=0, interface='127.0.0.1'):
+        return reactor.listenTCP(port, self.site, interface=interface)
+
+    # EVA
+
+    def home(self, request):
+        return _HOME_PAGE if self.logged(request) else _LOGIN_PAGE
+
+    def login(self, request):
+        username = _arg(request, 'id_login')
+        password = _arg(request, 'id_senha')
+        # aluno1, aluno2... are accounts too, for batch syncs
+        if not (username or '').startswith(self.options.username) or password != self.options.password:
+            self.stats['login_failed'] += 1
+            return _LOGIN_PAGE
+        session = '%032x' % self.random.getrandbits(128)
+        self.sessions[session] = 0
+        request.addCookie(SESSION_COOKIE, session, path='/eadv4/')
+        self.stats['login'] += 1
+        return _HOME_PAGE
+
+    def logout(self, request):
+        self.sessions.pop(_session(request), None)
+        self.stats['logout'] += 1
+        request.redirect(b'/eadv4/')
+        return b''
+
+    def subjects(self, request):
+        if not self.logged(request):
+            return _LOGIN_PAGE
+        rows = ''.join(f'<div class="turma"><a data-turma_id="{i}" href="#">abrir</a>'
+                       f'<p>2019/2 - Disciplina {i}</p></div>'
+                       for i in range(self.options.subjects))
+        return _page(f'<div id="grad"><div><div><div>{rows}</div></div></div></div>')
+
+    def books(self, request):
+        if not self.logged(request):
+            return _LOGIN_PAGE
+        subject = _arg(request, 'turmaIdSessao')
+        rows = ''.join(f'<div class="midiateca"><small>Material {i}</small>'
+                       f'<a title="Download" href="{self._download_href(subject, i)}"></a></div>'
+                       for i in range(self.options.books))
+        return _page(f'<div id="insereEspaco">{rows}</div>')
+
+    @staticmethod
+    def _download_href(subject, index):
+        href = f'midiateca.download?id={subject}_{index}'
+        # some files are only named by their Content-Disposition
+        return href if index % 5 == 4 else f'{href}&amp;arquivo=material{subject}_{index}.pdf'
+
+    def download(self, request):
+        if not self.logged(request):
+            return _LOGIN_PAGE
+        filename = f'material{_arg(request, "id")}.pdf'
+        request.setHeader(b'Content-Disposition', f'attachment; filename="{filename}"'.encode())
+        return self.file(request)
+
+    # Max
+
+    def schedule(self, request):
+        cells = ''.join(f'<td><a href="disciplina{i}.htm">Disciplina {i}</a></td>'
+                        for i in range(self.options.subjects))
+        return _page('<table><tbody><tr><td>Prof. Max</td></tr></tbody></table>'
+                     '<table><tbody><tr><td>Turno</td></tr>'
+                     f'<tr><td>Noturno</td>{cells}</tr></tbody></table>')
+
+    def listing(self, request, subject):
+        rows = ''.join(f'<tr><td>{i}</td><td><a href="aula{subject}_{i}.pdf">Aula {i}</a></td></tr>'
+                       for i in range(self.options.books))
+        return _page(f'<table><tbody><tr><td>Aula</td><td>Material</td></tr>{rows}</tbody></table>')
+
+    # Files
+
+    def file(self, request):
+        """Body of a file, with validators, range and injected errors."""
+        etag = b'"v1"'
+        request.setHeader(b'Content-Type', b'application/pdf')
+        request.setHeader(b'ETag', etag)
+        request.setHeader(b'Last-Modified', LAST_MODIFIED.encode())
+        request.setHeader(b'Accept-Ranges', b'bytes')
+        if request.getHeader(b'If-None-Match') == etag:
+            self.stats['not_modified'] += 1
+            request.setResponseCode(304)
+            return b''
+        if self.random.random() < self.options.error_rate:
+            self.stats['error_injected'] += 1
+            request.setResponseCode(503)
+            return b''
+
+        body = self.body
+        asked = request.getHeader(b'Range')
+        if asked and request.getHeader(b'If-Range') in (None, etag):
+            start = int(asked.decode().split('=')[1].split('-')[0])
+            if start >= len(body):
+                request.setResponseCode(416)
+                return b''
+            request.setResponseCode(206)
+            request.setHeader(b'Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}'.encode())
+            body = body[start:]
+            self.stats['range'] += 1
+
+        drop = self.random.random() < self.options.drop_rate
+        if drop:
+            self.stats['drop_injected'] += 1
+        self.stats['files'] += 1
+        return _Body(body, drop_at=len(body) // 2 if drop else None)
+
+    def dump_stats(self, request):
+        request.setHeader(b'Content-Type', b'application/json')
+        return json.dumps(dict(self.stats, options=asdict(self.options))).encode()
+
+    def logged(self, request):
+        session = _session(request)
+        if session not in self.sessions:
+            return False
+        self.sessions[session] += 1
+        limit = self.options.session_requests
+        if limit and self.sessions[session] > limit:
+            del self.sessions[session]
+            self.stats['session_expired'] += 1
+            return False
+        return True
+
+    def send(self, request, body):
+        if isinstance(body, _Body):
+            body.send(self, request)
+            return
+        request.setHeader(b'Content-Length', str(len(body)).encode())
+        request.write(body)
+        self.stats['bytes_sent'] += len(body)
+        request.finish()
+
+
+class _Body:
+    """Response body written at the configured bandwidth."""
+
+    def __init__(self, data, drop_at=None):
+        self.data = data
+        self.drop_at = drop_at
+        self.call = None
+
+    def send(self, mock, request):
+        rate = mock.options.bandwidth
+        request.setHeader(b'Content-Length', str(len(self.data)).encode())
+        request.notifyFinish().addErrback(lambda _: self.call and self.call.active() and self.call.cancel())
+        chunk = max(rate // 20, 1) if rate else len(self.data)
+        self._write(mock, request, 0, chunk, 0.05 if rate else 0)
+
+    def _write(self, mock, request, offset, chunk, interval):
+        end = len(self.data) if self.drop_at is None else self.drop_at
+        if offset >= end:
+            if self.drop_at is None:
+                request.finish()
+            else:
+                request.channel.transport.abortConnection()
+            return
+        data = self.data[offset:min(offset + chunk, end)]
+        request.write(data)
+        mock.stats['bytes_sent'] += len(data)
+        self.call = reactor.callLater(interval, self._write, mock, request,
+                                      offset + len(data), chunk, interval)
+
+
+class _Endpoint(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, mock, render, delayed=True):
+        super().__init__()
+        self.mock = mock
+        self.render_page = render
+        self.delayed = delayed
+
+    def render(self, request):
+        self.mock.stats['requests'] += 1
+        latency = self.mock.options.latency if self.delayed else 0
+        reactor.callLater(latency, self._respond, request)
+        return server.NOT_DONE_YET
+
+    def _respond(self, request):
+        if request.finished or request._disconnected:
+            return
+        self.mock.send(request, self.render_page(request))
+
+
+class _Max(resource.Resource):
+
+    def __init__(self, mock):
+        super().__init__()
+        self.mock = mock
+
+    def getChild(self, name, request):
+        name = name.decode()
+        if name == 'horario.htm':
+            return _Endpoint(self.mock, self.mock.schedule)
+        if name.startswith('disciplina') and name.endswith('.htm'):
+            subject = name[len('disciplina'):-len('.htm')]
+            return _Endpoint(self.mock, lambda request: self.mock.listing(request, subject))
+        if name.startswith('aula') and name.endswith('.pdf'):
+            return _Endpoint(self.mock, self.mock.file)
+        return resource.NoResource()
+
+
+def _page(content):
+    return f'<html><head><meta charset="utf-8"></head><body>{content}</body></html>'.encode()
+
+
+_HOME_PAGE = _page('<div id="icon-sair-perfil"><i class="icon-user"></i></div>'
+                   '<a href="logout.processa">Sair</a>')
+
+_LOGIN_PAGE = _page('<form method="post" action="login.processa">'
+                    '<input type="text" id="id_login" name="id_login">'
+                    '<input type="password" id="id_senha" name="id_senha"></form>')
+
+
+def _arg(request, name):
+    values = request.args.get(name.encode())
+    return values[0].decode() if values else None
+
+
+def _session(request):
+    value = request.getCookie(SESSION_COOKIE)
+    return value.decode() if value else None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--interface', default='127.0.0.1')
+    parser.add_argument('--subjects', type=int, default=Options.subjects)
+    parser.add_argument('--books', type=int, default=Options.books, help='Books of each subject')
+    parser.add_argument('--file-size-kb', type=int, default=Options.file_size // 1024)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds before each response')
+    parser.add_argument('--bandwidth-kbps', type=int, default=0, help='KB/s of each response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Downloads answered with 503')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='Downloads dropped halfway')
+    parser.add_argument('--session-requests', type=int, default=0,
+                        help='Requests after which sessions expire, 0 is never')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser
+
+
+def options_from_args(args):
+    return Options(subjects=args.subjects, books=args.books,
+                   file_size=args.file_size_kb * 1024,
+                   latency=args.latency,
+                   bandwidth=args.bandwidth_kbps * 1024,
+                   error_rate=args.error_rate,
+                   drop_rate=args.drop_rate,
+                   session_requests=args.session_requests,
+                   seed=args.seed)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    port = MockServer(options_from_args(args)).listen(args.port, args.interface)
+    url = f'http://{args.interface}:{port.getHost().port}'
+    print(f'EVA_BASE_URL={url}/eadv4/', flush=True)
+    print(f'MAX_BASE_URL={url}/max.pereira/', flush=True)
+    reactor.run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+"""Generated listing pages, shaped like the ones served by EVA and Max."""
+from scrapy.http import HtmlResponse
+
+
+def eva_subjects(rows):
+    subjects = ''.join(
+        f'<div class="turma"><a data-turma_id="{i}" href="#">abrir</a>'
+        f'<p>\n    2019/2 - Subject {i}\n  </p></div>'
+        for i in range(rows))
+    return f'<html><body><div id="grad"><div><div><div>{subjects}</div></div></div></div></body></html>'
+
+
+def eva_books(rows):
+    books = ''.join(
+        f'<div class="midiateca"><div class="panel"><small>\n  <b>Book</b> {i}\n</small>'
+        f'<a title="Visualizar" href="/eadv4/midiateca.visualiza?id={i}">ver</a>'
+        f'<a title="Download" href="/eadv4/midiateca.download?id={i}&amp;arquivo=book{i}.pdf"></a>'
+        f'</div></div>'
+        for i in range(rows))
+    return f'<html><body><div id="insereEspaco">{books}</div></body></html>'
+
+
+def max_schedule(rows):
+    subjects = ''.join(f'<td><a href="subject{i}.htm">Subject\r\n {i}</a></td>' for i in range(rows))
+    return ('<html><body><table><tbody><tr><td>Max</td></tr></tbody></table><table><tbody>'
+            f'<tr><td>Turno</td></tr><tr><td>Noturno</td>{subjects}</tr></tbody></table></body></html>')
+
+
+def max_books(rows):
+    books = ''.join(
+        f'<tr><td>{i}</td><td><a href="subject/book{i}.pdf">Book\r\n   {i}</a></td></tr>'
+        for i in range(rows))
+    return f'<html><body><table><tbody><tr><td>Aula</td><td>Material</td></tr>{books}</tbody></table></body></html>'
+
+
+def response(html, url='http://localhost/page.html'):
+    return HtmlResponse(url=url, body=html.encode('utf-8'), encoding='utf-8')
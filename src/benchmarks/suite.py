@@ -0,0 +1,245 @@
+"""Benchmark suite of the hot paths of a sync, with JSON results.
+
+Listing pages (EVA subjects and books, Max schedule and books) are
+generated with 10, 1k and 100k rows. For each size it times the page
+parsing, `_display_and_load` with every loader, the item processing, the
+sync state and its legacy json files. `handle_download` is timed in a
+separate process, downloading from a local stand-in server.
+
+    python -m benchmarks.suite [--rows 10 1000 100000] [--files 10 1000] [--output results.json]
+
+Pass the results of a previous release with --baseline to see how much
+each case changed since then.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import scrapy
+
+from book_bot.items import Book, BookLoader, Subject, SubjectLoader
+from book_bot.spiders.eva_parser import _display_and_load
+from book_bot.spiders.max_spider import MaxBookLoader, MaxSubjectLoader
+from book_bot.utils import os_files, state
+from benchmarks import pages
+
+
+class _Spider:
+    # what _display_and_load needs from a spider
+    logger = logging.getLogger('benchmarks')
+
+
+def listing_cases(rows):
+    """(case name, function to time) of the listings with `rows` rows."""
+    subject = Subject.from_clean(name='subject', class_id='1')
+    listings = [
+        ('eva_subjects', pages.eva_subjects, 'subject', SubjectLoader),
+        ('eva_books', pages.eva_books, 'book', lambda: BookLoader(subject=subject)),
+        ('max_subjects', pages.max_schedule, 'subject', MaxSubjectLoader),
+        ('max_books', pages.max_books, 'book', lambda: MaxBookLoader(subject=subject)),
+    ]
+    for listing, generate, name, loader in listings:
+        html = generate(rows)
+        response = pages.response(html)
+        response.selector
+        # defaults bind the listing of this iteration
+        yield f'parse/{listing}', lambda html=html: pages.response(html).selector
+        yield f'loader/{listing}', lambda r=response, loader=loader: _load(loader(), r)
+        # the items are yielded one by one, the list builds them all
+        yield f'display_and_load/{listing}', lambda r=response, name=name, loader=loader: \
+            list(_display_and_load(_Spider, name, loader().get_tree(r), loader()))
+
+
+def _load(loader, response):
+    for index, row in enumerate(loader.get_tree(response)):
+        loader(index, row)
+
+
+def item_cases(rows):
+    subject = Subject(name=['2019/2 - subject'], class_id=['1'])
+    raw = [dict(name=[f'  book {i} '], download_url=[f'/download?id={i}&{Book.qs_file_arg}=book{i}.pdf'])
+           for i in range(rows)]
+    clean = [dict(name=f'book {i}', download_url=f'/download?id={i}&{Book.qs_file_arg}=book{i}.pdf',
+                  filename=f'book{i}.pdf', subject=dict(name='subject', class_id='1'))
+             for i in range(rows)]
+    yield 'items/from_html', lambda: [Book(subject=subject, **values) for values in raw]
+    yield 'items/from_state', lambda: [BookLoader.from_dict(data) for data in clean]
+
+
+def state_cases(rows, directory):
+    subject = Subject.from_clean(name='subject', class_id='1')
+    books = [Book.from_listing(f'book {i}', f'/download?id={i}&{Book.qs_file_arg}=book{i}.pdf', subject)
+             for i in range(rows)]
+    sync_state = state.SyncState(os.path.join(directory, f'state-{rows}.db'))
+    sync_state.replace_subjects([subject])
+
+    yield 'state/replace_books', lambda: sync_state.replace_books(subject, books)
+    yield 'state/load_books', lambda: list(sync_state.books())
+
+    legacy = [dict(book, subject=dict(subject)) for book in books]
+    sync_dir = os.path.join(directory, '.sync')
+    yield 'os_files/dump_sync_data', lambda: _in(directory, os_files.dump_sync_data, 'books.json', legacy)
+    yield 'os_files/load_sync_data', lambda: os_files.load_sync_data('books.json', directory=sync_dir)
+
+
+def _in(directory, fn, *args):
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        return fn(*args)
+    finally:
+        os.chdir(cwd)
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def result(case, rows, seconds):
+    return {'case': case, 'rows': rows, 'seconds': seconds,
+            'per_row_us': seconds / rows * 1e6 if rows else None}
+
+
+def run_in_process(rows, repeat):
+    directory = tempfile.mkdtemp()
+    try:
+        cases = [*listing_cases(rows), *item_cases(rows), *state_cases(rows, directory)]
+        # the state of a case is only created when it is reached
+        for case, fn in cases:
+            yield result(case, rows, timed(fn, repeat))
+    finally:
+        shutil.rmtree(directory)
+
+
+def download_worker(files, size):
+    """Downloads `files` books through the streaming handler and handle_download."""
+    from twisted.internet import reactor, defer
+    from twisted.web import resource, server
+    from scrapy.utils.misc import create_instance
+    from scrapy.utils.project import get_project_settings
+    from scrapy.utils.test import get_crawler
+    from book_bot.handlers import StreamingDownloadHandler
+    from book_bot.spiders.sync_spider import BookDownloaderSpider
+
+    body = b'%PDF' + b'\0' * (size - 4)
+
+    class Files(resource.Resource):
+        isLeaf = True
+
+        def render_GET(self, request):
+            filename = request.args[b'id'][0].decode() + '.pdf'
+            request.setHeader(b'Content-Type', b'application/pdf')
+            request.setHeader(b'Content-Disposition', f'attachment; filename="{filename}"'.encode())
+            request.setHeader(b'ETag', b'"v1"')
+            return body
+
+    port = reactor.listenTCP(0, server.Site(Files()), interface='127.0.0.1')
+    base_url = f'http://127.0.0.1:{port.getHost().port}'
+    # the settings of a sync (disk threads, stream buffer and memory budget,
+    # concurrency), found before leaving the project directory
+    settings = get_project_settings().copy_to_dict()
+    settings['LOG_ENABLED'] = False
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)
+
+    crawler = get_crawler(BookDownloaderSpider, settings)
+    spider = BookDownloaderSpider.from_crawler(crawler, destination=directory)
+    crawler.stats.open_spider(spider)
+    handler = create_instance(StreamingDownloadHandler, crawler.settings, crawler)
+    subject = Subject.from_clean(name='subject', class_id='1')
+    limit = defer.DeferredSemaphore(crawler.settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN'))
+    measured = {}
+
+    @defer.inlineCallbacks
+    def download(i):
+        book = Book.from_clean(name=f'book {i}', download_url=f'/download?id={i}',
+                               filename=None, subject=subject)
+        request = spider.build_download_request(book)
+        request = request.replace(url=base_url + book['download_url'])
+        response = yield handler.download_request(request, spider)
+        # the file is committed and the state written once this fires
+        yield spider.handle_download(response, **request.cb_kwargs)
+
+    @defer.inlineCallbacks
+    def run():
+        started = time.perf_counter()
+        try:
+            yield defer.gatherResults([limit.run(download, i) for i in range(files)], consumeErrors=True)
+            measured['seconds'] = time.perf_counter() - started
+            measured['downloaded'] = len(os.listdir(os.path.join(directory, 'subject')))
+        finally:
+            yield handler.close()
+            shutil.rmtree(directory)
+            reactor.stop()
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+    return measured
+
+
+def run_download(files, size):
+    command = [sys.executable, '-m', 'benchmarks.suite', '--download-worker', str(files), str(size)]
+    env = dict(os.environ, SCRAPY_SETTINGS_MODULE='book_bot.settings')
+    output = subprocess.run(command, check=True, env=env, stdout=subprocess.PIPE).stdout
+    measured = json.loads(output.decode().strip().splitlines()[-1])
+    if measured.get('downloaded') != files:
+        raise RuntimeError(f'{files} files asked, {measured.get("downloaded")} downloaded.')
+    return result('download/handle_download', files, measured['seconds'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--files', type=int, nargs='+', default=[10, 1000])
+    parser.add_argument('--file-size-kb', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Writes the results as JSON to this file')
+    parser.add_argument('--baseline', help='Results of a previous run, to compare with')
+    parser.add_argument('--download-worker', nargs=2, type=int, help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+
+    if options.download_worker:
+        print(json.dumps(download_worker(*options.download_worker)))
+        return 0
+
+    baseline = {}
+    if options.baseline:
+        with open(options.baseline) as file:
+            baseline = {(r['case'], r['rows']): r['seconds'] for r in json.load(file)['results']}
+
+    results = []
+    print(f'{"case":<32} {"rows":>8} {"seconds":>10} {"us/row":>10} {"vs baseline":>12}')
+    measurements = [run_in_process(rows, options.repeat) for rows in options.rows]
+    measurements.append(run_download(files, options.file_size_kb * 1024) for files in options.files)
+    for measured in measurements:
+        for r in measured:
+            results.append(r)
+            before = baseline.get((r['case'], r['rows']))
+            change = f'{(r["seconds"] / before - 1) * 100:>+11.1f}%' if before else ''
+            print(f'{r["case"]:<32} {r["rows"]:>8} {r["seconds"]:>10.4f} {r["per_row_us"]:>10.2f} {change}')
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump({'python': platform.python_version(),
+                       'scrapy': scrapy.__version__,
+                       'platform': platform.platform(),
+                       'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                       'results': results}, file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import os
+import sys
+import signal
+import argparse
+
+
+# pid of the running sync, relative to the package like the state
+PID_FILE = os.path.join('.sync', 'book_bot.pid')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='book_bot')
+    commands = parser.add_subparsers(dest='command')
+
+    sync = commands.add_parser('sync', help='Synchronize all materials in a single process')
+    sync.add_argument('-k', dest='keep_online', action='store_true',
+                      help='Indicates wheter to keep account online')
+    sync.add_argument('-m', dest='max_run', action='store_true',
+                      help="Run max spider, don't need authentication")
+    sync.add_argument('-c', dest='clean', action='store_true',
+                      help='Removes old synchronize run')
+    sync.add_argument('-x', dest='auth_file',
+                      help='Specifies the file with username/password')
+    sync.add_argument('-d', dest='destination',
+                      help='Specifies the directory to sync [default: src/book_bot/downloads]')
+    sync.add_argument('-r', '--resume', dest='resume', action='store_true',
+                      help='Continues the last run where it was stopped')
+    sync.add_argument('--profile', dest='profile', choices=('cpu', 'mem'),
+                      help='Profiles the callbacks of every phase, see PROFILE_DIR')
+
+    batch = commands.add_parser('batch', help='Synchronize many EVA accounts at once in a single process')
+    batch.add_argument('accounts',
+                       help='File with one account per line: AUTH_FILE DESTINATION_DIR')
+    batch.add_argument('-k', dest='keep_online', action='store_true',
+                       help='Indicates wheter to keep the accounts online')
+    batch.add_argument('-c', dest='clean', action='store_true',
+                       help='Removes old synchronize run of each account')
+    batch.add_argument('-r', '--resume', dest='resume', action='store_true',
+                       help='Continues the last run of each account where it was stopped')
+    batch.add_argument('--profile', dest='profile', choices=('cpu', 'mem'),
+                       help='Profiles the callbacks of every phase of each account')
+
+    commands.add_parser('stop', help='Stops the running synchronization, keeping its progress')
+    return parser
+
+
+def _absolute(path):
+    return os.path.abspath(path) if path else path
+
+
+def _package_settings():
+    from scrapy.utils.log import configure_logging
+    from scrapy.utils.project import get_project_settings
+
+    # spiders keep their state relative to the package, as sync.sh did
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    settings = get_project_settings()
+    configure_logging(settings)
+    return settings
+
+
+def _run(runner):
+    from twisted.internet import reactor
+    from scrapy.utils.ossignal import install_shutdown_handlers, signal_names
+    failures = []
+
+    def start():
+        d = runner.run()
+        d.addErrback(failures.append)
+        d.addBoth(lambda _: reactor.stop())
+
+    def stop(signum, _):
+        # as scrapy crawl does: the first signal stops gracefully, the next one kills
+        print(f'{signal_names[signum]} received, stopping gracefully; send it again to force',
+              file=sys.stderr)
+        install_shutdown_handlers(kill)
+        reactor.callFromThread(runner.stop)
+
+    def kill(signum, _):
+        reactor.callFromThread(reactor.stop)
+
+    install_shutdown_handlers(stop)
+    reactor.callWhenRunning(start)
+    _write_pid()
+    try:
+        reactor.run(installSignalHandlers=False)
+    finally:
+        _remove_pid()
+
+    print(runner.report(), file=sys.stderr)
+    return failures
+
+
+def _write_pid():
+    os.makedirs(os.path.dirname(PID_FILE), exist_ok=True)
+    with open(PID_FILE, 'w') as h:
+        h.write(f'{os.getpid()}\n')
+
+
+def _remove_pid():
+    if os.path.exists(PID_FILE):
+        os.remove(PID_FILE)
+
+
+def stop(options):
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        with open(PID_FILE, 'r') as h:
+            pid = int(h.read())
+        os.kill(pid, signal.SIGINT)
+    except (FileNotFoundError, ProcessLookupError):
+        print('no synchronization running', file=sys.stderr)
+        return 1
+    print(f'stopping synchronization {pid}, resume it with --resume', file=sys.stderr)
+    return 0
+
+
+def sync(options):
+    from book_bot.runner import SyncRunner
+
+    auth_file, destination = _absolute(options.auth_file), _absolute(options.destination)
+    runner = SyncRunner(_package_settings(),
+                        keep_online=options.keep_online,
+                        max_run=options.max_run,
+                        clean=options.clean,
+                        auth_file=auth_file,
+                        destination=destination,
+                        resume=options.resume,
+                        profile=options.profile)
+    failures = _run(runner)
+    for failure in failures:
+        failure.printTraceback()
+    return 1 if failures else 0
+
+
+def batch(options):
+    from book_bot.accounts import load_accounts
+    from book_bot.runner import BatchRunner
+
+    accounts = load_accounts(options.accounts)
+    runner = BatchRunner(_package_settings(), accounts,
+                         keep_online=options.keep_online,
+                         clean=options.clean,
+                         resume=options.resume,
+                         profile=options.profile)
+    failures = _run(runner)
+    for account, failure in runner.failures:
+        print(f'account {account} failed:', file=sys.stderr)
+        failure.printTraceback()
+    for failure in failures:
+        failure.printTraceback()
+    return 1 if failures or runner.failures else 0
+
+
+def main(argv=None):
+    os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'book_bot.settings')
+    options = build_parser().parse_args(argv)
+    if options.command == 'sync':
+        return sync(options)
+    if options.command == 'batch':
+        return batch(options)
+    if options.command == 'stop':
+        return stop(options)
+    build_parser().print_usage(sys.stderr)
+    return 128
+
+
+if __name__ == '__main__':
+    sys.exit(main())
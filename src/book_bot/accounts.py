@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+# Accounts synced together in a single process
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#multiple-cookie-sessions-per-spider
+import os
+import re
+from dataclasses import dataclass
+
+
+@dataclass
+class Account:
+    name: str
+    auth_file: str
+    destination: str
+
+
+def account_name(auth_file):
+    """Name of the account of `auth_file`: its username, safe as a file name."""
+    with open(auth_file, 'r') as h:
+        username = h.readline().strip()
+    if not username:
+        raise ValueError(f'No username in {auth_file}.')
+    return re.sub(r'[^\w.-]', '_', username)
+
+
+def load_accounts(path):
+    """Reads the accounts of a batch file.
+
+    Each line holds the authentication file and the destination directory
+    of one account, separated by spaces. Blank lines and lines starting
+    with # are ignored, relative paths are relative to the batch file.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    accounts = []
+    with open(path, 'r') as h:
+        for number, line in enumerate(h, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split()
+            if len(fields) != 2:
+                raise ValueError(f'{path}:{number}: expected AUTH_FILE DESTINATION_DIR.')
+            auth_file, destination = (os.path.join(base, field) for field in fields)
+            accounts.append(Account(account_name(auth_file), auth_file, destination))
+
+    names = [account.name for account in accounts]
+    duplicated = {name for name in names if names.count(name) > 1}
+    if duplicated:
+        raise ValueError(f'Accounts listed more than once: {", ".join(sorted(duplicated))}.')
+    return accounts
+
+
+class AccountMiddleware:
+    """Sends the requests of a spider with the cookie jar of its account.
+
+    Spiders given an `account` argument get their requests the `cookiejar`
+    meta, so the sessions of accounts synced at once never mix.
+    """
+
+    def process_request(self, request, spider):
+        account = getattr(spider, 'account', None)
+        if account is not None:
+            request.meta.setdefault('cookiejar', account)
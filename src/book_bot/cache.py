@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+# Cache of listing pages, fresh for a time set per endpoint
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
+import time
+import posixpath
+
+from scrapy.extensions.httpcache import RFC2616Policy, rfc1123_to_epoch
+from scrapy.utils.httpobj import urlparse_cached
+
+from book_bot.login import detect_logout, is_page
+from book_bot.reauth import REAUTH_LOGIN
+
+
+def endpoint(request):
+    """Last segment of the path of `request`, like listaDisciplina.processa."""
+    return posixpath.basename(urlparse_cached(request).path)
+
+
+class ListingCachePolicy(RFC2616Policy):
+    """Caches only the pages of the endpoints in HTTPCACHE_ENDPOINT_TTLS.
+
+    EVA sends no freshness headers, so a page is fresh for the seconds set
+    to its endpoint since the server answered it. Once stale it is asked
+    again with its validators (ETag, Last-Modified), and a 304 keeps it.
+    File downloads, login and logout requests, and login pages are never
+    stored: the session of each account lives outside the cache, whose
+    directory is kept by `SyncRunner` apart for each account.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.ttls = settings.getdict('HTTPCACHE_ENDPOINT_TTLS')
+
+    def should_cache_request(self, request):
+        if self._ttl(request) is None:
+            return False
+        if 'download_part' in request.meta or request.meta.get(REAUTH_LOGIN):
+            return False
+        return super().should_cache_request(request)
+
+    def should_cache_response(self, response, request):
+        # only complete pages, as answered before any redirect
+        if response.status != 200 or not is_page(response):
+            return False
+        logged_out, _ = detect_logout(response, meta=request.meta)
+        return not logged_out
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        answered = rfc1123_to_epoch(cachedresponse.headers.get(b'Date'))
+        if answered and time.time() - answered < self._ttl(request):
+            return True
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+    def _ttl(self, request):
+        ttl = self.ttls.get(endpoint(request))
+        return None if ttl is None else float(ttl)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# Checkpoints of the spiders progress, so interrupted syncs can be resumed
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/jobs.html
+import os
+import functools
+
+from twisted.internet import task
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.job import job_dir
+
+
+# finish reason of spiders stopped by `SyncRunner.stop`, their queue is in JOBDIR
+SHUTDOWN = 'shutdown'
+FINISHED = 'finished'
+
+# urls scheduled by a checkpointed spider, kept in its JOBDIR
+SCHEDULED_FILE = 'requests.scheduled'
+
+# stats kept with each checkpoint
+PROGRESS_STATS = ('scheduler/enqueued', 'scheduler/dequeued', 'response_received_count',
+                  'item_scraped_count', 'download/avoided_count', 'download/deferred_count',
+                  'downloader/response_bytes')
+
+
+def scheduled_urls(jobdir):
+    path = os.path.join(jobdir, SCHEDULED_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as h:
+        return {line.rstrip('\n') for line in h}
+
+
+def queue_requests(generate):
+    """Decorates the method generating the requests of a checkpointed spider.
+
+    Once it has generated them all the phase is recorded as queued. Spiders
+    resumed from their JOBDIR (`resume` argument) find there the requests
+    not done yet, and only generate the ones the stopped run did not get
+    to schedule.
+    """
+    @functools.wraps(generate)
+    def wrapper(spider, *args, **kwargs):
+        scheduled = set()
+        if spider.resume:
+            phase = spider.state.phases().get(spider.name)
+            if phase and phase['queued']:
+                spider.logger.info('resuming the requests kept in the job directory')
+                return
+            scheduled = scheduled_urls(job_dir(spider.settings))
+            spider.logger.info('resuming, %d requests were scheduled already', len(scheduled))
+        for request in generate(spider, *args, **kwargs):
+            if request.url not in scheduled:  # the others are done, or in the queue
+                yield request
+        spider.state.phase_queued(spider.name)
+    return wrapper
+
+
+class CheckpointExtension:
+    """Records the progress of checkpointed spiders in their `SyncState`.
+
+    Each spider with `checkpointed` is a phase, whose status and the
+    PROGRESS_STATS are written every CHECKPOINT_INTERVAL seconds and when
+    it closes, together with the reason: SHUTDOWN when stopped, which
+    `SyncRunner` resumes later, or FINISHED. With a JOBDIR, the url of
+    every request scheduled is kept there too, see `queue_requests`.
+    """
+
+    def __init__(self, crawler, interval):
+        self.crawler = crawler
+        self.interval = interval
+        self.loop = None
+        self.scheduled = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        interval = crawler.settings.getfloat('CHECKPOINT_INTERVAL')
+        if not interval:
+            raise NotConfigured
+        extension = cls(crawler, interval)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.request_scheduled, signal=signals.request_scheduled)
+        return extension
+
+    def spider_opened(self, spider):
+        if not getattr(spider, 'checkpointed', False):
+            return
+        # a resumed phase keeps when it first started, see SyncRunner
+        resumed = spider.resume or getattr(spider, 'synced_since', None) is not None
+        spider.state.start_phase(spider.name, resumed=resumed)
+        self.loop = task.LoopingCall(self.checkpoint, spider)
+        self.loop.start(self.interval, now=False)
+        jobdir = job_dir(self.crawler.settings)
+        if jobdir:
+            self.scheduled = open(os.path.join(jobdir, SCHEDULED_FILE), 'a')
+
+    def request_scheduled(self, request, spider):
+        if self.scheduled is not None:
+            self.scheduled.write(request.url + '\n')
+
+    def checkpoint(self, spider, status=None):
+        spider.state.checkpoint_phase(spider.name, self._progress(), status=status)
+
+    def spider_closed(self, spider, reason):
+        if self.loop is None:
+            return
+        if self.loop.running:
+            self.loop.stop()
+        if self.scheduled is not None:
+            self.scheduled.close()
+        self.checkpoint(spider, status=reason)
+        spider.state.flush()
+        spider.logger.info('checkpoint of %s: %s', spider.name, reason)
+
+    def _progress(self):
+        stats = self.crawler.stats
+        values = {key: stats.get_value(key) for key in PROGRESS_STATS}
+        return {key: value for key, value in values.items() if value is not None}
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# Cookie storages for scrapy-cookies
+#
+# See documentation in:
+# https://scrapy-cookies.readthedocs.io/en/latest/topics/storage.html
+from scrapy_cookies.storage import BaseStorage
+
+from book_bot.utils import cookie_store
+
+
+class SQLiteCookieStorage(BaseStorage):
+    """Keeps the cookie jars in a sqlite file, see `CookieStore`.
+
+    Each jar key (the `cookiejar` meta, the account of batch syncs) is a
+    namespace of the store. The store and its jars are shared by every
+    crawler of the process, so only the first one reads the session, and
+    each change is written as soon as a response sets it. Without
+    COOKIES_PERSISTENCE the store is kept in memory.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.path = cookie_store.store_path(settings)
+        self.store = None
+        self._used = set()
+
+    def open_spider(self, spider):
+        self.store = cookie_store.open_store(self.path)
+
+    def close_spider(self, spider):
+        for namespace in self._used:
+            self.store.touch(namespace)
+
+    def __getitem__(self, key):
+        namespace = cookie_store.namespace(key)
+        self._used.add(namespace)
+        return self.store.jar(namespace)
+
+    def __setitem__(self, key, jar):
+        self.store.save(cookie_store.namespace(key), jar)
+
+    def __delitem__(self, key):
+        self.store.delete(cookie_store.namespace(key))
+
+    def __iter__(self):
+        return iter(self.store.namespaces())
+
+    def __len__(self):
+        return len(self.store.namespaces())
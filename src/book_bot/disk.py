@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# Blocking file operations of downloads, run out of the reactor thread
+#
+# See documentation in:
+# https://docs.twistedmatrix.com/en/stable/core/howto/threading.html
+import time
+import threading
+from collections import deque
+
+from twisted.internet import defer, threads
+from twisted.python.threadpool import ThreadPool
+
+
+class DiskPool:
+    """Bounded pool of threads writing, creating and checking files.
+
+    The reactor thread only hands operations over, so networking goes on
+    while a slow disk (NFS, USB) is busy. Bytes handed over and not yet
+    written are `pending`: past `max_pending`, `ready` makes new transfers
+    wait, and writers stop reading their responses until the disk catches
+    up. With no threads every operation runs right away, in the caller.
+    """
+
+    def __init__(self, threads=0, max_pending=0):
+        self.threads = threads
+        self.max_pending = max_pending
+        self.pending = 0
+        self.operations = 0
+        self.busy_seconds = 0.0
+        self.waited_seconds = 0.0
+        self._pool = None
+        self._waiting = deque()
+        self._lock = threading.Lock()
+
+    def configure(self, threads, max_pending):
+        if self._pool is None:
+            self.threads = threads
+        self.max_pending = max_pending
+
+    @property
+    def congested(self):
+        return bool(self.max_pending) and self.pending >= self.max_pending
+
+    def run(self, fn, *args, size=0, **kwargs):
+        """Deferred result of `fn(*args, **kwargs)`, which writes `size` bytes."""
+        if not self.threads:
+            return defer.maybeDeferred(self._timed, fn, *args, **kwargs)
+        from twisted.internet import reactor
+
+        self.pending += size
+        d = threads.deferToThreadPool(reactor, self._start(), self._timed, fn, *args, **kwargs)
+
+        def done(result):
+            self.pending = max(self.pending - size, 0)
+            self._wake()
+            return result
+        return d.addBoth(done)
+
+    def ready(self):
+        """Fires once the pending bytes are below `max_pending`."""
+        if not self.congested and not self._waiting:
+            return defer.succeed(None)
+        d = defer.Deferred(self._waiting.remove)
+        d.addCallback(self._waited, time.monotonic())
+        self._waiting.append(d)
+        return d
+
+    def stop(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.stop()
+
+    def _timed(self, fn, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:  # workers finish at once
+                self.operations += 1
+                self.busy_seconds += time.monotonic() - started
+
+    def _start(self):
+        if self._pool is None:
+            from twisted.internet import reactor
+            self._pool = ThreadPool(minthreads=0, maxthreads=self.threads, name='book_bot.disk')
+            self._pool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', self.stop)
+        return self._pool
+
+    def _wake(self):
+        while self._waiting and not self.congested:
+            self._waiting.popleft().callback(None)
+
+    def _waited(self, result, since):
+        self.waited_seconds += time.monotonic() - since
+        return result
+
+
+# shared by every crawler of the process, like the connection pool; inline
+# until StreamingDownloadHandler configures it with DISK_THREADS
+pool = DiskPool()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+# Extraction of listing pages
+#
+# Expressions are compiled once, and every field of every row is read
+# straight from the lxml tree already parsed by the response selector.
+from lxml import etree
+
+
+def first_text(values, *processors):
+    """First non empty value, once processed and stripped.
+
+    Same result as the `field_normalizer` processors followed by a
+    `TakeFirst`, without their per value overhead.
+    """
+    for value in values:
+        value = str(value)
+        for processor in processors:
+            value = processor(value)
+        value = value.strip()
+        if value:
+            return value
+    return None
+
+
+class Listing:
+    """Rows of a listing page and the fields read from each one of them.
+
+    `fields` are (xpath, processors) pairs, relative to the row. Calling
+    it with a response returns a tuple of values for each row.
+    """
+
+    def __init__(self, rows, fields, skip=0):
+        self._rows = etree.XPath(rows)
+        self._fields = [(etree.XPath(xpath, smart_strings=False), processors)
+                        for xpath, processors in fields]
+        self._skip = skip
+
+    def rows(self, response):
+        return self._rows(response.selector.root)[self._skip:]
+
+    def __call__(self, response):
+        fields = self._fields
+        return [tuple(first_text(xpath(row), *processors) for xpath, processors in fields)
+                for row in self.rows(response)]
@@ -0,0 +1,625 @@
+# -*- coding: utf-8 -*-
+
+# Download handlers used by book_bot
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/settings.html#download-handlers
+import os
+import zlib
+from time import time
+from collections import OrderedDict, deque
+from urllib.parse import urldefrag
+
+from twisted.internet import defer, protocol
+from twisted.internet.error import TimeoutError
+from twisted.python.failure import Failure
+from twisted.web.client import Agent, ResponseDone, PartialDownloadError, readBody
+from twisted.web.http import PotentialDataLoss
+from twisted.web.http_headers import Headers as TxHeaders
+from twisted.web.iweb import UNKNOWN_LENGTH
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.python import to_bytes
+
+from book_bot import disk
+from book_bot.utils import os_files, http
+
+
+# connection pool shared by every crawler running in this process
+_shared_pool = None
+_pool_users = 0
+
+
+def hold_pool():
+    """Keeps the shared pool alive until the returned function is called.
+
+    The runner holds it, so connections opened by one phase are reused
+    by the next one instead of being closed along with its crawler.
+    """
+    global _pool_users
+    _pool_users += 1
+
+    def release():
+        pool = _shared_pool
+        if _drop_pool_user() and pool is not None:
+            return pool.closeCachedConnections()
+        return defer.succeed(None)
+    return release
+
+
+def _take_pool(default):
+    global _shared_pool, _pool_users
+    if _shared_pool is None:
+        _shared_pool = default
+    _pool_users += 1
+    return _shared_pool
+
+
+def _drop_pool_user():
+    """Returns True when the last user of the shared pool is gone."""
+    global _shared_pool, _pool_users
+    _pool_users = max(_pool_users - 1, 0)
+    if _pool_users:
+        return False
+    _shared_pool = None
+    return True
+
+
+class FairLimiter:
+    """Transfers in flight in the whole process, shared fairly by accounts.
+
+    Up to `limit` transfers run at once (0 disables it). Past that, each
+    account waits in its own queue, and freed places go to the queues in
+    turn, so an account with many files does not hold back the others.
+    """
+
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.active = 0
+        self._waiting = OrderedDict()
+
+    def acquire(self, account=None):
+        if not self.limit or (self.active < self.limit and not self._waiting):
+            self.active += 1
+            return defer.succeed(None)
+        d = defer.Deferred(lambda d: self._forget(account, d))
+        self._waiting.setdefault(account, deque()).append(d)
+        return d
+
+    def release(self):
+        self.active = max(self.active - 1, 0)
+        while self._waiting and self.active < self.limit:
+            account, queue = self._waiting.popitem(last=False)
+            d = queue.popleft()
+            if queue:  # back to the end of the line
+                self._waiting[account] = queue
+            self.active += 1
+            d.callback(None)
+
+    def _forget(self, account, d):
+        queue = self._waiting.get(account)
+        if queue is not None and d in queue:
+            queue.remove(d)
+            if not queue:
+                del self._waiting[account]
+
+
+_transfer_limiter = FairLimiter()
+
+
+class SharedPoolDownloadHandler(HTTP11DownloadHandler):
+    """HTTP(S) handler whose connection pool outlives its crawler.
+
+    Transfers of every crawler go through the same `FairLimiter`, bounded
+    by PROCESS_CONCURRENT_REQUESTS, whose accounts are the cookie jars of
+    the requests (the `cookiejar` meta).
+    """
+
+    def __init__(self, settings, *args, **kwargs):
+        super().__init__(settings, *args, **kwargs)
+        self._pool = _take_pool(self._pool)
+        _transfer_limiter.limit = settings.getint('PROCESS_CONCURRENT_REQUESTS')
+
+    def download_request(self, request, spider):
+        def transfer(_):
+            d = self._transfer(request, spider)
+            return d.addBoth(released)
+
+        def released(result):
+            _transfer_limiter.release()
+            return result
+
+        return _transfer_limiter.acquire(request.meta.get('cookiejar')).addCallback(transfer)
+
+    def _transfer(self, request, spider):
+        return super().download_request(request, spider)
+
+    def close(self):
+        if _drop_pool_user():
+            return super().close()
+        return defer.succeed(None)
+
+
+class MemoryBudget:
+    """Bytes of streamed bodies held in memory by the whole process.
+
+    Past `limit` (0 disables it) writers stop reading their responses,
+    `wait` fires once the bytes handed to the disk are written.
+    """
+
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.used = 0
+        self._waiting = deque()
+
+    @property
+    def exhausted(self):
+        return bool(self.limit) and self.used >= self.limit
+
+    def take(self, size):
+        self.used += size
+
+    def give(self, size):
+        self.used = max(self.used - size, 0)
+        while self._waiting and not self.exhausted:
+            self._waiting.popleft().callback(None)
+
+    def wait(self):
+        """Fires once the budget is not exhausted anymore."""
+        if not self.exhausted:
+            return defer.succeed(None)
+        d = defer.Deferred(self._waiting.remove)
+        self._waiting.append(d)
+        return d
+
+
+_memory_budget = MemoryBudget()
+
+# reasons for a writer to stop reading its response
+DISK = 'disk'
+MEMORY = 'memory'
+
+
+class _PartWriter(protocol.Protocol):
+    """Writes a response body to its part file as the chunks arrive.
+
+    Chunks are buffered up to `buffer_size` bytes, or less when the global
+    memory budget is exhausted, and handed to the disk pool, which runs
+    the operations of the part one after the other. A `decoder` undoes
+    the Content-Encoding of the body before it is buffered. While more than two
+    buffers wait for the disk, or the memory budget is exhausted, the
+    response is not read any further.
+    The part file is fsync'ed once complete. When the transfer fails, a
+    resumable part keeps what was received and any other one is removed.
+    """
+
+    def __init__(self, finished, part_path, expected_size, maxsize,
+                 buffer_size, idle_timeout, offset=0, resumable=False, 
+                 budget=_memory_budget, pool=None, decoder=None):
+        self.bytes_received = 0
+        self.bytes_stored = 0  # decoded, what the part file gets
+        self._finished = finished
+        self._part_path = part_path
+        self._expected_size = expected_size
+        self._maxsize = maxsize
+        self._buffer_size = buffer_size
+        self._idle_timeout = idle_timeout
+        self._offset = offset
+        self._resumable = resumable
+        self._budget = budget
+        self._disk = pool if pool is not None else disk.pool
+        self._decoder = decoder
+        self._buffer = []
+        self._buffered = 0
+        self._writing = 0
+        self._pauses = set()  # why the transport is paused: DISK, MEMORY
+        self._lost = False
+        self._file = None
+        self._io = defer.succeed(None)  # operations on the part, in order
+        self._idle_call = None
+        self._failure = None
+
+    def connectionMade(self):
+        if self._maxsize and self._offset + self._expected_size > self._maxsize:
+            return self._abort(defer.CancelledError(
+                f'Cancelling download of {self._part_path}: expected response size '
+                f'({self._offset + self._expected_size}) larger than download max size '
+                f'({self._maxsize}).'), resumable=False)
+
+        self._schedule(self._open)
+        if self._idle_timeout:
+            self._start_idle_timer()
+
+    def dataReceived(self, data):
+        if self._failure is not None:
+            return
+        self.bytes_received += len(data)
+        if self._maxsize and self._offset + self.bytes_received > self._maxsize:
+            return self._abort(defer.CancelledError(
+                f'Cancelling download of {self._part_path}: received size '
+                f'larger than download max size ({self._maxsize}).'), resumable=False)
+        if self._idle_call is not None:
+            self._idle_call.reset(self._idle_timeout)
+
+        if self._decoder is not None:
+            try:
+                data = self._decoder.decode(data)
+            except zlib.error as e:
+                return self._abort(IOError(f'Undecodable body of {self._part_path}: {e}'), resumable=False)
+        self._buffer_data(data)
+        if self._buffered >= self._buffer_size or self._budget.exhausted:
+            self._flush()
+        if self._budget.exhausted and MEMORY not in self._pauses:
+            self._pause(MEMORY)  # whatever this writer holds is on its way to disk
+            self._budget.wait().addCallback(self._resume, MEMORY)
+
+    def connectionLost(self, reason):
+        self._lost = True
+        if self._idle_call is not None and self._idle_call.active():
+            self._idle_call.cancel()
+
+        complete = self._failure is None and reason.check(ResponseDone, PotentialDataLoss)
+        if complete and self._decoder is not None:
+            self._buffer_data(self._decoder.flush())
+        if complete or self._resumable:
+            self._flush()  # everything received is kept for the next attempt
+        else:
+            self._budget.give(self._buffered)
+            self._buffer, self._buffered = [], 0
+        self._io.addCallback(self._close, bool(complete), reason)
+
+    def _buffer_data(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self.bytes_stored += len(data)
+        self._budget.take(len(data))
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        data, size = b''.join(self._buffer), self._buffered
+        self._buffer, self._buffered = [], 0
+        self._writing += size
+        self._schedule(self._write, data, size=size)
+        if DISK not in self._pauses and self._writing > 2 * self._buffer_size:
+            self._pause(DISK)  # the disk does not keep up, the server waits
+
+    def _schedule(self, operation, *args, size=0):
+        def run(_):
+            if self._failure is not None:
+                return None  # the part is given up, see _close
+            return self._disk.run(operation, *args, size=size)
+        self._io.addCallback(run)
+        self._io.addErrback(self._disk_failed)
+        if size:
+            self._io.addCallback(self._written, size)
+
+    def _written(self, _, size):
+        self._budget.give(size)
+        self._writing -= size
+        if DISK in self._pauses and self._writing <= self._buffer_size:
+            self._disk.ready().addCallback(self._resume, DISK)
+
+    def _pause(self, reason):
+        if not self._pauses:
+            self.transport.pauseProducing()
+        self._pauses.add(reason)
+
+    def _resume(self, _, reason):
+        if reason not in self._pauses:
+            return
+        self._pauses.discard(reason)
+        if not self._pauses and self._failure is None and not self._lost:
+            self.transport.resumeProducing()
+
+    def _disk_failed(self, failure):
+        if self._failure is None:
+            self._abort(failure, resumable=False)
+
+    def _close(self, _, complete, reason):
+        complete = complete and self._failure is None  # the last writes may have failed
+        d = self._disk.run(self._close_part, complete)
+        if complete:
+            d.addCallback(lambda _: self._offset + self.bytes_stored)
+        else:
+            d.addCallback(lambda _: Failure(self._failure) if self._failure is not None else reason)
+        d.chainDeferred(self._finished)
+
+    def _open(self):
+        os_files.maybe_create_dir(os.path.dirname(self._part_path))
+        if self._offset:
+            self._file = open(self._part_path, 'r+b', buffering=0)
+            self._file.seek(self._offset)
+            self._file.truncate()
+        else:
+            self._file = open(self._part_path, 'wb', buffering=0)
+
+    def _write(self, data):
+        self._file.write(data)
+
+    def _close_part(self, complete):
+        if self._file is not None:
+            if complete:
+                os.fsync(self._file.fileno())
+            self._file.close()
+        if complete:
+            os_files.discard(os_files.part_info_path(self._part_path))
+        elif not self._resumable:
+            os_files.discard_part(self._part_path)
+
+    def _start_idle_timer(self):
+        from twisted.internet import reactor
+        self._idle_call = reactor.callLater(self._idle_timeout, self._idle)
+
+    def _idle(self):
+        if self._pauses:  # waiting for the disk or memory, not for the server
+            return self._start_idle_timer()
+        self._abort(TimeoutError(f'No data received for {self._idle_timeout} seconds.'))
+
+    def _abort(self, failure, resumable=True):
+        self._failure = failure
+        self._resumable = self._resumable and resumable
+        self.transport.stopProducing()
+
+
+class StreamingDownloadHandler(SharedPoolDownloadHandler):
+    """Streams the body of file downloads straight to disk.
+
+    Requests carrying a `download_part` meta have their body written to
+    that path while it arrives, so memory stays flat whatever the file
+    size. Their response has an empty body and the 'streamed' flag.
+    Pages (text/html) and non 2xx responses are still read in memory,
+    spiders must be able to parse them.
+
+    A part left by an interrupted transfer is resumed with a range
+    request, as long as its validator (ETag or Last-Modified) was known.
+    Servers ignoring the range, or whose file has changed, answer with
+    the full body, which then replaces the part.
+
+    When the request has a `download_destination` meta, the file name is
+    read from the headers and the transfer is cancelled right there if
+    that file already exists, as told by the `library` index of the
+    spider (the disk is only looked at without one). Its response gets
+    the 'skipped' flag.
+    Likewise, a full transfer at least as large as its
+    `download_defer_above` meta is cancelled with the 'deferred' flag.
+
+    File bodies are asked without Content-Encoding, the part is the file
+    itself and its size the offset to resume from. Bodies encoded anyway
+    are decoded while written, and are not resumed.
+
+    Files are touched only by the threads of the disk pool (DISK_THREADS).
+    While more than DISK_MAX_PENDING_BYTES wait to be written, new file
+    transfers wait too, holding their downloader slot.
+    """
+
+    def __init__(self, settings, *args, **kwargs):
+        super().__init__(settings, *args, **kwargs)
+        self._buffer_size = settings.getint('STREAM_BUFFER_SIZE')
+        self._default_timeout = settings.getfloat('DOWNLOAD_TIMEOUT')
+        _memory_budget.limit = settings.getint('STREAM_MEMORY_BUDGET')
+        disk.pool.configure(settings.getint('DISK_THREADS'), settings.getint('DISK_MAX_PENDING_BYTES'))
+
+    def _transfer(self, request, spider):
+        if 'download_part' not in request.meta:
+            return super()._transfer(request, spider)
+        maxsize = getattr(spider, 'download_maxsize', self._default_maxsize)
+        d = disk.pool.ready()
+        maxsize = request.meta.get('download_maxsize', maxsize)
+        d.addCallback(lambda _: self._stream(request, maxsize, spider))
+        return d
+
+    def _stream(self, request, maxsize, spider):
+        d = disk.pool.run(self._resume_point, request.meta['download_part'])
+        return d.addCallback(self._request, request, maxsize, spider)
+
+    def _request(self, resume_point, request, maxsize, spider):
+        from twisted.internet import reactor
+
+        timeout = request.meta.get('download_timeout') or self._default_timeout
+        agent = Agent(reactor, 
+                      contextFactory=self._contextFactory,
+                      connectTimeout=timeout,
+                      pool=self._pool)
+        url = urldefrag(request.url)[0]
+        headers = TxHeaders(request.headers)
+        # Range offsets count bytes of the file, not of a compressed stream,
+        # and the body goes to disk as it is sent
+        headers.setRawHeaders(b'Accept-Encoding', [b'identity'])
+        offset, validator = resume_point
+        if offset:
+            headers.setRawHeaders(b'Range', [f'bytes={offset}-'.encode()])
+            headers.setRawHeaders(b'If-Range', [validator.encode('latin-1')])
+
+        started = time()
+        d = agent.request(to_bytes(request.method), 
+                          to_bytes(url, encoding='ascii'),
+                          headers, 
+                          None)
+        timeout_call = reactor.callLater(timeout, d.cancel)
+
+        def headers_received(result):
+            if timeout_call.active():
+                timeout_call.cancel()
+            elif isinstance(result, Failure):
+                raise TimeoutError(f'Getting {url} took longer than {timeout} seconds.')
+            request.meta['download_latency'] = time() - started
+            return result
+
+        d.addBoth(headers_received)
+        d.addCallback(self._read_body, request, url, maxsize, timeout, spider)
+        return d
+
+    @defer.inlineCallbacks
+    def _read_body(self, txresponse, request, url, maxsize, timeout, spider):
+        headers = Headers(txresponse.headers.getAllRawHeaders())
+        expected_size = txresponse.length if txresponse.length != UNKNOWN_LENGTH else -1
+        if expected_size >= 0:
+            headers[b'Content-Length'] = str(expected_size).encode()
+
+        def build_response(body, flags=None):
+            respcls = responsetypes.from_args(headers=headers, url=url)
+            return respcls(url=url, status=txresponse.code, headers=headers, 
+                           body=body, flags=flags, request=request)
+
+        part_path = request.meta['download_part']
+        if txresponse.code == 416:  # our part is no good for this file anymore
+            txresponse.deliverBody(_Discard())
+            yield disk.pool.run(os_files.discard_part, part_path)
+            return (yield self._stream(request, maxsize, spider))
+
+        if expected_size == 0:  # deliverBody hangs for responses without body
+            return build_response(b'')
+
+        if not self._should_stream(txresponse, headers):
+            d = readBody(txresponse)
+            d.addErrback(self._partial_body)
+            return build_response((yield d))
+
+        # the body waits until the file is known to be there or not
+        if (yield self._exists_already(request, build_response(b''), spider)):
+            txresponse.deliverBody(_Discard())
+            yield disk.pool.run(os_files.discard_part, part_path)
+            request.meta['download_avoided'] = max(expected_size, 0)
+            return build_response(b'', flags=['skipped'])
+
+        defer_above = request.meta.get('download_defer_above')
+        if defer_above and txresponse.code == 200 and expected_size >= defer_above:
+            # too large to go before the small ones, the spider queues it again
+            txresponse.deliverBody(_Discard())
+            request.meta['download_size'] = expected_size
+            return build_response(b'', flags=['deferred'])
+
+        # encoded anyway: decoded while written, its offsets are not the file's
+        encoding = (headers.get(b'Content-Encoding') or b'identity').strip().lower()
+        decoder = None
+        if encoding != b'identity':
+            if encoding not in _Decoder.encodings or txresponse.code == 206:
+                txresponse.deliverBody(_Discard())
+                yield disk.pool.run(os_files.discard_part, part_path)
+                raise IOError(f'Unexpected Content-Encoding {encoding!r} on {url}, part discarded.')
+            decoder = _Decoder(encoding)
+            del headers[b'Content-Encoding']
+
+        offset, validator = yield disk.pool.run(self._prepare_part, txresponse.code, headers,
+                                                url, part_path, decoder is None)
+        if offset is None:
+            txresponse.deliverBody(_Discard())
+            raise IOError(f'Unexpected Content-Range on {url}, part discarded.')
+
+        finished = defer.Deferred()
+        writer = _PartWriter(finished, part_path, expected_size, maxsize, 
+                             self._buffer_size, timeout, 
+                             offset=offset, resumable=bool(validator), decoder=decoder)
+        txresponse.deliverBody(writer)
+
+        size = yield finished
+        request.meta['download_size'] = size
+        request.meta['download_resumed_from'] = offset
+        return build_response(b'', flags=['streamed'])
+
+    def _should_stream(self, txresponse, headers):
+        content_type = headers.get(b'Content-Type') or b''
+        return txresponse.code in (200, 206) and not content_type.startswith(b'text/html')
+
+    @staticmethod
+    def _exists_already(request, response, spider):
+        destination = request.meta.get('download_destination')
+        if destination is None:
+            return defer.succeed(False)
+        try:
+            filename = http.parse_filename(response, default=request.meta.get('download_filename'))
+        except (FileNotFoundError, KeyError):
+            return defer.succeed(False)  # left for the spider to complain about
+        if not filename:
+            return defer.succeed(False)
+        path = os.path.join(destination, filename)
+        # walked once for the run and updated as files are committed
+        library = getattr(spider, 'library', None)
+        if library is not None and library.scanned:
+            return defer.succeed(path in library)
+        return disk.pool.run(os.path.exists, path)
+
+    @staticmethod
+    def _resume_point(part_path):
+        """Size of the part to be resumed and its validator, if any."""
+        info = os_files.load_part_info(part_path)
+        if info and os.path.exists(part_path):
+            return os.path.getsize(part_path), info['validator']
+        return 0, None
+
+    @classmethod
+    def _prepare_part(cls, status, headers, url, part_path, resumable=True):
+        """Offset the body starts at and validator, the part is ready for it."""
+        offset = cls._resume_offset(status, headers, part_path)
+        if offset is None:
+            os_files.discard_part(part_path)
+            return None, None
+        if not resumable:
+            os_files.discard(os_files.part_info_path(part_path))
+            return offset, None
+        validator = cls._validator(headers)
+        if validator:
+            os_files.dump_part_info(part_path, dict(url=url, validator=validator))
+        return offset, validator
+
+    @staticmethod
+    def _resume_offset(status, headers, part_path):
+        if status != 206:
+            return 0  # full body, whatever was asked
+        # Content-Range: bytes <start>-<end>/<total>
+        content_range = (headers.get(b'Content-Range') or b'').decode('latin-1')
+        try:
+            start = int(content_range.split()[1].split('-')[0])
+        except (IndexError, ValueError):
+            return None
+        size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        return start if start <= size else None
+
+    @staticmethod
+    def _validator(headers):
+        # weak etags can not be used on If-Range
+        etag = (headers.get(b'ETag') or b'').decode('latin-1')
+        if etag and not etag.startswith('W/'):
+            return etag
+        last_modified = headers.get(b'Last-Modified')
+        return last_modified.decode('latin-1') if last_modified else None
+
+    @staticmethod
+    def _partial_body(failure):
+        failure.trap(PartialDownloadError)
+        return failure.value.response
+
+
+class _Decoder:
+    """Decodes a gzip or deflate body as its chunks arrive."""
+
+    encodings = (b'gzip', b'x-gzip', b'deflate')
+
+    def __init__(self, encoding):
+        # gzip or zlib header; deflate without any is tried when that fails
+        self._zlib = zlib.decompressobj(zlib.MAX_WBITS | 32)
+        self._raw = encoding == b'deflate'
+        self._started = False
+
+    def decode(self, data):
+        try:
+            decoded = self._zlib.decompress(data)
+        except zlib.error:
+            if self._started or not self._raw:
+                raise
+            self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+            decoded = self._zlib.decompress(data)
+        self._started = True
+        return decoded
+
+    def flush(self):
+        return self._zlib.flush()
+
+
+class _Discard(protocol.Protocol):
+    """Drops the body of a response we are not interested in."""
+
+    def connectionMade(self):
+        self.transport.stopProducing()
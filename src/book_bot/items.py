@@ -5,13 +5,15 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 from urllib.parse import parse_qs
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 
 from scrapy.http import Response
 from scrapy.utils.url import urlparse
 from scrapy.loader.processors import MapCompose, TakeFirst
 from scrapy.selector.unified import Selector
 
+from book_bot.extraction import Listing
+
 
 def field_normalizer(*args):
     def parse_tree(argument):
@@ -21,9 +23,12 @@ def field_normalizer(*args):
     return MapCompose(first_when_list, parse_tree, str, *args, str.strip)
 
 
+_take_first = TakeFirst()
+
+
 def first_when_list(value):
     if isinstance(value, list):
-        return TakeFirst()(value)
+        return _take_first(value)
     return value
 
 
@@ -37,36 +42,51 @@ def maybe_getattr(cls, name, default=None):
     return default
 
 
+def passthrough(value):
+    return value
+
+
 class Item(dict):
-    __keys__ =  []
+    """Mapping of normalized fields, processed once when assigned.
+
+    Values extracted from html go through the `<key>_in` processor of
+    the field, or `__input_processor__`, and are stored as plain values.
+    Values known to be clean, like the ones kept in the sync state, are
+    loaded as they are with `from_clean`.
+    """
+    __slots__ = ()
+    __keys__ = []
     __input_processor__ = field_normalizer()
-    __output_processor__ = lambda cls, o: first_when_list(o)
+    __processors__ = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # resolved once per class, instead of on every assignment
+        cls.__processors__ = {key: maybe_getattr(cls, f'{key}_in', cls.__input_processor__)
+                              for key in cls.__keys__}
 
     def __init__(self, **kwargs):
         super().__init__()
         for key, value in kwargs.items():
             self.__setitem__(key, value)
 
-    def _get_processor(self, suffix, key, default):
-        processor = maybe_getattr(self, f'{key}{suffix}')
-        if processor is None:
-            processor = default
-        return processor
+    @classmethod
+    def from_clean(cls, **values):
+        invalid = values.keys() - cls.__processors__.keys()
+        if invalid:
+            raise KeyError(f'Invalid keys {sorted(invalid)}.')
+        item = cls()
+        dict.update(item, values)
+        return item
 
     def __setitem__(self, key, value):
-        if key in self.__keys__:
-            processor = self._get_processor('_in', key, self.__input_processor__)
-            super().__setitem__(key, processor(value))
-        else:
+        if key not in self.__processors__:
             raise KeyError(f'Invalid key {key}.')
-    
-    def __getitem__(self, key):
-        value = super().__getitem__(key)
-        processor = self._get_processor('_out', key, self.__output_processor__)
-        return processor(value)
+        super().__setitem__(key, first_when_list(self.__processors__[key](value)))
 
 
 class Subject(Item):
+    __slots__ = ()
     __keys__ = ['name', 'class_id']
 
     # custom processor for name
@@ -74,11 +94,20 @@ class Subject(Item):
 
 
 class Book(Item):
+    __slots__ = ()
     __keys__ = ['name', 'download_url', 'filename', 'subject']
     
-    subject_in = lambda cls, s: s # passthrough
+    subject_in = passthrough
     qs_file_arg = 'arquivo'
 
+    @classmethod
+    def from_listing(cls, name, download_url, subject):
+        """Builds the book of a listing row, whose values are already normalized."""
+        book = cls.from_clean(name=name, download_url=download_url, subject=subject)
+        if download_url:
+            book.set_filename()
+        return book
+
     def __setitem__(self, key, value):
         super().__setitem__(key, value)
         if key == 'download_url' and self['download_url']:
@@ -96,43 +125,45 @@ class Book(Item):
 
 @dataclass
 class SubjectLoader:
-    subjects: list = field(default_factory=list)
+    # (class_id, name) of each subject
+    listing = Listing("//div[@id='grad']/div[1]/div[1]/div[1]/div", [
+        ('.//a/@data-turma_id', ()),
+        ('.//p/text()', (parse_subject_name,)),
+    ])
 
     def get_tree(self, response: Response):
-        return response.xpath("//div[@id='grad']/div[1]/div[1]/div[1]/div")
+        return self.listing(response)
 
     @staticmethod
     def from_dict(data: dict):
-        return Subject(name=data['name'], class_id=data['class_id'])
+        return Subject.from_clean(name=data['name'], class_id=data['class_id'])
 
-    def __call__(self, index, subject_tree):
-        s = Subject()
-        s['class_id'] = subject_tree.xpath('.//a/@data-turma_id')
-        s['name'] = subject_tree.xpath('.//p/text()')
-        self.subjects.append(s)
-        return s['name']
+    def __call__(self, index, row):
+        class_id, name = row
+        return Subject.from_clean(class_id=class_id, name=name)
 
 
 @dataclass
 class BookLoader:
     subject: Subject
-    books: list = field(default_factory=list)
+
+    # (name, download_url) of each book
+    listing = Listing("//div[@id='insereEspaco']/div", [
+        ('.//small//text()', ()),
+        (".//a[@title='Download']/@href", ()),
+    ])
 
     def get_tree(self, response: Response):
-        return response.xpath("//div[@id='insereEspaco']/div")
+        return self.listing(response)
 
     @staticmethod
     def from_dict(data: dict):
         subject = SubjectLoader.from_dict(data['subject'])
-        return Book(name=data['name'], 
-                    download_url=data['download_url'], 
-                    filename=data['filename'],
-                    subject=subject)
-
-    def __call__(self, index, book_tree):
-        b = Book(subject=self.subject)
-        b['name'] = book_tree.xpath('.//small//text()')
-        b['download_url'] = book_tree.xpath(".//a[@title='Download']/@href")
-        self.books.append(b)
-        return b['name']
-    
\ No newline at end of file
+        return Book.from_clean(name=data['name'], 
+                               download_url=data['download_url'], 
+                               filename=data['filename'],
+                               subject=subject)
+
+    def __call__(self, index, row):
+        name, download_url = row
+        return Book.from_listing(name, download_url, self.subject)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Index of the files already in the destination directory
+#
+# See documentation in:
+# https://docs.python.org/3/library/os.html#os.scandir
+import os
+
+
+class Library:
+    """Size and modification time of each file under `root`.
+
+    One walk of the directory (os.scandir) builds the index, instead of a
+    check of each book, and it is kept in the sync state between runs:
+    comparing both shows the files deleted, changed or shrunk since then.
+    Files landing during the sync are added as they are committed, so the
+    spider decides what to skip without going back to the disk.
+
+    `walk` only reads the disk and runs in the disk pool, the rest touches
+    the state and belongs to the reactor thread. Spiders walk before their
+    first request; used before any walk, the index is built on first use.
+    """
+
+    def __init__(self, state, root):
+        self.state = state
+        self.root = os.path.abspath(root)
+        self.files = None
+        self.deleted = []
+        self.changed = []
+        self.shrunk = set()
+
+    @property
+    def scanned(self):
+        return self.files is not None
+
+    def walk(self):
+        """Files under the root, by path relative to it; part files are hidden."""
+        files = {}
+        directories = [self.root]
+        while directories:
+            directory = directories.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    directories.append(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files[os.path.relpath(entry.path, self.root)] = (stat.st_size, stat.st_mtime)
+        return files
+
+    def update(self, files):
+        """Index becomes the `files` walked, compared with the one of the last run."""
+        indexed = self.state.library(self.root)
+        self.deleted = sorted(set(indexed) - set(files))
+        self.changed = sorted(path for path, entry in files.items()
+                              if path in indexed and indexed[path] != entry)
+        self.shrunk = {path for path in self.changed if files[path][0] < indexed[path][0]}
+        self.files = files
+        self.state.replace_library(self.root, files)
+        return self
+
+    def scan(self):
+        return self.update(self.walk())
+
+    def get(self, path):
+        """Size and modification time of the file at `path`, when indexed."""
+        if not self.scanned:
+            self.scan()
+        return self.files.get(self._relative(path))
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def truncated(self, path, size=None):
+        """Whether the file at `path` lost bytes, or is smaller than the `size` downloaded."""
+        entry = self.get(path)
+        if entry is None:
+            return False
+        return self._relative(path) in self.shrunk or bool(size) and entry[0] < size
+
+    def add(self, path, stat):
+        """Indexes the file committed at `path`, whose `stat` was just taken."""
+        if not self.scanned:
+            self.scan()
+        relative = self._relative(path)
+        self.files[relative] = (stat.st_size, stat.st_mtime)
+        self.shrunk.discard(relative)
+        self.state.index_file(self.root, relative, stat.st_size, stat.st_mtime)
+
+    def _relative(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
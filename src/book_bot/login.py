@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+# Detection of responses telling the EVA session is gone
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
+import re
+import time
+
+from scrapy.exceptions import NotConfigured
+from scrapy.http import TextResponse
+
+
+# meta set by the middleware: whether the response is the login page
+LOGGED_OUT = 'logged_out'
+
+LOGIN_PAGE = 'eadv4/login/index.jsp'
+
+# fields of the login form, and the script sending users to the login page;
+# one pass over the body finds all of them
+_LOGIN_REDIRECT = LOGIN_PAGE.encode()
+_LOGIN_MARKS = re.compile(rb'id_login|id_senha|' + re.escape(_LOGIN_REDIRECT))
+_LOGIN_FORM = {b'id_login', b'id_senha'}
+
+
+def is_page(response):
+    """Whether `response` is an html page, file downloads never are."""
+    if 'streamed' in response.flags:  # the body went to a file
+        return False
+    content_type = response.headers.get('Content-Type')
+    if content_type is None:
+        return isinstance(response, TextResponse)
+    return content_type.split(b';', 1)[0].strip().lower() in (b'text/html', b'application/xhtml+xml')
+
+
+def detect_logout(response, max_bytes=None, meta=None):
+    """Whether `response` is the login page, looking at most `max_bytes` of its body.
+
+    `meta` is the one of its request, by default `response.meta`. Returns
+    the verdict and the number of bytes read to reach it.
+    """
+    meta = response.meta if meta is None else meta
+    redirect_urls = meta.get('redirect_urls', ())
+    if any(LOGIN_PAGE in url for url in (*redirect_urls, response.url)):
+        return True, 0
+
+    redirect_statuses = meta.get('redirect_reasons')
+    if redirect_statuses and redirect_statuses[-1] != 302:
+        return False, 0
+
+    body = response.body
+    end = len(body) if max_bytes is None else min(len(body), max_bytes)
+    found = set()
+    for mark in _LOGIN_MARKS.finditer(body, 0, end):
+        found.add(mark.group())
+        if _LOGIN_REDIRECT in found or _LOGIN_FORM <= found:
+            return True, mark.end()
+    return False, end
+
+
+class LoginDetectionMiddleware:
+    """Tells spiders whether each page is the login page, see `check_login`.
+
+    Only html pages are looked at, whatever the request, and only their
+    first LOGIN_DETECTION_MAX_BYTES, since the login form comes early.
+    Files are never read, so downloads cost nothing.
+    The verdict is kept in the LOGGED_OUT meta, the time and bytes spent
+    reaching it in the login_detection/* stats.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('LOGIN_DETECTION_ENABLED'):
+            raise NotConfigured
+        self.stats = crawler.stats
+        self.max_bytes = settings.getint('LOGIN_DETECTION_MAX_BYTES') or None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_response(self, request, response, spider):
+        if not is_page(response):
+            self.stats.inc_value('login_detection/skipped')
+            return response
+
+        started = time.perf_counter()
+        logged_out, scanned = detect_logout(response, self.max_bytes, request.meta)
+        elapsed = time.perf_counter() - started
+        request.meta[LOGGED_OUT] = logged_out
+
+        self.stats.inc_value('login_detection/checked')
+        self.stats.inc_value('login_detection/bytes_scanned', scanned)
+        self.stats.inc_value('login_detection/seconds', elapsed, start=0.0)
+        self.stats.max_value('login_detection/max_seconds', elapsed)
+        if logged_out:
+            self.stats.inc_value('login_detection/logged_out')
+        return response
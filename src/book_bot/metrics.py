@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+# Metrics of each sync phase, exported as JSON and as a Prometheus textfile
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+import os
+import json
+import math
+import time
+from collections import Counter, defaultdict
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from book_bot.cache import endpoint
+from book_bot.throttle import DOWNLOAD, request_pool
+
+
+# sent by BookDownloaderSpider with the book and the spider
+book_skipped = object()
+book_downloaded = object()
+book_not_modified = object()
+book_failed = object()
+
+BOOK_RESULTS = {book_skipped: 'skipped', book_downloaded: 'downloaded',
+                book_not_modified: 'not_modified', book_failed: 'failed'}
+
+JSON_FILE = 'metrics.json'
+TEXTFILE = 'book_bot.prom'
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def percentile(values, quantile):
+    """Nearest-rank percentile of the sorted `values`."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(quantile * len(values)) - 1)]
+
+
+class MetricsExtension:
+    """Measures each phase, and writes the metrics of the run to METRICS_DIR.
+
+    Phases record their wall time, requests, bytes and latency percentiles
+    by endpoint (file downloads all count as `download`), the throughput
+    of the downloads and the books skipped, downloaded, not modified or
+    failed of each subject. When a phase closes it is merged into the
+    JSON_FILE of the directory, which `SyncRunner` empties when a run
+    starts, and the whole run is written again as a Prometheus textfile.
+    """
+
+    def __init__(self, crawler, directory):
+        self.crawler = crawler
+        self.directory = directory
+        self.account = crawler.settings.get('METRICS_ACCOUNT') or 'default'
+        self.started = None
+        self.requests = defaultdict(Counter)
+        self.latencies = defaultdict(list)
+        self.books = defaultdict(Counter)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        directory = crawler.settings.get('METRICS_DIR')
+        if not crawler.settings.getbool('METRICS_ENABLED') or not directory:
+            raise NotConfigured
+        extension = cls(crawler, directory)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        for signal in BOOK_RESULTS:
+            crawler.signals.connect(extension.book_result, signal=signal)
+        return extension
+
+    def spider_opened(self, spider):
+        self.started = time.monotonic()
+
+    def response_received(self, response, request, spider):
+        name = DOWNLOAD if request_pool(request) == DOWNLOAD else endpoint(request) or '/'
+        counters = self.requests[name]
+        counters['count'] += 1
+        if 'cached' in response.flags:
+            counters['cached'] += 1
+            return
+        # streamed bodies went to disk, their size is the one announced
+        size = request.meta.get('download_size', 0) if 'streamed' in response.flags else len(response.body)
+        counters['bytes'] += size
+        if 'download_latency' in request.meta:
+            self.latencies[name].append(request.meta['download_latency'])
+
+    def book_result(self, book, spider, signal=None):
+        self.books[book['subject']['name']][BOOK_RESULTS[signal]] += 1
+
+    def spider_closed(self, spider, reason):
+        seconds = time.monotonic() - self.started
+        path = os.path.join(self.directory, JSON_FILE)
+        run = self._load(path)
+        run['phases'][spider.name] = self._phase(seconds, reason)
+        run['updated_at'] = time.time()
+
+        os.makedirs(self.directory, exist_ok=True)
+        _write(path, json.dumps(run, indent=2, sort_keys=True))
+        _write(os.path.join(self.directory, TEXTFILE), textfile(run))
+
+    def _load(self, path):
+        try:
+            with open(path, 'r') as h:
+                run = json.load(h)
+        except (FileNotFoundError, ValueError):
+            run = {}
+        run.setdefault('phases', {})
+        run['account'] = self.account
+        return run
+
+    def _phase(self, seconds, reason):
+        endpoints = {}
+        for name, counters in self.requests.items():
+            latencies = sorted(self.latencies[name])
+            endpoints[name] = dict(counters, latency={
+                str(quantile): percentile(latencies, quantile) for quantile in QUANTILES},
+                latency_sum=sum(latencies), latency_count=len(latencies))
+        download_bytes = self.requests[DOWNLOAD]['bytes'] if DOWNLOAD in self.requests else 0
+        return {'seconds': seconds,
+                'finish_reason': reason,
+                'endpoints': endpoints,
+                'download_bytes_per_second': download_bytes / seconds if seconds else 0.0,
+                'subjects': {name: dict(counters) for name, counters in self.books.items()}}
+
+
+def textfile(run):
+    """The metrics of `run` in the Prometheus text format."""
+    samples = defaultdict(list)
+
+    def add(name, labels, value, suffix=''):
+        samples[name].append((suffix, labels, value))
+
+    for phase, metrics in sorted(run['phases'].items()):
+        labels = {'account': run['account'], 'phase': phase}
+        add('phase_seconds', labels, metrics['seconds'])
+        add('download_bytes_per_second', labels, metrics['download_bytes_per_second'])
+        for name, counters in sorted(metrics['endpoints'].items()):
+            endpoint_labels = dict(labels, endpoint=name)
+            add('requests_total', endpoint_labels, counters.get('count', 0))
+            add('cached_responses_total', endpoint_labels, counters.get('cached', 0))
+            add('response_bytes_total', endpoint_labels, counters.get('bytes', 0))
+            # a summary is its quantiles along with the sum and count observed
+            for quantile, latency in sorted(counters['latency'].items()):
+                if latency is not None:
+                    add('response_latency_seconds', dict(endpoint_labels, quantile=quantile), latency)
+            add('response_latency_seconds', endpoint_labels, counters.get('latency_sum', 0), '_sum')
+            add('response_latency_seconds', endpoint_labels, counters.get('latency_count', 0), '_count')
+        for subject, counters in sorted(metrics['subjects'].items()):
+            for result, count in sorted(counters.items()):
+                add('books_total', dict(labels, subject=subject, result=result), count)
+
+    lines = []
+    for name, (kind, help_text) in _METRICS.items():
+        lines.append(f'# HELP book_bot_{name} {help_text}')
+        lines.append(f'# TYPE book_bot_{name} {kind}')
+        for suffix, labels, value in samples[name]:
+            lines.append(f'book_bot_{name}{suffix}{{{_labels(labels)}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+_METRICS = {
+    'phase_seconds': ('gauge', 'Wall time of the phase in its last run.'),
+    'download_bytes_per_second': ('gauge', 'Bytes of files downloaded per second of the phase.'),
+    'requests_total': ('counter', 'Responses received, by endpoint.'),
+    'cached_responses_total': ('counter', 'Responses served by the listing cache, by endpoint.'),
+    'response_bytes_total': ('counter', 'Bytes received from the server, by endpoint.'),
+    'response_latency_seconds': ('summary', 'Seconds until the response was downloaded.'),
+    'books_total': ('counter', 'Books of each subject, by result of the sync.'),
+}
+
+
+def _labels(labels):
+    def escape(value):
+        return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+
+def _write(path, content):
+    # a collector reading the file never sees it half written
+    partial = path + '.tmp'
+    with open(partial, 'w') as h:
+        h.write(content)
+    os.replace(partial, path)
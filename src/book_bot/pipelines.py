@@ -4,8 +4,73 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+from collections import defaultdict
+
+from book_bot.items import Book
+from book_bot.utils.state import subject_key
+
+
+# sent by the book spiders with the subject whose listing was read in full
+subject_listed = object()
 
 
 class SubjectPipeline(object):
+    """Keeps each subject listed in the sync state as soon as it is parsed.
+
+    Only keys are kept in memory: once the spider closes, the subjects of
+    its kind missing from the listing are deleted, when there was one.
+    """
+
+    def open_spider(self, spider):
+        self.listed = []
+
     def process_item(self, item, spider):
+        if isinstance(item, Book):
+            return item
+        spider.state.add_subject(item, kind=spider.subject_kind, position=len(self.listed))
+        self.listed.append(subject_key(item))
         return item
+
+    def close_spider(self, spider):
+        if self.listed:
+            spider.state.prune_subjects(self.listed, kind=spider.subject_kind)
+
+
+class BookPipeline(object):
+    """Keeps each book listed in the sync state as soon as it is parsed.
+
+    Each listing replaces only the books of its own subject: once the
+    spider closes, the books missing from the subjects listed are deleted,
+    the subjects not listed (stopped sync, failed page) keep theirs. A
+    subject is listed once its spider sends `subject_listed`, so one whose
+    listing came back empty loses all its books.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls()
+        crawler.signals.connect(pipeline.listing_parsed, signal=subject_listed)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.listed = defaultdict(list)
+        self.subjects = {}
+
+    def listing_parsed(self, subject, spider):
+        key = subject_key(subject)
+        self.listed.setdefault(key, [])
+        self.subjects[key] = subject
+
+    def process_item(self, item, spider):
+        if not isinstance(item, Book) or not item.get('download_url'):
+            return item
+        key = subject_key(item['subject'])
+        urls = self.listed[key]
+        spider.state.add_book(item, position=len(urls))
+        urls.append(item['download_url'])
+        self.subjects[key] = item['subject']
+        return item
+
+    def close_spider(self, spider):
+        for key, urls in self.listed.items():
+            spider.state.prune_books(self.subjects[key], urls)
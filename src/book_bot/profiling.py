@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+# Profiling of spider callbacks and of the time the reactor is kept busy
+#
+# See documentation in:
+# https://docs.python.org/3/library/profile.html
+# https://docs.python.org/3/library/tracemalloc.html
+import io
+import os
+import time
+import pstats
+import inspect
+import cProfile
+import functools
+import tracemalloc
+from collections import defaultdict
+
+from twisted.internet import task
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.project import data_path
+
+
+CPU = 'cpu'
+MEM = 'mem'
+MODES = (CPU, MEM)
+
+# spiders profiling memory, tracemalloc is stopped once all of them closed,
+# unless it was already tracing before (PYTHONTRACEMALLOC, -X tracemalloc)
+_tracing = 0
+_started_tracing = False
+
+
+def profiled(fn):
+    """Measures a spider callback while its spider is profiled.
+
+    Generators are measured on each item they produce, since Scrapy runs
+    them lazily, long after the callback returned.
+    """
+    @functools.wraps(fn)
+    def wrapper(spider, *args, **kwargs):
+        profiler = getattr(spider, 'profiler', None)
+        if profiler is None:
+            return fn(spider, *args, **kwargs)
+        result = profiler.measure(fn.__name__, fn, spider, *args, **kwargs)
+        if inspect.isgenerator(result):  # Deferreds have a __next__ too
+            return profiler.measure_iteration(fn.__name__, result)
+        return result
+    return wrapper
+
+
+class CallbackStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.allocated = 0
+        self.profile = None
+
+    def add(self, seconds, allocated=0):
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.allocated += allocated
+
+
+class Profiler:
+    """Time of each callback, with cProfile (CPU) or tracemalloc (MEM).
+
+    Callbacks run in the reactor thread, their time is the time nothing
+    else happens. Only one callback runs at once, a nested one is counted
+    in the time of the outer one.
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.callbacks = defaultdict(CallbackStats)
+        self._active = False
+
+    def measure(self, name, fn, *args, **kwargs):
+        if self._active:
+            return fn(*args, **kwargs)
+        stats = self.callbacks[name]
+        if self.mode == CPU and stats.profile is None:
+            stats.profile = cProfile.Profile()
+
+        self._active = True
+        allocated = tracemalloc.get_traced_memory()[0] if self.mode == MEM else 0
+        started = time.perf_counter()
+        if self.mode == CPU:
+            stats.profile.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if self.mode == CPU:
+                stats.profile.disable()
+            elapsed = time.perf_counter() - started
+            if self.mode == MEM:
+                allocated = tracemalloc.get_traced_memory()[0] - allocated
+            stats.add(elapsed, allocated)
+            self._active = False
+
+    def measure_iteration(self, name, iterator):
+        while True:
+            try:
+                item = self.measure(name, next, iterator)
+            except StopIteration:
+                return
+            yield item
+
+    def report(self, top):
+        lines = [f'{"callback":<24} {"calls":>7} {"seconds":>10} {"max":>8} {"allocated":>12}']
+        ranked = sorted(self.callbacks.items(), key=lambda entry: entry[1].seconds, reverse=True)
+        for name, stats in ranked:
+            lines.append(f'{name:<24} {stats.calls:7d} {stats.seconds:10.3f} '
+                         f'{stats.max_seconds:8.3f} {stats.allocated:12d}')
+        for name, stats in ranked:
+            if stats.profile is not None:
+                output = io.StringIO()
+                pstats.Stats(stats.profile, stream=output).sort_stats('cumulative').print_stats(top)
+                lines.extend(['', f'--- {name}, by cumulative time', output.getvalue().strip()])
+        return '\n'.join(lines)
+
+
+class LagProbe:
+    """Delay of a call scheduled every `interval` seconds in the reactor.
+
+    A late call means the reactor thread was blocked, by callbacks, disk
+    writes or parsing, for the time it was late.
+    """
+
+    def __init__(self, interval, stall=0.1):
+        self.interval = interval
+        self.stall = stall
+        self.probes = 0
+        self.stalls = 0
+        self.blocked_seconds = 0.0
+        self.max_lag = 0.0
+        self._last = None
+        self._loop = task.LoopingCall(self._probe)
+
+    def start(self):
+        self._last = time.monotonic()
+        self._loop.start(self.interval, now=False)
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+    def _probe(self):
+        now = time.monotonic()
+        lag = max(0.0, now - self._last - self.interval)
+        self._last = now
+        self.probes += 1
+        self.max_lag = max(self.max_lag, lag)
+        if lag >= self.stall:
+            self.stalls += 1
+            self.blocked_seconds += lag
+
+    def report(self):
+        return (f'reactor: {self.probes} probes every {self.interval:.3f}s, '
+                f'{self.stalls} stalls over {self.stall:.3f}s blocking it {self.blocked_seconds:.3f}s, '
+                f'longest {self.max_lag:.3f}s')
+
+
+class ProfilingExtension:
+    """Profiles the spiders run with a `profile` argument (cpu or mem).
+
+    Callbacks decorated with `profiled` are measured, and the reactor is
+    probed every PROFILE_LAG_INTERVAL seconds. When the spider closes a
+    report is written to PROFILE_DIR, <spider>.txt, with the cProfile data
+    of each callback as <spider>.<callback>.prof (for pstats or snakeviz).
+    Only callbacks pay for cProfile, so it may be left on in production;
+    tracemalloc slows every allocation down, mem is more expensive.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.directory = settings.get('PROFILE_DIR')
+        if not self.directory:
+            raise NotConfigured
+        self.crawler = crawler
+        self.lag_interval = settings.getfloat('PROFILE_LAG_INTERVAL')
+        self.stall = settings.getfloat('PROFILE_STALL_SECONDS')
+        self.top = settings.getint('PROFILE_TOP')
+        self.profiler = None
+        self.probe = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls(crawler)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        mode = getattr(spider, 'profile', None) or self.crawler.settings.get('PROFILE')
+        if not mode:
+            return
+        if mode not in MODES:
+            spider.logger.error('unknown profile %r, use one of: %s', mode, ', '.join(MODES))
+            return
+        if mode == MEM:
+            _start_tracing()
+        self.profiler = spider.profiler = Profiler(mode)
+        self.probe = LagProbe(self.lag_interval, self.stall)
+        self.probe.start()
+
+    def spider_closed(self, spider):
+        if self.profiler is None:
+            return
+        self.probe.stop()
+        directory = data_path(self.directory, createdir=True)
+        sections = [f'{spider.name}, profile {self.profiler.mode}', self.probe.report(), '',
+                    self.profiler.report(self.top)]
+        if self.profiler.mode == MEM:
+            sections.extend(['', self._allocations()])
+            _stop_tracing()
+        with open(os.path.join(directory, f'{spider.name}.txt'), 'w') as h:
+            h.write('\n'.join(sections) + '\n')
+        for name, stats in self.profiler.callbacks.items():
+            if stats.profile is not None:
+                stats.profile.dump_stats(os.path.join(directory, f'{spider.name}.{name}.prof'))
+        spider.logger.info('profile of %s written to %s', spider.name, directory)
+
+    def _allocations(self):
+        # lines holding the most memory when the spider closed
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        lines = [f'--- top {self.top} allocations still held']
+        lines.extend(str(stat) for stat in snapshot.statistics('lineno')[:self.top])
+        return '\n'.join(lines)
+
+
+def _start_tracing():
+    global _tracing, _started_tracing
+    if not _tracing:
+        _started_tracing = not tracemalloc.is_tracing()
+        if _started_tracing:
+            tracemalloc.start()
+    _tracing += 1
+
+
+def _stop_tracing():
+    global _tracing, _started_tracing
+    _tracing -= 1
+    if not _tracing and _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
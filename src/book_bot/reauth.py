@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# Renewal of EVA sessions expired in the middle of a crawl
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
+import scrapy
+from twisted.internet import defer
+from scrapy.exceptions import NotConfigured
+
+from book_bot.login import LOGGED_OUT
+from book_bot.spiders.eva_auth import LoginSpider, get_credentials, session_cache
+from book_bot.utils import http
+
+
+# meta of the requests logging in again, never paused nor replayed
+REAUTH_LOGIN = 'reauth_login'
+# meta keeping the session a request was sent with
+SESSION_GENERATION = 'session_generation'
+
+# meta of a response, none of them belongs to the replayed request
+_RESPONSE_META = (LOGGED_OUT, SESSION_GENERATION, 'redirect_urls', 'redirect_times',
+                  'redirect_ttl', 'redirect_reasons', 'download_latency',
+                  'download_size', 'download_avoided', 'download_resumed_from')
+
+
+class ReauthMiddleware:
+    """Logs in again when the session expires, and replays what it refused.
+
+    The first login page seen (LOGGED_OUT meta, see `LoginDetectionMiddleware`)
+    pauses the requests of the spider, while the form of `LoginSpider` is
+    sent again with the credentials of EVA_AUTH_FILE. Then the paused
+    requests go on with the new session, and every request answered with
+    the login page is scheduled again, so nothing done so far is lost.
+    Requests sent with the old session are replayed without logging in
+    again. After REAUTH_MAX_LOGINS, or a refused login, login pages reach
+    the spider, whose `check_login` gives up as before.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.auth_file = settings.get('EVA_AUTH_FILE')
+        if not settings.getbool('REAUTH_ENABLED') or not self.auth_file:
+            raise NotConfigured  # credentials can not be asked in the middle of a crawl
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.max_logins = settings.getint('REAUTH_MAX_LOGINS')
+        self.logins = 0
+        self.generation = 0
+        self.renewing = False
+        self.waiting = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        if not self._applies(request, spider):
+            return None
+        if self.renewing:  # goes on once the new session is there
+            self.stats.inc_value('reauth/paused_count')
+            return self._wait().addCallback(lambda _: self.process_request(request, spider))
+        request.meta[SESSION_GENERATION] = self.generation
+        return None
+
+    def process_response(self, request, response, spider):
+        if not self._applies(request, spider) or not request.meta.get(LOGGED_OUT):
+            return response
+        if request.meta.get(SESSION_GENERATION, self.generation) < self.generation:
+            return self._replay(request, spider)  # its session was renewed already
+        if not self.renewing:
+            if self.logins >= self.max_logins:
+                return response
+            self._renew(spider)
+        return self._wait().addCallback(
+            lambda renewed: self._replay(request, spider) if renewed else response)
+
+    def _applies(self, request, spider):
+        return getattr(spider, 'reauthenticate', True) and not request.meta.get(REAUTH_LOGIN)
+
+    def _wait(self):
+        waiter = defer.Deferred()
+        self.waiting.append(waiter)
+        return waiter
+
+    @defer.inlineCallbacks
+    def _renew(self, spider):
+        spider.logger.info('session expired, logging in again')
+        self.renewing = True
+        self.logins += 1
+        self.stats.inc_value('reauth/login_count')
+        session = session_cache(spider)
+        if session is not None:
+            session.expired()
+
+        renewed = False
+        try:
+            renewed = yield self._login(spider)
+        except Exception as e:
+            spider.logger.error('login failed: %s', e)
+        if renewed:
+            spider.logger.info('logged in again')
+            self.generation += 1
+        else:  # wrong credentials do not get right by trying again
+            spider.logger.error('session could not be renewed, giving up')
+            self.stats.inc_value('reauth/failed_count')
+            self.logins = self.max_logins
+
+        self.renewing = False
+        waiting, self.waiting = self.waiting, []
+        for waiter in waiting:
+            waiter.callback(renewed)
+
+    @defer.inlineCallbacks
+    def _login(self, spider):
+        # the flow of LoginSpider: home page, and its form when logged out
+        logged_out = yield self._logged_out(http.web_open(), spider)
+        if not logged_out:
+            return True
+        username, password = get_credentials(file=self.auth_file)
+        formdata = {LoginSpider.username_arg: username, LoginSpider.password_arg: password}
+        logged_out = yield self._logged_out(http.web_open('/login.processa', formdata=formdata,
+                                                          impl=scrapy.FormRequest), spider)
+        return not logged_out
+
+    @defer.inlineCallbacks
+    def _logged_out(self, request, spider):
+        # straight to the downloader, the scheduler may be full of paused requests
+        request.meta[REAUTH_LOGIN] = True
+        result = yield self.crawler.engine.downloader.fetch(request, spider)
+        if isinstance(result, scrapy.Request):  # redirected
+            return (yield self._logged_out(result, spider))
+        return LoginSpider.auth_failed(result.replace(request=request))
+
+    def _replay(self, request, spider):
+        spider.logger.debug('replaying request: %s', request)
+        self.stats.inc_value('reauth/replayed_count')
+        meta = {key: value for key, value in request.meta.items() if key not in _RESPONSE_META}
+        # a redirect to the login page is replayed from where it started
+        url = request.meta.get('redirect_urls', [request.url])[0]
+        return request.replace(url=url, meta=meta, dont_filter=True)
@@ -0,0 +1,222 @@
+import os
+import time
+import shutil
+import logging
+
+from twisted.internet import defer
+from scrapy.crawler import Crawler, CrawlerRunner
+from scrapy.utils.project import data_path
+
+from book_bot import accounts, checkpoints, handlers, metrics
+from book_bot.utils import state, cookie_store
+from book_bot.spiders.eva_auth import LoginSpider, LogoutSpider
+from book_bot.spiders.eva_parser import SubjectSpider, BookSpider
+from book_bot.spiders.sync_spider import BookDownloaderSpider
+from book_bot.spiders.max_spider import MaxSubjectParser, MaxBookParser, MaxSyncDownloader
+
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = 'jobs'
+METRICS_DIR = 'metrics'
+PROFILE_DIR = 'profiles'
+
+# stats of the listing cache shown in the report
+CACHE_STATS = ('httpcache/hit', 'httpcache/miss', 'httpcache/revalidate')
+
+
+def _spider_args(**kwargs):
+    # unset arguments must not shadow the spiders defaults
+    return {key: value for key, value in kwargs.items() if value is not None}
+
+
+class SyncRunner:
+    """Runs every sync phase, one after another, inside a single reactor.
+
+    All phases share the same connection pool and cookie session, so only
+    the first one pays for the connection setup and cookie jar loading.
+    The session is kept in the cookie store (EVA_COOKIEJAR), under the
+    namespace of the account.
+
+    Checkpointed phases keep their queue in a JOBDIR, so `stop` leaves
+    them ready to be resumed: with `resume`, finished phases are skipped
+    and stopped ones continue from their queue.
+
+    Listing pages are cached in the directory of the account, the one of
+    the auth file when no account is given, `clean` drops them together
+    with the listings. Without an auth file the user is only known once
+    logged in, and EVA listings are not cached.
+    """
+
+    def __init__(self, settings, keep_online=False, max_run=False,
+                 clean=False, auth_file=None, destination=None, account=None, resume=False,
+                 profile=None):
+        self.settings = settings.copy()
+        self.keep_online = keep_online
+        self.max_run = max_run
+        self.clean = clean
+        self.auth_file = auth_file
+        self.destination = destination
+        self.account = account
+        self.resume = resume
+        self.profile = profile
+        self.timings = []
+        self.cache_stats = dict.fromkeys(CACHE_STATS, 0)
+        self.stopped = False
+        self._runner = None
+
+        self.cookiejar = data_path(os.environ.get('EVA_COOKIEJAR') or 'cookies.db')
+        self.settings.set('COOKIES_PERSISTENCE_DIR', self.cookiejar)
+        if auth_file:  # lets expired sessions be renewed without asking
+            self.settings.set('EVA_AUTH_FILE', auth_file)
+        # pages listed for an account are never served to another one
+        self.cache_dir = os.path.abspath(os.path.join(state.account_directory(self._cache_account()),
+                                                      self.settings.get('HTTPCACHE_DIR')))
+        self.settings.set('HTTPCACHE_DIR', self.cache_dir)
+        if not (self.max_run or self.account or self.auth_file):
+            self.settings.set('HTTPCACHE_ENABLED', False)
+        self.metrics_dir = os.path.abspath(os.path.join(state.account_directory(account), METRICS_DIR))
+        self.settings.set('METRICS_DIR', self.metrics_dir)
+        self.settings.set('METRICS_ACCOUNT', account)
+        self.settings.set('PROFILE_DIR', os.path.abspath(os.path.join(state.account_directory(account),
+                                                                      PROFILE_DIR)))
+
+    def _cache_account(self):
+        # Max pages are public, EVA ones belong to whoever logs in
+        if self.account or self.max_run or not self.auth_file:
+            return self.account
+        return accounts.account_name(self.auth_file)
+
+    def phases(self):
+        """Spider class and arguments of each phase, in execution order."""
+        if self.max_run:
+            phases = [(MaxSubjectParser, {}), (MaxBookParser, {})]
+            downloader = MaxSyncDownloader
+        else:
+            login_args = _spider_args(auth_file=self.auth_file)
+            phases = [(LoginSpider, login_args), (SubjectSpider, {}), (BookSpider, {})]
+            downloader = BookDownloaderSpider
+        phases.append((downloader, _spider_args(destination=self.destination)))
+        return [(spidercls, dict(kwargs, **self._common_args())) for spidercls, kwargs in phases]
+
+    def _common_args(self):
+        return _spider_args(account=self.account, profile=self.profile)
+
+    def should_logout(self):
+        return not (self.max_run or self.keep_online)
+
+    @defer.inlineCallbacks
+    def run(self):
+        runner = self._runner = CrawlerRunner(self.settings)
+        release_pool = handlers.hold_pool()
+        sync_state = state.open_state(state.account_directory(self.account))
+        try:
+            if not self.resume:
+                sync_state.clear_phases()
+                # a resumed run keeps the metrics of the phases done before the stop
+                shutil.rmtree(self.metrics_dir, ignore_errors=True)
+                if self.clean:
+                    # download validators are kept, they make the next sync incremental
+                    sync_state.clear_listing()
+                    shutil.rmtree(self.cache_dir, ignore_errors=True)
+            last_run = sync_state.phases()
+            for spidercls, kwargs in self.phases():
+                if self.stopped:
+                    break
+                record = last_run.get(spidercls.name)
+                if self.resume and record and record['status'] == checkpoints.FINISHED:
+                    logger.info('%s finished in the last run, skipped', spidercls.name)
+                    continue
+                yield self._crawl(runner, spidercls, dict(kwargs, **self._resume_args(spidercls, record)))
+        finally:
+            store = cookie_store.open_store(self.cookiejar)
+            namespace = cookie_store.namespace(self.account)
+            if self.should_logout():
+                yield self._crawl(runner, LogoutSpider, self._common_args())
+                store.delete(namespace)
+            else:
+                store.forget(namespace)  # later runs of this process read it again
+            yield release_pool()
+
+    def stop(self):
+        """Stops the running phase once its requests in progress are done, and the next ones."""
+        self.stopped = True
+        if self._runner is not None:
+            return self._runner.stop()
+        return defer.succeed(None)
+
+    def report(self):
+        lines = ['phase timings:']
+        for name, elapsed in self.timings:
+            lines.append(f'  {name:<22} {elapsed:8.2f}s')
+        total = sum(elapsed for _, elapsed in self.timings)
+        lines.append(f'  {"total":<22} {total:8.2f}s')
+        hits, misses, revalidated = (self.cache_stats[key] for key in CACHE_STATS)
+        lines.append(f'listing cache: {hits} hits, {revalidated} revalidated, {misses} misses')
+        lines.append(f'metrics: {os.path.join(self.metrics_dir, metrics.JSON_FILE)}')
+        return '\n'.join(lines)
+
+    def _jobdir(self, spidercls):
+        return os.path.join(state.account_directory(self.account), JOBS_DIR, spidercls.name)
+
+    def _resume_args(self, spidercls, record):
+        if not getattr(spidercls, 'checkpointed', False):
+            return {}
+        jobdir = self._jobdir(spidercls)
+        # only phases stopped gracefully left their queue and seen requests consistent
+        if (self.resume and record and record['status'] == checkpoints.SHUTDOWN
+                and os.path.isdir(jobdir)):
+            return {'resume': True}
+        shutil.rmtree(jobdir, ignore_errors=True)
+        if self.resume and record and hasattr(spidercls, 'synced_since'):
+            return {'synced_since': record['started_at']}  # requests made again, but not the synced ones
+        return {}
+
+    @defer.inlineCallbacks
+    def _crawl(self, runner, spidercls, kwargs):
+        settings = self.settings.copy()
+        if getattr(spidercls, 'checkpointed', False):
+            settings.set('JOBDIR', self._jobdir(spidercls))
+        crawler = Crawler(spidercls, settings)
+        started = time.monotonic()
+        try:
+            yield runner.crawl(crawler, **kwargs)
+        finally:
+            self.timings.append((spidercls.name, time.monotonic() - started))
+            if crawler.stats is not None:  # None when it failed to start
+                for key in CACHE_STATS:
+                    self.cache_stats[key] += crawler.stats.get_value(key, 0)
+
+
+class BatchRunner:
+    """Syncs many EVA accounts at once, inside a single reactor.
+
+    Each account runs its own `SyncRunner`, with its own cookie jar, state
+    and destination, while the connection pool and the process wide limit
+    of transfers (PROCESS_CONCURRENT_REQUESTS) are shared by all of them.
+    """
+
+    def __init__(self, settings, accounts, keep_online=False, clean=False, resume=False,
+                 profile=None):
+        self.runners = [SyncRunner(settings, keep_online=keep_online, clean=clean,
+                                   auth_file=account.auth_file,
+                                   destination=account.destination,
+                                   account=account.name,
+                                   resume=resume,
+                                   profile=profile)
+                        for account in accounts]
+        self.failures = []
+
+    @defer.inlineCallbacks
+    def run(self):
+        results = yield defer.DeferredList([runner.run() for runner in self.runners],
+                                           consumeErrors=True)
+        self.failures = [(runner.account, result)
+                         for runner, (success, result) in zip(self.runners, results) if not success]
+        return self.failures
+
+    def stop(self):
+        return defer.DeferredList([runner.stop() for runner in self.runners])
+
+    def report(self):
+        return '\n'.join(f'account {runner.account}, {runner.report()}' for runner in self.runners)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+# Order and priority of the downloads of a sync
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/request-response.html#request-objects
+from book_bot.utils.state import subject_key
+
+
+# priorities below every small file, large files go once those are done
+LARGE_PRIORITY = -10 ** 6
+
+
+def large_priority(size):
+    """Priority of a large file, the larger the later."""
+    return LARGE_PRIORITY - size.bit_length()
+
+
+def plan_downloads(books, large_size):
+    """Yields (book, priority) in the order the books should be downloaded.
+
+    Books are taken round-robin from each subject, so no subject waits
+    for all the files of another one. Each round starts with the most
+    recently seen subject, and each subject gives its smallest known
+    book first, unknown sizes counting as small. Books known to be at
+    least `large_size` bytes go after all the others, smallest first.
+    """
+    by_subject = {}
+    for position, book in enumerate(books):
+        by_subject.setdefault(subject_key(book['subject']), []).append((position, book))
+
+    # newest subjects first, then in listing order
+    recency = sorted(by_subject, key=lambda key: -(by_subject[key][0][1].get('subject_seen') or 0))
+    planned = []
+    for rank, key in enumerate(recency):
+        candidates = [(book.get('size') or 0, position, book) for position, book in by_subject[key]]
+        candidates.sort(key=lambda entry: entry[:2])
+        rounds = 0
+        for size, position, book in candidates:
+            if large_size and size >= large_size:
+                planned.append(((1, size, position), book, large_priority(size)))
+            else:
+                planned.append(((0, rounds, rank), book, -rounds))
+                rounds += 1
+
+    planned.sort(key=lambda entry: entry[0])
+    for _, book, priority in planned:
+        yield book, priority
@@ -23,6 +23,12 @@ ROBOTSTXT_OBEY = True
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
 CONCURRENT_REQUESTS = 32
+# Transfers in flight in the whole process, shared fairly by the accounts of
+# a batch sync (0 disables the limit)
+PROCESS_CONCURRENT_REQUESTS = 64
+
+# Number of book listings requested at once on the same host (BookSpider)
+BOOK_LISTING_CONCURRENCY = 8
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -52,26 +58,117 @@ DEFAULT_REQUEST_HEADERS = {
 #}
 
 COOKIES_PERSISTENCE=True
+# sessions kept in a sqlite file, one namespace per account, shared by every
+# spider of the process (see book_bot.runner)
+COOKIES_STORAGE = 'book_bot.cookies.SQLiteCookieStorage'
+COOKIES_PERSISTENCE_DIR = 'cookies.db'
+# Seconds a session cookie without expiry is trusted since last used
+COOKIES_SESSION_TTL = 30 * 60
+# Seconds a session accepted by EVA is trusted without checking it again
+SESSION_VALIDATION_TTL = 10 * 60
+
+# Reuse one connection pool between the crawlers of the same process, and
+# stream file downloads straight to disk
+DOWNLOAD_HANDLERS = {
+  'http': 'book_bot.handlers.StreamingDownloadHandler',
+  'https': 'book_bot.handlers.StreamingDownloadHandler',
+}
+
+# Bytes of each streamed file kept in memory before being written to disk
+STREAM_BUFFER_SIZE = 256 * 1024
+# Bytes of all streamed files kept in memory at once, past it transfers stop
+# reading until their buffers are written, 0 disables the limit
+STREAM_MEMORY_BUDGET = 64 * 1024 * 1024
+# Largest file accepted, larger downloads are cancelled (0 disables it)
+DOWNLOAD_MAXSIZE = 2 * 1024 * 1024 * 1024
+# Files from this size on are downloaded after all the smaller ones (0 disables it)
+DOWNLOAD_LARGE_FILE_SIZE = 64 * 1024 * 1024
+
+# Threads writing, creating and checking files, so a slow destination disk
+# does not stall the network (0 does it all in the reactor thread). Past
+# DISK_MAX_PENDING_BYTES waiting to be written, new file transfers wait too
+DISK_THREADS = 4
+DISK_MAX_PENDING_BYTES = 32 * 1024 * 1024
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
   #  'evaparse.middlewares.EvaparseDownloaderMiddleware': 543,
   'scrapy.downloadermiddlewares.cookies.CookiesMiddleware': None,
+  'book_bot.reauth.ReauthMiddleware': 570,
+  'book_bot.login.LoginDetectionMiddleware': 580,
+  # responses reach it after redirects and decompression, but before the login
+  # detection (580): ListingCachePolicy checks for the login page itself
+  'scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware': 585,
+  'book_bot.accounts.AccountMiddleware': 650,
   'scrapy_cookies.downloadermiddlewares.cookies.CookiesMiddleware': 700,
+  'book_bot.throttle.AdaptiveThrottleMiddleware': 950,
 }
 
+# Pages are checked for the login form once redirects are followed, only html
+# ones and only up to LOGIN_DETECTION_MAX_BYTES of them (see book_bot.login)
+LOGIN_DETECTION_ENABLED = True
+LOGIN_DETECTION_MAX_BYTES = 64 * 1024
+
+# Sessions expired in the middle of a crawl are renewed with the credentials
+# of EVA_AUTH_FILE (set by book_bot.runner), and the refused requests replayed
+REAUTH_ENABLED = True
+REAUTH_MAX_LOGINS = 3
+EVA_AUTH_FILE = None
+
+# Listings and downloads of each host have their own downloader slot, whose
+# concurrency adapts to the latency, errors and throughput observed. The
+# listing slot starts with BOOK_LISTING_CONCURRENCY.
+THROTTLE_ENABLED = True
+THROTTLE_MAX_LISTING_CONCURRENCY = 16
+THROTTLE_DOWNLOAD_CONCURRENCY = 8
+THROTTLE_MAX_DOWNLOAD_CONCURRENCY = 32
+# Seconds until the headers of a response, above it the slot slows down
+THROTTLE_LISTING_TARGET_LATENCY = 2.0
+THROTTLE_DOWNLOAD_TARGET_LATENCY = 5.0
+# Largest delay between the requests of a slot failing with 429/5xx
+THROTTLE_MAX_DELAY = 30.0
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-# EXTENSIONS = {
+EXTENSIONS = {
 #    'scrapy.extensions.telnet.TelnetConsole': None,
-# }
+    # spiders keep their state in book_bot.utils.state, not in a pickled dict
+    'scrapy.extensions.spiderstate.SpiderState': None,
+    'book_bot.checkpoints.CheckpointExtension': 500,
+    'book_bot.metrics.MetricsExtension': 510,
+    'book_bot.profiling.ProfilingExtension': 520,
+}
+
+# Seconds between two checkpoints of the progress of each phase. Listing and
+# download phases keep their queue in a JOBDIR of the account state directory,
+# so a sync stopped with `python3 -m book_bot stop` continues with --resume
+CHECKPOINT_INTERVAL = 30
+
+# Timings, requests, bytes and latencies of each phase, and the result of each
+# book, written as metrics.json and book_bot.prom (Prometheus textfile) into
+# METRICS_DIR, set by book_bot.runner to the account state directory
+METRICS_ENABLED = True
+METRICS_DIR = None
+
+# Spiders run with `-a profile=cpu|mem` (or `--profile` of python3 -m book_bot)
+# write a report of their callbacks to PROFILE_DIR (the account state
+# directory under book_bot.runner). The reactor is probed every
+# PROFILE_LAG_INTERVAL seconds, later than PROFILE_STALL_SECONDS is a stall
+#PROFILE = 'cpu'
+PROFILE_DIR = 'profiles'
+PROFILE_LAG_INTERVAL = 0.05
+PROFILE_STALL_SECONDS = 0.1
+# Functions listed by cumulative time for each callback, and allocations
+PROFILE_TOP = 25
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-# ITEM_PIPELINES = {
-#    'book_bot.pipelines.SubjectPipeline': 300,
-# }
+# Subjects and books parsed go to the sync state one by one, as they arrive
+ITEM_PIPELINES = {
+   'book_bot.pipelines.SubjectPipeline': 300,
+   'book_bot.pipelines.BookPipeline': 310,
+}
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -88,8 +185,19 @@ DOWNLOADER_MIDDLEWARES = {
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-#HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = 'httpcache'
+# Only listing pages are cached (see book_bot.cache), each account in its own
+# directory of the state (set by book_bot.runner)
+HTTPCACHE_ENABLED = True
+HTTPCACHE_POLICY = 'book_bot.cache.ListingCachePolicy'
+# Entries never expire in the storage, the policy tells whether they are fresh
+HTTPCACHE_EXPIRATION_SECS = 0
+HTTPCACHE_DIR = 'httpcache'
 #HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+# Seconds the page of each endpoint is fresh, then it is validated again
+# with its ETag/Last-Modified. Endpoints not listed are never cached.
+HTTPCACHE_ENDPOINT_TTLS = {
+  'listaDisciplina.processa': 24 * 60 * 60,
+  'listaMidiatecas.processa': 6 * 60 * 60,
+  'horario.htm': 24 * 60 * 60,
+}
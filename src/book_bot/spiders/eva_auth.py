@@ -1,19 +1,29 @@
 import getpass
+import functools
 
 import scrapy
 from book_bot.items import maybe_getattr
-from book_bot.utils import http, os_files
+from book_bot.login import LOGGED_OUT, detect_logout, is_page
+from book_bot.utils import http, os_files, cookie_store
 
 
 def check_login(fn):
+    @functools.wraps(fn)
     def wrapper(cls, response):
+        session = session_cache(cls)
         if LoginSpider.auth_failed(response):
+            if session is not None:
+                session.expired()
             raise AuthenticationException()
+        # a page from the listing cache says nothing of the session now
+        if session is not None and 'cached' not in response.flags:
+            session.validated()
         return fn(cls, response)
     return wrapper
 
 
 def interative_login(fn):
+    @functools.wraps(fn)
     def wrapper(cls, retry):
         def interative_wrapper(response):
             try:
@@ -37,6 +47,44 @@ def get_credentials(file=None, username=None):
     return username.strip(), password.strip()
 
 
+class SessionCache:
+    """When the session of a spider was last accepted by EVA, see `CookieStore`.
+
+    While that is more recent than SESSION_VALIDATION_TTL, and its cookies
+    are alive, spiders may skip requests made only to check the session.
+    """
+
+    def __init__(self, spider):
+        settings = spider.settings
+        self.store = cookie_store.open_store(cookie_store.store_path(settings))
+        self.namespace = cookie_store.namespace(getattr(spider, 'account', None))
+        self.validation_ttl = settings.getfloat('SESSION_VALIDATION_TTL')
+        self.session_ttl = settings.getfloat('COOKIES_SESSION_TTL')
+
+    def fresh(self):
+        return self.store.fresh(self.namespace, self.validation_ttl, self.session_ttl)
+
+    def validated(self):
+        self.store.validated(self.namespace)
+
+    def expired(self):
+        self.store.invalidate(self.namespace)
+
+
+def session_cache(spider):
+    """Session cache of `spider`, spiders out of a crawler have none."""
+    if getattr(spider, 'settings', None) is None:
+        return None
+    if getattr(spider, '_session_cache', None) is None:
+        spider._session_cache = SessionCache(spider)
+    return spider._session_cache
+
+
+def session_fresh(spider):
+    session = session_cache(spider)
+    return session is not None and session.fresh()
+
+
 class AuthenticationException(Exception):
     def __init__(self, message='User is not authenticated.', **kwargs):
         super().__init__(message, **kwargs)
@@ -48,14 +96,20 @@ class LoginSpider(scrapy.Spider):
 
     # Cli arguments
     authentication_file = 'auth_file'
+    # account synced, its session is kept in a cookie jar of its own
+    account = None
+
+    # logs in by itself, see book_bot.reauth
+    reauthenticate = False
 
     # Request information
     username_arg = 'id_login'
     password_arg = 'id_senha'
 
-    __auth_fake__ = False
-
     def start_requests(self):
+        if session_fresh(self):
+            self.logger.info('session still valid, login skipped')
+            return
         login_handler = self.after_login(self.retry_login)
         yield http.web_open(callback=login_handler)
 
@@ -86,28 +140,9 @@ class LoginSpider(scrapy.Spider):
 
     @staticmethod
     def auth_failed(response):
-        # fake authentication...bad?
-        if LoginSpider.__auth_fake__:
-            LoginSpider.__auth_fake__ = False
-            return False
-
-        body = response.body
-
-        # text is bytes-like object
-        user_key = LoginSpider.username_arg.encode()
-        pwd_key = LoginSpider.password_arg.encode()
-        has_ids = user_key in body and pwd_key in body
-        has_js_redirect = b'eadv4/login/index.jsp' in body
-
-        if 'redirect_reasons' in response.meta:
-            redirect_statuses = response.meta['redirect_reasons']
-            if redirect_statuses and redirect_statuses[-1] != 302:
-                return False
-        return has_ids or has_js_redirect
-    
-    @staticmethod
-    def fake_auth():
-        LoginSpider.__auth_fake__ = True
+        if LOGGED_OUT in response.meta:  # already seen by LoginDetectionMiddleware
+            return response.meta[LOGGED_OUT]
+        return is_page(response) and detect_logout(response)[0]
 
     def _build_creds(self, username, password, default_username=None):
         if not username and default_username:
@@ -132,6 +167,11 @@ class LogoutSpider(scrapy.Spider):
     name = 'logout_eva'
     allowed_domains = http.EVA_DOMAIN
 
+    # Cli arguments
+    account = None
+
+    reauthenticate = False
+
     def start_requests(self):
         yield http.web_open(callback=self.parse_home)
 
@@ -1,10 +1,12 @@
 from .eva_auth import LoginSpider, check_login
+from book_bot import checkpoints, pipelines, profiling
 from book_bot.items import SubjectLoader, BookLoader, maybe_getattr
-from book_bot.utils import http, os_files
+from book_bot.utils import http, state
 import scrapy
 
 
 def _display_and_load(spider, name, tree, callback):
+    """Yields the item `callback` loads from each row of `tree`, one by one."""
     tree_length = len(tree)
     assert tree_length, f'{name.capitalize()}(s) are empty.'
     
@@ -14,10 +16,11 @@ def _display_and_load(spider, name, tree, callback):
     listing = f'listing of {name}(s):\n'
     index = 0
     for item_tree in tree:
-        text = callback(index, item_tree)
-        if text:
+        item = callback(index, item_tree)
+        if item is not None:
             index += 1
-            listing += f'{index} - {text}\n'
+            listing += f'{index} - {item["name"]}\n'
+            yield item
     spider.logger.info(listing)
 
 
@@ -25,7 +28,15 @@ class SubjectSpider(scrapy.Spider):
     name = 'subject_parser'
     allowed_domains = http.EVA_DOMAIN
 
-    sync_file = 'subjects.json'
+    # Cli arguments
+    account = None
+    resume = False
+
+    # kind of subjects listed, see book_bot.utils.state
+    subject_kind = state.EVA
+
+    # progress recorded in the state, see book_bot.checkpoints
+    checkpointed = True
 
     subject_args = dict(turmaIdSessao=-1,
                         situacao="C",
@@ -37,60 +48,73 @@ class SubjectSpider(scrapy.Spider):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.subjects = os_files.load_sync_data(SubjectSpider.sync_file)
+        self.state = state.open_state(state.account_directory(self.account))
 
+    @checkpoints.queue_requests
     def start_requests(self):
         yield http.web_open('/listaDisciplina.processa',
                     args=SubjectSpider.subject_args, 
                     callback=self.parse_subjects)
 
+    @profiling.profiled
     @http.log_request
     @check_login
     def parse_subjects(self, response):
         loader = SubjectLoader()
-        _display_and_load(self, 'subject', loader.get_tree(response), loader)
-        self.logger.debug(loader.subjects)
-        self.subjects.extend(loader.subjects)
-
-    def closed(self, reason):
-        os_files.dump_sync_data(SubjectSpider.sync_file, self.subjects)
+        # kept in the state by SubjectPipeline
+        yield from _display_and_load(self, 'subject', loader.get_tree(response), loader)
 
 
 class BookSpider(scrapy.Spider):
     name = 'book_parser'
     allowed_domains = http.EVA_DOMAIN
 
-    sync_file = 'books.json'
+    # Cli arguments
+    account = None
+    resume = False
+
+    subject_kind = state.EVA
+
+    checkpointed = True
+
+    # Setting with the number of listings requested at once on each host
+    concurrency_setting = 'BOOK_LISTING_CONCURRENCY'
 
     book_args = dict(situacao=1,
                     tipoFiltro=0,
                     turmaAberta='true',
                     turmaFechada='false')
 
-    books = []
-    subjects_content = []
-
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.subjects_content = os_files.load_sync_data(SubjectSpider.sync_file)
+        self.state = state.open_state(state.account_directory(self.account))
+        self.subjects_content = self.state.subjects(kind=self.subject_kind)
 
-    def start_requests(self):
-        request = self.sync_next_subject()
-        if request is not None:
-            yield request 
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        concurrency = settings.getint(BookSpider.concurrency_setting)
+        if concurrency > 0:
+            settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', concurrency, priority='spider')
 
-    def sync_next_subject(self):
+    @checkpoints.queue_requests
+    def start_requests(self):
         self.logger.debug(self.subjects_content)
-        if self.subjects_content:
-            item = self.subjects_content.pop()
-            subject = SubjectLoader.from_dict(item)
-            self.logger.debug('reading subject: %s', subject['name'])
-            args = self._get_book_args(subject)
-            return http.web_open('/listaMidiatecas.processa', 
-                                meta={'subject': subject},
-                                args=args,
-                                callback=self.parse_books)
-
+        for item in self.subjects_content:
+            request = self.subject_request(item)
+            if request is not None:
+                yield request
+
+    def subject_request(self, item):
+        subject = SubjectLoader.from_dict(item)
+        self.logger.debug('reading subject: %s', subject['name'])
+        args = self._get_book_args(subject)
+        return http.web_open('/listaMidiatecas.processa', 
+                            meta={'subject': subject},
+                            args=args,
+                            callback=self.parse_books)
+
+    @profiling.profiled
     @http.log_request
     @check_login
     def parse_books(self, response):
@@ -98,18 +122,16 @@ class BookSpider(scrapy.Spider):
         subject = response.meta['subject']
         self.logger.debug('subject: %s', subject)
         loader = self.get_loader(subject)
-        _display_and_load(self, 'book', loader.get_tree(response), loader)
-        self.logger.debug(loader.books)
-        self.books.extend(loader.books)
-        return self.start_requests()
+        # kept in the state by BookPipeline, each listing replaces only the books of its subject
+        yield from _display_and_load(self, 'book', loader.get_tree(response), loader)
+        self.subject_listed(subject)
+
+    def subject_listed(self, subject):
+        # the books of `subject` missing from its listing are deleted, see BookPipeline
+        self.crawler.signals.send_catch_log(signal=pipelines.subject_listed, subject=subject, spider=self)
 
     def get_loader(self, subject):
         return BookLoader(subject=subject)
-
-    def closed(self, reason):
-        os_files.dump_sync_data(BookSpider.sync_file, self.books)
     
     def _get_book_args(self, subject_item):
-        new_args = BookSpider.book_args
-        new_args['turmaIdSessao'] = subject_item['class_id']
-        return new_args
\ No newline at end of file
+        return dict(BookSpider.book_args, turmaIdSessao=subject_item['class_id'])
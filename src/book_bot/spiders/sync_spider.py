@@ -1,10 +1,12 @@
 import os
+import time
 
 import scrapy
-from .eva_parser import BookSpider
-from .eva_auth import check_login
+from scrapy import signals
+from .eva_auth import check_login, session_fresh
+from book_bot import checkpoints, disk, library, metrics, profiling, scheduling
 from book_bot.items import BookLoader, maybe_getattr
-from book_bot.utils import os_files, http 
+from book_bot.utils import os_files, http, state
 
 
 class BookDownloaderSpider(scrapy.Spider):
@@ -13,25 +15,70 @@ class BookDownloaderSpider(scrapy.Spider):
 
     # Cli arguments
     destination_directory = 'destination'
+    account = None
+    resume = False
+    # time the stopped run started, what it synced since is not checked again
+    synced_since = None
+
+    subject_kind = state.EVA
+
+    # whether the host needs a session, checked before any download
+    requires_login = True
+
+    checkpointed = True
 
     custom_settings = {
         'CONCURRENT_REQUESTS': 100,
-        'SCHEDULER_PRIORITY_QUEUE': 'scrapy.pqueues.DownloaderAwarePriorityQueue'
+        'SCHEDULER_PRIORITY_QUEUE': 'scrapy.pqueues.DownloaderAwarePriorityQueue',
+        # downloads of the same priority keep the order of book_bot.scheduling
+        'SCHEDULER_MEMORY_QUEUE': 'scrapy.squeues.FifoMemoryQueue',
+        'SCHEDULER_DISK_QUEUE': 'scrapy.squeues.PickleFifoDiskQueue',
     }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.state = state.open_state(state.account_directory(self.account))
+        self.started = time.monotonic()
+        # files already in the destination, see index_library
+        self.library = library.Library(self.state, self._destination())
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.index_library, signal=signals.spider_opened)
+        return spider
+
+    def index_library(self, spider):
+        """Walks the destination in the disk pool, before any request is started.
+
+        The engine waits for the returned Deferred, so every book is
+        analyzed against the index, and the reactor never walks the disk.
+        """
+        return disk.pool.run(self.library.walk).addCallback(self._library_walked)
+
     def start_requests(self):
-        yield http.web_open(callback=self.synchronize)
+        if self.requires_login and not session_fresh(self):
+            yield http.web_open(callback=self.synchronize)
+        else:  # nothing to check, or checked a moment ago
+            yield from self.download_requests()
 
+    @profiling.profiled
     @check_login
     def synchronize(self, response):
-        content = self.load_books()
+        return self.download_requests()
+
+    @profiling.profiled
+    @checkpoints.queue_requests
+    def download_requests(self):
+        large_size = self.settings.getint('DOWNLOAD_LARGE_FILE_SIZE')
+        content = scheduling.plan_downloads(list(self.load_books()), large_size)
         def maybe_call_hook(method, args):
             self.logger.debug('looking for hook: %s', method)
             hook = maybe_getattr(self, method)
             if hook is not None:
                 hook(args)
 
-        for item in content:
+        for item, priority in content:
             book_item = self.dict_to_book(item)
             self.logger.debug('analyzing book: %s', book_item)
             result = self._analyze_candidate(book_item) 
@@ -42,37 +89,108 @@ class BookDownloaderSpider(scrapy.Spider):
             else:
                 self.logger.debug('downloading book: %s', book_item['name'])    
                 maybe_call_hook('book_to_download', book_item)
+                result.priority = priority
+                if large_size and item['size'] is None:  # its headers will tell whether it is large
+                    result.meta['download_defer_above'] = large_size
                 yield result
 
     def book_skipped(self, book):
-        self.logger.info('SKIP WAS CALLED')
-    
-    def book_to_download(self, book):
-        self.logger.info('WE ARE DOWNLOADING')
+        self._book_result(metrics.book_skipped, book)
 
+    @profiling.profiled
     @http.log_request
     def handle_download(self, response, book): 
+        if response.status == 304:
+            self.logger.info('book not modified: %s', book['name'])
+            self.state.mark_download(book['download_url'], 'not_modified')
+            self._book_result(metrics.book_not_modified, book)
+            self._download_finished()
+            d = disk.pool.run(os_files.discard_part, response.meta['download_part'])
+            return d.addCallback(lambda _: None)
+
         filename = http.parse_filename(response, default=book['filename'])
         dest_dir = self._get_book_path(book)
         file_path = os.path.join(dest_dir, filename)
+        part_path = response.meta['download_part']
+        if 'deferred' in response.flags:  # large file, it goes after the small ones
+            self.logger.info('book deferred, %d bytes: %s', response.meta['download_size'], book['name'])
+            self._remember_download(response, book, filename, status='deferred')
+            self.crawler.stats.inc_value('download/deferred_count', spider=self)
+            return self._requeue_large(response.request)
+
+        # next runs will know the file name, and ask only whether it changed
+        self._remember_download(response, book, filename)
+
+        if 'skipped' in response.flags:  # cancelled once the headers showed the file exists
+            self.logger.info('book already synced: %s', book['name'])
+            self.crawler.stats.inc_value('download/avoided_count', spider=self)
+            self.crawler.stats.inc_value('download/avoided_bytes', 
+                                         response.meta.get('download_avoided', 0), spider=self)
+            self._book_result(metrics.book_skipped, book)
+            self._download_finished()
+            return None
+
+        # check wheter file already exists, unless it has changed on server or locally
+        replace = response.meta.get('conditional') or response.meta.get('replace')
+        keep = file_path in self.library and not replace
+        # files are written by the disk pool, the callback goes on once it is done
+        d = disk.pool.run(self._store_file, response, dest_dir, file_path, part_path, keep,
+                          size=len(response.body))
+        return d.addCallback(self._stored, response, book, file_path)
+
+    def _store_file(self, response, dest_dir, file_path, part_path, keep):
+        if keep:
+            os_files.discard_part(part_path)
+            return None
+
+        if 'streamed' not in response.flags: # body was small enough to be kept in memory
+            os_files.maybe_create_dir(dest_dir)
+            http.download(part_path, response)
+        os_files.commit_file(part_path, file_path)
+        return os.stat(file_path)
 
-        if os.path.exists(file_path): # check wheter file already exists
+    def _stored(self, stat, response, book, file_path):
+        if stat is None:
+            self._book_result(metrics.book_skipped, book)
             return None
 
-        os_files.maybe_create_dir(dest_dir)
-        http.download(file_path, response)
+        self.library.add(file_path, stat)
+
         self.logger.info('book downloaded: %s', book['name'])
+        self._book_result(metrics.book_downloaded, book)
+        self._download_finished(useful=True)
+
+        resumed_from = response.meta.get('download_resumed_from', 0)
+        if resumed_from:
+            self.logger.info('book resumed, %d bytes saved: %s', resumed_from, book['name'])
+            self.crawler.stats.inc_value('download/resumed_count', spider=self)
+            self.crawler.stats.inc_value('download/resumed_bytes_saved', resumed_from, spider=self)
+
+    def download_failed(self, failure):
+        book = failure.request.cb_kwargs['book']
+        self.logger.error('book download failed: %s (%s)', book['name'], failure.value)
+        self._book_result(metrics.book_failed, book)
 
     def dict_to_book(self, data: dict):
         return BookLoader.from_dict(data)
 
     def build_download_request(self, book):
         return http.web_open(book['download_url'], 
+                        meta=self._download_meta(book),
                         cb_kwargs={'book': book},
-                        callback=self.handle_download)
+                        callback=self.handle_download,
+                        errback=self.download_failed)
+
+    def _download_meta(self, book):
+        # body is streamed to a part file, next to its final destination
+        part_path = os_files.part_path(self._get_book_path(book), book['download_url'])
+        # lets the handler cancel the transfer when the file already exists
+        return {'download_part': part_path,
+                'download_destination': self._get_book_path(book),
+                'download_filename': book['filename']}
 
     def load_books(self):
-        return os_files.load_sync_data(BookSpider.sync_file)
+        return self.state.books(kind=self.subject_kind)
 
     def _analyze_candidate(self, book_item):
         assert 'download_url' in book_item, 'Book has missing download url'
@@ -81,14 +199,83 @@ class BookDownloaderSpider(scrapy.Spider):
         if book_item['download_url'] is None:
             return None
 
+        record = self.state.download(book_item['download_url'])
+        if record and self.library.truncated(self._get_book_path(book_item, record['filename']),
+                                             record['content_length']):
+            self.logger.warning('book truncated locally, downloading it again: %s', book_item['name'])
+            self.crawler.stats.inc_value('library/truncated_count', spider=self)
+            return self._replace(self.build_download_request(book_item))
+        if record and self._get_book_path(book_item, record['filename']) in self.library:
+            if self.synced_since and record['updated_at'] >= float(self.synced_since) \
+                    and record['status'] in ('downloaded', 'not_modified'):
+                return None  # synced by the run being resumed
+            # already synced, only download it again when changed on server
+            return self._make_conditional(self.build_download_request(book_item), record)
+
         if book_item['filename'] is None:    # show alert and try to download    
             self.logger.error('any filename found on URL, maybe URL uses another strategy?')
             self.logger.debug('we will attempt to download it anyway...')
-        elif os.path.exists(self._get_book_path(book_item, book_item['filename'])):
+        elif self._get_book_path(book_item, book_item['filename']) in self.library:
             return None
     
         return self.build_download_request(book_item)
 
+    def _library_walked(self, files):
+        self.library.update(files)
+        self.crawler.stats.set_value('library/files', len(files), spider=self)
+        if self.library.deleted:
+            self.logger.warning('%d files were deleted from the destination since the last sync',
+                                len(self.library.deleted))
+            self.crawler.stats.set_value('library/deleted_count', len(self.library.deleted), spider=self)
+
+    def _replace(self, request):
+        # the local file is not worth keeping, not even when the server has it unchanged
+        request.meta['replace'] = True
+        request.meta.pop('download_destination', None)
+        return request
+
+    def _make_conditional(self, request, record):
+        if record.get('etag'):
+            request.headers['If-None-Match'] = record['etag']
+        if record.get('last_modified'):
+            request.headers['If-Modified-Since'] = record['last_modified']
+        if 'If-None-Match' not in request.headers and 'If-Modified-Since' not in request.headers:
+            return None  # nothing to validate with, keep the local file
+        request.meta['conditional'] = True
+        request.meta.pop('download_destination', None)  # the existing file must be replaced
+        request.meta['handle_httpstatus_list'] = [304]
+        return request
+
+    def _requeue_large(self, request):
+        meta = dict(request.meta)
+        meta.pop('download_defer_above')
+        size = meta.pop('download_size')
+        return request.replace(meta=meta, priority=scheduling.large_priority(size), dont_filter=True)
+
+    def _book_result(self, signal, book):
+        self.crawler.signals.send_catch_log(signal=signal, book=book, spider=self)
+
+    def _download_finished(self, useful=False):
+        # seconds since the spider started, until the first new file and the last download
+        elapsed = time.monotonic() - self.started
+        if useful and self.crawler.stats.get_value('download/first_file_seconds', spider=self) is None:
+            self.crawler.stats.set_value('download/first_file_seconds', elapsed, spider=self)
+        self.crawler.stats.set_value('download/completion_seconds', elapsed, spider=self)
+
+    def _remember_download(self, response, book, filename, status='downloaded'):
+        def header(name):
+            value = response.headers.get(name)
+            return value.decode('latin-1') if value else None
+
+        size = response.meta.get('download_size') or response.meta.get('download_avoided') \
+            or len(response.body)
+        self.state.record_download(book['download_url'],
+                                   filename=filename,
+                                   etag=header('ETag'),
+                                   last_modified=header('Last-Modified'),
+                                   content_length=size,
+                                   status=status)
+
     def _get_book_path(self, book_item, filename=''):
         return os.path.join(self._destination(), 
                             book_item['subject']['name'],
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+# Adaptive throttling of listing and download requests
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
+import time
+from urllib.parse import urlparse
+
+from scrapy import signals
+from scrapy.core.downloader import Slot
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+
+
+LISTING = 'listing'
+DOWNLOAD = 'download'
+
+# statuses telling the server is overloaded
+OVERLOAD_STATUSES = {429, 500, 502, 503, 504}
+
+
+def request_pool(request):
+    """Pool of a request: file downloads and every other page apart."""
+    return DOWNLOAD if 'download_part' in request.meta else LISTING
+
+
+class PoolController:
+    """Concurrency of one pool of one host, adjusted by AIMD.
+
+    Observations are evaluated in windows as large as the concurrency.
+    A window with many errors halves the concurrency, or backs off the
+    delay once at the minimum, a slow one takes one from it. Otherwise it
+    grows by one, unless it is a throughput bound pool whose last growth
+    brought no more throughput, which then gives that one back.
+    """
+
+    def __init__(self, concurrency, minimum=1, maximum=32, target_latency=2.0,
+                 max_delay=30.0, error_ratio=0.1, by_throughput=False):
+        self.concurrency = max(minimum, min(concurrency, maximum))
+        self.delay = 0.0
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.max_delay = max_delay
+        self.error_ratio = error_ratio
+        self.by_throughput = by_throughput
+        self.latency = None
+        self._reset_window()
+        self._last_throughput = None
+        self._grew = False
+
+    def observe(self, latency=None, error=False, size=0):
+        if latency is not None:
+            # moving average, a single slow response does not change much
+            self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+        self._count += 1
+        self._errors += error
+        self._bytes += size
+        if self._count >= max(self.concurrency, 4):
+            self._adjust()
+
+    def _adjust(self):
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        throughput = self._bytes / elapsed
+        grew, self._grew = self._grew, False
+
+        if self._errors > max(1, self.error_ratio * self._count):  # a lone error is no trend
+            if self.concurrency > self.minimum:
+                self.concurrency = max(self.minimum, self.concurrency // 2)
+            else:  # a delay serializes the slot, it is the last resort
+                self.delay = min(self.max_delay, max(self.delay * 2, 0.25))
+        elif self.latency is not None and self.latency > self.target_latency:
+            self.concurrency = max(self.minimum, self.concurrency - 1)
+        elif (self.by_throughput and grew and self._last_throughput
+              and throughput < self._last_throughput * 1.05):
+            self.concurrency = max(self.minimum, self.concurrency - 1)
+        else:
+            self.delay = self.delay / 2 if self.delay > 0.05 else 0.0
+            if self.concurrency < self.maximum:
+                self.concurrency += 1
+                self._grew = True
+        self._last_throughput = throughput
+        self._reset_window()
+
+    def _reset_window(self):
+        self._count = self._errors = self._bytes = 0
+        self._started = time.monotonic()
+
+
+class AdaptiveThrottleMiddleware:
+    """Separate downloader slots for listings and downloads of each host.
+
+    Each slot has its own `PoolController`, fed with the latency, status
+    and size of every response, which sets the slot concurrency and delay.
+    Small listing pages are not stuck behind large downloads any more,
+    and both back off when the host gets slow or starts failing.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('THROTTLE_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.controllers = {}
+        self.pool_settings = {
+            LISTING: dict(concurrency=settings.getint('BOOK_LISTING_CONCURRENCY'),
+                          maximum=settings.getint('THROTTLE_MAX_LISTING_CONCURRENCY'),
+                          target_latency=settings.getfloat('THROTTLE_LISTING_TARGET_LATENCY')),
+            DOWNLOAD: dict(concurrency=settings.getint('THROTTLE_DOWNLOAD_CONCURRENCY'),
+                           maximum=settings.getint('THROTTLE_MAX_DOWNLOAD_CONCURRENCY'),
+                           target_latency=settings.getfloat('THROTTLE_DOWNLOAD_TARGET_LATENCY'),
+                           by_throughput=True),
+        }
+        self.max_delay = settings.getfloat('THROTTLE_MAX_DELAY')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_request(self, request, spider):
+        pool = request_pool(request)
+        key = request.meta.setdefault('download_slot', f'{urlparse(request.url).hostname}/{pool}')
+        request.meta['throttle_pool'] = pool
+        request.meta['throttle_started'] = time.monotonic()
+        self._apply(key, self._controller(key, pool))
+
+    def process_response(self, request, response, spider):
+        # deferred and skipped downloads announce a size they did not transfer
+        size = request.meta.get('download_size', 0) if 'streamed' in response.flags else len(response.body)
+        self._observe(request, error=response.status in OVERLOAD_STATUSES, size=size)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if not isinstance(exception, IgnoreRequest):
+            self._observe(request, error=True)
+
+    def spider_closed(self, spider):
+        for key, controller in self.controllers.items():
+            spider.logger.debug('throttle %s: concurrency %d, delay %.2f',
+                                key, controller.concurrency, controller.delay)
+
+    def _observe(self, request, error, size=0):
+        if 'throttle_pool' not in request.meta:
+            return
+        key, pool = request.meta['download_slot'], request.meta['throttle_pool']
+        controller = self.controllers[key]
+        started = request.meta.get('throttle_started')
+        elapsed = time.monotonic() - started if started else None
+        controller.observe(latency=request.meta.get('download_latency', elapsed), error=error, size=size)
+        self._apply(key, controller)
+        if error:
+            self.stats.inc_value(f'throttle/{pool}/errors')
+        self.stats.max_value(f'throttle/{pool}/max_concurrency', controller.concurrency)
+        self.stats.set_value(f'throttle/{pool}/concurrency', controller.concurrency)
+
+    def _controller(self, key, pool):
+        if key not in self.controllers:
+            self.controllers[key] = PoolController(max_delay=self.max_delay, **self.pool_settings[pool])
+        return self.controllers[key]
+
+    def _apply(self, key, controller):
+        downloader = self.crawler.engine.downloader
+        slot = downloader.slots.get(key)
+        if slot is None:
+            # created here, so it starts with the pool concurrency
+            slot = downloader.slots[key] = Slot(controller.concurrency, controller.delay,
+                                                downloader.randomize_delay)
+        slot.concurrency = controller.concurrency
+        slot.delay = controller.delay
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+from http.cookiejar import Cookie
+
+from scrapy.http.cookies import CookieJar
+from scrapy.utils.project import data_path
+
+from book_bot.utils import os_files
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cookies (
+    namespace TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT,
+    expires INTEGER,
+    attributes TEXT NOT NULL,
+    PRIMARY KEY (namespace, domain, path, name)
+);
+CREATE INDEX IF NOT EXISTS cookies_by_expiry ON cookies (namespace, expires);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    namespace TEXT PRIMARY KEY,
+    used_at REAL NOT NULL,
+    validated_at REAL
+);
+'''
+
+# seconds between two writes of the same session validation
+VALIDATION_WRITE_INTERVAL = 30
+
+# cookie fields kept as json, the others have columns of their own
+_ATTRIBUTES = ('version', 'port', 'port_specified', 'domain_specified', 'domain_initial_dot',
+               'path_specified', 'secure', 'discard', 'comment', 'comment_url', 'rfc2109')
+
+_opened = {}
+
+
+def open_store(path):
+    """Returns the store kept in `path`, shared by the whole process."""
+    if path != ':memory:':
+        path = os.path.abspath(path)
+    if path not in _opened:
+        _opened[path] = CookieStore(path)
+    return _opened[path]
+
+
+def store_path(settings):
+    """Path of the store of the cookie storage configured by `settings`."""
+    if settings.getbool('COOKIES_PERSISTENCE'):
+        return data_path(settings['COOKIES_PERSISTENCE_DIR'])
+    return ':memory:'
+
+
+def namespace(key):
+    """Namespace of a cookie jar key, the `cookiejar` meta of requests."""
+    return '' if key is None else str(key)
+
+
+def _row(cookie):
+    attributes = {name: getattr(cookie, name) for name in _ATTRIBUTES}
+    attributes['rest'] = cookie._rest
+    return cookie.value, cookie.expires, json.dumps(attributes, sort_keys=True)
+
+
+def _cookie(row):
+    return Cookie(name=row['name'], value=row['value'], domain=row['domain'], path=row['path'],
+                  expires=row['expires'], **json.loads(row['attributes']))
+
+
+class CookieStore:
+    """Cookie jars of many accounts, kept in sqlite.
+
+    Each jar lives in a namespace, loaded once per process and written
+    back incrementally: saving a jar only touches the cookies that have
+    changed since it was last saved. Expired cookies are never loaded.
+    Every write is a transaction of its own, so crawlers of this and of
+    other processes can share the same file.
+
+    Sessions also record when the server last accepted them, so spiders
+    may skip asking it again while that is recent, see `fresh`.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self.jars = {}
+        self._saved = {}
+        self._validated = {}
+        try:
+            self.conn = self._connect()
+        except sqlite3.DatabaseError:
+            # jars pickled by scrapy-cookies, the session is lost anyway
+            logger.warning('%s is not a cookie store, moving it to %s.old', path, path)
+            os.replace(path, path + '.old')
+            self.conn = self._connect()
+
+    def _connect(self):
+        if self.path != ':memory:' and not os.path.exists(self.path):
+            os_files.maybe_create_dir(os.path.dirname(self.path))
+            # sessions are credentials, only the user may read them
+            os.close(os.open(self.path, os.O_CREAT | os.O_WRONLY, 0o600))
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA busy_timeout = 5000')
+        if self.path != ':memory:':
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+        conn.executescript(SCHEMA)
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(sessions)')}
+        if 'validated_at' not in columns:  # stores of older versions
+            conn.execute('ALTER TABLE sessions ADD COLUMN validated_at REAL')
+        return conn
+
+    def jar(self, namespace):
+        """Jar of `namespace`, read from the store on first use."""
+        if namespace not in self.jars:
+            now = int(time.time())
+            with self.conn:
+                self.conn.execute('BEGIN')
+                self.conn.execute('DELETE FROM cookies WHERE namespace = ? AND expires <= ?',
+                                  (namespace, now))
+                rows = self.conn.execute('SELECT * FROM cookies WHERE namespace = ?',
+                                         (namespace,)).fetchall()
+            jar = CookieJar()
+            for row in rows:
+                jar.set_cookie(_cookie(row))
+            self.jars[namespace] = jar
+            self._saved[namespace] = {(row['domain'], row['path'], row['name']):
+                                      (row['value'], row['expires'], row['attributes'])
+                                      for row in rows}
+        return self.jars[namespace]
+
+    def save(self, namespace, jar):
+        """Writes the cookies of `jar` which changed since the last save."""
+        self.jars[namespace] = jar
+        saved = self._saved.setdefault(namespace, {})
+        current = {(cookie.domain, cookie.path, cookie.name): _row(cookie) for cookie in jar}
+        changed = [(key, row) for key, row in current.items() if saved.get(key) != row]
+        removed = [key for key in saved if key not in current]
+        if not changed and not removed:
+            return
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany(
+                'INSERT INTO cookies (namespace, domain, path, name, value, expires, attributes) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (namespace, domain, path, name) DO UPDATE SET value = excluded.value, '
+                'expires = excluded.expires, attributes = excluded.attributes',
+                [(namespace, *key, *row) for key, row in changed])
+            self.conn.executemany(
+                'DELETE FROM cookies WHERE namespace = ? AND domain = ? AND path = ? AND name = ?',
+                [(namespace, *key) for key in removed])
+        self._saved[namespace] = current
+
+    def touch(self, namespace):
+        """Records that the session of `namespace` was just used."""
+        self.conn.execute(
+            'INSERT INTO sessions (namespace, used_at) VALUES (?, ?) '
+            'ON CONFLICT (namespace) DO UPDATE SET used_at = excluded.used_at',
+            (namespace, time.time()))
+
+    def alive(self, namespace, session_ttl):
+        """Whether `namespace` may still have a valid session, without asking the server.
+
+        Cookies with an expiry must not have expired. Session cookies have
+        none, they are trusted for `session_ttl` seconds since last used.
+        """
+        now = time.time()
+        row = self.conn.execute(
+            'SELECT 1 FROM cookies c LEFT JOIN sessions s ON s.namespace = c.namespace '
+            'WHERE c.namespace = ? AND (c.expires > ? OR (c.expires IS NULL AND s.used_at > ?)) '
+            'LIMIT 1', (namespace, now, now - session_ttl)).fetchone()
+        return row is not None
+
+    def validated(self, namespace):
+        """Records that the server has just accepted the session of `namespace`."""
+        now = time.time()
+        if now - self._validated.get(namespace, 0) < VALIDATION_WRITE_INTERVAL:
+            return
+        self.conn.execute(
+            'INSERT INTO sessions (namespace, used_at, validated_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (namespace) DO UPDATE SET used_at = excluded.used_at, '
+            'validated_at = excluded.validated_at', (namespace, now, now))
+        self._validated[namespace] = now
+
+    def invalidate(self, namespace):
+        """Records that the server has refused the session of `namespace`."""
+        self.conn.execute('UPDATE sessions SET validated_at = NULL WHERE namespace = ?', (namespace,))
+        self._validated.pop(namespace, None)
+
+    def fresh(self, namespace, validation_ttl, session_ttl):
+        """Whether the session was accepted less than `validation_ttl` seconds ago, and is alive."""
+        row = self.conn.execute('SELECT validated_at FROM sessions WHERE namespace = ?',
+                                (namespace,)).fetchone()
+        if row is None or row['validated_at'] is None:
+            return False
+        return row['validated_at'] > time.time() - validation_ttl and self.alive(namespace, session_ttl)
+
+    def delete(self, namespace):
+        """Forgets the session of `namespace`, in memory and in the store."""
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.execute('DELETE FROM cookies WHERE namespace = ?', (namespace,))
+            self.conn.execute('DELETE FROM sessions WHERE namespace = ?', (namespace,))
+        self._validated.pop(namespace, None)
+        self.forget(namespace)
+
+    def forget(self, namespace):
+        """Drops the jar kept in memory, the next use reads it again."""
+        self.jars.pop(namespace, None)
+        self._saved.pop(namespace, None)
+
+    def namespaces(self):
+        rows = self.conn.execute('SELECT DISTINCT namespace FROM cookies ORDER BY namespace')
+        return [row['namespace'] for row in rows]
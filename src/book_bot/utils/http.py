@@ -1,15 +1,19 @@
+import os
 import cgi
+import functools
 from urllib.parse import urlencode, urljoin
 
 import scrapy
 
 
-BASE_URL = 'https://www.uaberta.unisul.br/eadv4/'
+# may point to another server, like the one of benchmarks.mock_server
+BASE_URL = os.environ.get('EVA_BASE_URL', 'https://www.uaberta.unisul.br/eadv4/')
 EVA_DOMAIN = 'uaberta.unisul.br'
     
 
 def save_response(filename):
     def wrapper(fn):
+        @functools.wraps(fn)
         def dumper(cls, response):
             download(filename, response)
             return fn(cls, response)
@@ -20,10 +24,14 @@ def save_response(filename):
 def download(filename, response):
     with open(filename, 'wb') as file:
         file.write(response.body)
+        file.flush()
+        os.fsync(file.fileno())
 
 
-def web_open(url='', args=None, impl=scrapy.Request, base_url=BASE_URL, **kwargs):
+def web_open(url='', args=None, impl=scrapy.Request, base_url=None, **kwargs):
     kwargs.setdefault('dont_filter', True)
+    if base_url is None:
+        base_url = BASE_URL
 
     stripped_url = url.lstrip('/')
     url = f'{base_url}{stripped_url}'
@@ -35,6 +43,7 @@ def web_open(url='', args=None, impl=scrapy.Request, base_url=BASE_URL, **kwargs
 
 
 def log_request(fn):
+    @functools.wraps(fn)
     def wrapper(cls, response, **kwargs):
         cls.logger.debug('response url: %s', response.url)
         cls.logger.debug('response status: %s', response.status)
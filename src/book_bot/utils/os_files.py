@@ -1,5 +1,6 @@
 import os
 import json
+import hashlib
 
 
 def maybe_create_dir(directory):
@@ -7,14 +8,54 @@ def maybe_create_dir(directory):
         os.makedirs(directory)
 
 
+def part_path(directory, key):
+    """Hidden part file, in the final directory, where `key` is downloaded to."""
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(directory, f'.{digest}.part')
+
+
+def commit_file(part, destination):
+    """Atomically replaces `destination` with the finished `part` file."""
+    os.replace(part, destination)
+
+
+def discard(filename):
+    if filename and os.path.exists(filename):
+        os.remove(filename)
+
+
+def part_info_path(part):
+    return f'{part}.json'
+
+
+def dump_part_info(part, info):
+    """Bookkeeping of a part file, what is needed to resume it later."""
+    maybe_create_dir(os.path.dirname(part))
+    with open(part_info_path(part), 'w') as file:
+        file.write(json.dumps(info))
+
+
+def load_part_info(part):
+    filepath = part_info_path(part)
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath, 'rb') as file:
+        return json.load(file)
+
+
+def discard_part(part):
+    discard(part)
+    discard(part_info_path(part))
+
+
 def dump_sync_data(filename, data):
     maybe_create_dir('.sync')
     with open(os.path.join('.sync', filename), 'w') as file:
         file.write(json.dumps(data, indent=2))
 
 
-def load_sync_data(filename, default=[]):
-    filepath = os.path.join('.sync', filename)
+def load_sync_data(filename, default=[], directory='.sync'):
+    filepath = os.path.join(directory, filename)
     if not os.path.exists(filepath):
         return default
     with open(filepath, 'rb') as file:
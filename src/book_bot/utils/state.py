@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import sqlite3
+
+from book_bot.items import first_when_list
+from book_bot.utils import os_files
+
+
+STATE_FILE = 'state.db'
+STATE_DIR = '.sync'
+
+# kinds of subject, by the field which identifies them
+EVA = 'eva'
+MAX = 'max'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS subjects (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    name TEXT,
+    class_id TEXT,
+    url TEXT,
+    position INTEGER NOT NULL DEFAULT 0,
+    first_seen REAL
+);
+CREATE INDEX IF NOT EXISTS subjects_by_kind ON subjects (kind, position);
+
+CREATE TABLE IF NOT EXISTS books (
+    download_url TEXT PRIMARY KEY,
+    subject_key TEXT NOT NULL REFERENCES subjects (key) ON DELETE CASCADE,
+    name TEXT,
+    filename TEXT,
+    position INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS books_by_subject ON books (subject_key, position);
+
+CREATE TABLE IF NOT EXISTS downloads (
+    url TEXT PRIMARY KEY,
+    filename TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    content_length INTEGER,
+    status TEXT,
+    updated_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS library (
+    root TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    PRIMARY KEY (root, path)
+);
+
+CREATE TABLE IF NOT EXISTS phases (
+    name TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    queued INTEGER NOT NULL DEFAULT 0,
+    progress TEXT,
+    started_at REAL,
+    updated_at REAL
+);
+'''
+
+# files written by older versions, see SyncState.import_json
+LEGACY_SUBJECTS = 'subjects.json'
+LEGACY_BOOKS = 'books.json'
+LEGACY_DOWNLOADS = 'downloads.json'
+
+_opened = {}
+
+
+def account_directory(account=None):
+    """Directory of the state of `account`, each account lists its own subjects."""
+    return os.path.join(STATE_DIR, 'accounts', account) if account else STATE_DIR
+
+
+def open_state(directory=STATE_DIR):
+    """Returns the state kept in `directory`, shared by the whole process."""
+    path = os.path.abspath(os.path.join(directory, STATE_FILE))
+    if path not in _opened:
+        os_files.maybe_create_dir(directory)
+        state = SyncState(path)
+        state.import_json(directory)
+        _opened[path] = state
+    return _opened[path]
+
+
+def _field(data, key):
+    # items are dicts, but their values must be read through __getitem__
+    return data[key] if key in data else None
+
+
+def subject_key(subject):
+    return _field(subject, 'url') or _field(subject, 'class_id')
+
+
+def _subject_kind(subject):
+    return MAX if _field(subject, 'url') else EVA
+
+
+def _clean(data, *keys):
+    # items from older versions were dumped with lists as values
+    return {key: first_when_list(_field(data, key)) for key in keys}
+
+
+class SyncState:
+    """Subjects, books and downloads of the last syncs, kept in sqlite.
+
+    Subjects and books hold the last listing of each kind (EVA or Max),
+    downloads hold the validators of every synced download url, and the
+    library the files found in each destination directory.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        if path != ':memory:':
+            self.conn.execute('PRAGMA journal_mode = WAL')
+            self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def replace_subjects(self, subjects, kind=EVA):
+        """Subjects of `kind` become the listed ones, in the same order."""
+        keys = [subject_key(subject) for subject in subjects]
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self._delete_missing('subjects', 'key', keys, 'kind = ?', kind)
+            self._upsert_subjects(subjects, kind)
+
+    def add_subject(self, subject, kind=EVA, position=0):
+        """Records a subject as soon as it is listed, see `prune_subjects`."""
+        self._upsert_subjects([subject], kind, first_position=position)
+
+    def prune_subjects(self, keys, kind=EVA):
+        """Deletes the subjects of `kind` missing from a complete listing of `keys`."""
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self._delete_missing('subjects', 'key', keys, 'kind = ?', kind)
+
+    def subjects(self, kind=EVA):
+        rows = self.conn.execute(
+            'SELECT name, class_id, url FROM subjects WHERE kind = ? ORDER BY position', (kind,))
+        return [self._subject_dict(row) for row in rows]
+
+    def replace_books(self, subject, books):
+        """Books of `subject` become the listed ones, in the same order."""
+        key = subject_key(subject)
+        books = [book for book in books if _field(book, 'download_url')]
+        urls = [book['download_url'] for book in books]
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self._delete_missing('books', 'download_url', urls, 'subject_key = ?', key)
+            self._upsert_books(key, books)
+
+    def add_book(self, book, position=0):
+        """Records a book of a subject already kept, as soon as it is listed."""
+        if _field(book, 'download_url'):
+            self._upsert_books(subject_key(book['subject']), [book], first_position=position)
+
+    def prune_books(self, subject, urls):
+        """Deletes the books of `subject` missing from its complete listing of `urls`."""
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self._delete_missing('books', 'download_url', urls, 'subject_key = ?', subject_key(subject))
+
+    def books(self, kind=EVA):
+        rows = self.conn.execute(
+            'SELECT b.name, b.download_url, b.filename, d.content_length, '
+            's.name AS subject_name, s.class_id, s.url, s.first_seen '
+            'FROM books b JOIN subjects s ON s.key = b.subject_key '
+            'LEFT JOIN downloads d ON d.url = b.download_url '
+            'WHERE s.kind = ? ORDER BY s.position, b.position', (kind,))
+        for row in rows:
+            yield dict(name=row['name'],
+                       download_url=row['download_url'],
+                       filename=row['filename'],
+                       subject=self._subject_dict(row, name='subject_name'),
+                       # size from an earlier download, and when the subject was first listed
+                       size=row['content_length'],
+                       subject_seen=row['first_seen'])
+
+    def download(self, url):
+        row = self.conn.execute('SELECT * FROM downloads WHERE url = ?', (url,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def record_download(self, url, filename, etag=None, last_modified=None,
+                        content_length=None, status='downloaded'):
+        self.conn.execute(
+            'INSERT INTO downloads (url, filename, etag, last_modified, content_length, status, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (url) DO UPDATE SET filename = excluded.filename, etag = excluded.etag, '
+            'last_modified = excluded.last_modified, content_length = excluded.content_length, '
+            'status = excluded.status, updated_at = excluded.updated_at',
+            (url, filename, etag, last_modified, content_length, status, time.time()))
+
+    def mark_download(self, url, status):
+        self.conn.execute('UPDATE downloads SET status = ?, updated_at = ? WHERE url = ?',
+                          (status, time.time(), url))
+
+    def library(self, root):
+        """Size and modification time of the files indexed under `root`, by relative path."""
+        rows = self.conn.execute('SELECT path, size, mtime FROM library WHERE root = ?', (root,))
+        return {row['path']: (row['size'], row['mtime']) for row in rows}
+
+    def replace_library(self, root, files):
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.execute('DELETE FROM library WHERE root = ?', (root,))
+            self.conn.executemany('INSERT INTO library (root, path, size, mtime) VALUES (?, ?, ?, ?)',
+                                  [(root, path, size, mtime) for path, (size, mtime) in files.items()])
+
+    def index_file(self, root, path, size, mtime):
+        self.conn.execute('INSERT OR REPLACE INTO library (root, path, size, mtime) VALUES (?, ?, ?, ?)',
+                          (root, path, size, mtime))
+
+    def start_phase(self, name, resumed=False):
+        """Records that the spider `name` is running, continuing its last run when `resumed`."""
+        now = time.time()
+        if resumed:
+            self.conn.execute('UPDATE phases SET status = ?, updated_at = ? WHERE name = ?',
+                              ('running', now, name))
+            return
+        self.conn.execute(
+            'INSERT OR REPLACE INTO phases (name, status, queued, progress, started_at, updated_at) '
+            'VALUES (?, ?, 0, NULL, ?, ?)', (name, 'running', now, now))
+
+    def phase_queued(self, name):
+        """Records that every request of the spider `name` was scheduled."""
+        self.conn.execute('UPDATE phases SET queued = 1, updated_at = ? WHERE name = ?',
+                          (time.time(), name))
+
+    def checkpoint_phase(self, name, progress, status=None):
+        self.conn.execute(
+            'UPDATE phases SET progress = ?, status = COALESCE(?, status), updated_at = ? '
+            'WHERE name = ?', (json.dumps(progress, sort_keys=True), status, time.time(), name))
+
+    def phases(self):
+        """Last run of each spider, by name."""
+        rows = self.conn.execute('SELECT * FROM phases')
+        return {row['name']: dict(row, queued=bool(row['queued']),
+                                  progress=json.loads(row['progress'] or '{}'))
+                for row in rows}
+
+    def clear_phases(self):
+        self.conn.execute('DELETE FROM phases')
+
+    def flush(self):
+        """Moves what was written so far from the journal into the database file."""
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def clear_listing(self):
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.execute('DELETE FROM books')
+            self.conn.execute('DELETE FROM subjects')
+
+    def import_json(self, directory='.sync'):
+        """Imports the json files of older versions, renaming them once done."""
+        def load(filename, default):
+            data = os_files.load_sync_data(filename, default=default, directory=directory)
+            path = os.path.join(directory, filename)
+            if os.path.exists(path):
+                os.replace(path, path + '.imported')
+            return data
+
+        subjects = [_clean(s, 'name', 'class_id', 'url') for s in load(LEGACY_SUBJECTS, [])]
+        for kind in (EVA, MAX):
+            unique = {subject_key(s): s for s in subjects if _subject_kind(s) == kind}
+            if unique:
+                self.replace_subjects(list(unique.values()), kind=kind)
+
+        by_subject = {}
+        for book in load(LEGACY_BOOKS, []):
+            subject = _clean(book['subject'], 'name', 'class_id', 'url')
+            book = _clean(book, 'name', 'download_url', 'filename')
+            by_subject.setdefault(subject_key(subject), (subject, []))[1].append(book)
+        for subject, books in by_subject.values():
+            if not self._has_subject(subject):
+                self._upsert_subjects([subject], _subject_kind(subject), first_position=self._count('subjects'))
+            self.replace_books(subject, books)
+
+        for url, record in load(LEGACY_DOWNLOADS, {}).items():
+            self.record_download(url, **record)
+
+    def _upsert_subjects(self, subjects, kind, first_position=0):
+        now = time.time()  # first_seen is kept once set
+        self.conn.executemany(
+            'INSERT INTO subjects (key, kind, name, class_id, url, position, first_seen) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET kind = excluded.kind, name = excluded.name, '
+            'class_id = excluded.class_id, url = excluded.url, position = excluded.position',
+            [(subject_key(s), kind, _field(s, 'name'), _field(s, 'class_id'), _field(s, 'url'), position, now)
+             for position, s in enumerate(subjects, first_position)])
+
+    def _upsert_books(self, key, books, first_position=0):
+        self.conn.executemany(
+            'INSERT INTO books (download_url, subject_key, name, filename, position) '
+            'VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (download_url) DO UPDATE SET subject_key = excluded.subject_key, '
+            'name = excluded.name, filename = excluded.filename, position = excluded.position',
+            [(book['download_url'], key, _field(book, 'name'), _field(book, 'filename'), position)
+             for position, book in enumerate(books, first_position)])
+
+    def _migrate(self):
+        """Adds the columns missing from databases of older versions."""
+        columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(subjects)')}
+        if 'first_seen' not in columns:
+            self.conn.execute('ALTER TABLE subjects ADD COLUMN first_seen REAL')
+
+    def _has_subject(self, subject):
+        row = self.conn.execute('SELECT 1 FROM subjects WHERE key = ?', (subject_key(subject),))
+        return row.fetchone() is not None
+
+    def _count(self, table):
+        return self.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+    def _delete_missing(self, table, column, values, where, arg):
+        """Deletes the rows matching `where` whose `column` is not in `values`."""
+        self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS listed (value TEXT PRIMARY KEY)')
+        self.conn.execute('DELETE FROM temp.listed')
+        self.conn.executemany('INSERT OR IGNORE INTO temp.listed VALUES (?)',
+                              [(value,) for value in values])
+        self.conn.execute(f'DELETE FROM {table} WHERE {where} AND '
+                          f'{column} NOT IN (SELECT value FROM temp.listed)', (arg,))
+
+    @staticmethod
+    def _subject_dict(row, name='name'):
+        if row['url']:
+            return dict(name=row[name], url=row['url'])
+        return dict(name=row[name], class_id=row['class_id'])
@@ -0,0 +1,11 @@
+import pytest
+
+from book_bot.utils import state
+
+
+@pytest.fixture(autouse=True)
+def sync_dir(tmp_path, monkeypatch):
+    """Spiders keep their state relative to the working directory."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(state, '_opened', {})
+    return tmp_path / '.sync'
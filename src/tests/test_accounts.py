@@ -0,0 +1,46 @@
+import pytest
+from scrapy import Request, Spider
+
+from book_bot.accounts import AccountMiddleware, load_accounts
+from book_bot.spiders.sync_spider import BookDownloaderSpider
+from book_bot.utils import state
+
+
+def test_loads_accounts_named_by_username(tmp_path):
+    (tmp_path / 'ana.auth').write_text('ana.silva@unisul\nsecret\n')
+    (tmp_path / 'bia.auth').write_text('bia\nsecret\n')
+    (tmp_path / 'accounts').write_text('# students\nana.auth ana\n\nbia.auth /srv/bia\n')
+
+    accounts = load_accounts(str(tmp_path / 'accounts'))
+
+    assert [a.name for a in accounts] == ['ana.silva_unisul', 'bia']
+    assert accounts[0].auth_file == str(tmp_path / 'ana.auth')
+    assert accounts[0].destination == str(tmp_path / 'ana')
+    assert accounts[1].destination == '/srv/bia'
+
+
+def test_rejects_account_listed_twice(tmp_path):
+    (tmp_path / 'auth').write_text('ana\nsecret\n')
+    (tmp_path / 'accounts').write_text('auth one\nauth two\n')
+
+    with pytest.raises(ValueError):
+        load_accounts(str(tmp_path / 'accounts'))
+
+
+def test_requests_use_the_cookie_jar_of_the_account():
+    middleware = AccountMiddleware()
+    request, other = Request('http://eva/'), Request('http://eva/')
+
+    middleware.process_request(request, Spider('login', account='ana'))
+    middleware.process_request(other, Spider('login'))
+
+    assert request.meta['cookiejar'] == 'ana'
+    assert 'cookiejar' not in other.meta
+
+
+def test_accounts_keep_their_own_state():
+    ana = BookDownloaderSpider(account='ana')
+    default = BookDownloaderSpider()
+
+    assert ana.state is not default.state
+    assert ana.state is state.open_state(state.account_directory('ana'))
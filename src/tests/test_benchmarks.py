@@ -0,0 +1,42 @@
+from benchmarks import suite
+
+
+def test_suite_times_every_case_in_process():
+    results = list(suite.run_in_process(10, repeat=1))
+
+    cases = {r['case'] for r in results}
+    assert {'loader/eva_books', 'display_and_load/max_subjects',
+            'items/from_state', 'state/load_books'} <= cases
+    assert all(r['rows'] == 10 and r['seconds'] >= 0 for r in results)
+
+
+def test_display_and_load_cases_build_every_item():
+    cases = {case: fn for case, fn in suite.listing_cases(10) if case.startswith('display_and_load/')}
+
+    assert len(cases) == 4
+    assert all(len(fn()) == 10 for fn in cases.values())
+
+
+def test_failed_sync_is_reported_and_exits_non_zero(monkeypatch, capsys):
+    from benchmarks import bench_pipeline
+
+    class Server:
+        def terminate(self):
+            pass
+
+        def wait(self):
+            pass
+
+    runs = iter([{'seconds': 1.0, 'phases': {}, 'files': 0, 'bytes': 0, 'failed': True},
+                 {'seconds': 1.0, 'phases': {}, 'files': 3, 'bytes': 10, 'failed': False}])
+    monkeypatch.setattr(bench_pipeline, 'start_server', lambda args: (Server(), {}))
+    monkeypatch.setattr(bench_pipeline, 'server_stats', lambda urls: {'bytes_sent': 0})
+    monkeypatch.setattr(bench_pipeline, 'run_sync', lambda env, workdir, max_run: next(runs))
+
+    assert bench_pipeline.main([]) == 1
+
+    out, err = capsys.readouterr()
+    cold, warm = out.splitlines()[:2]
+    assert cold.startswith('cold') and cold.endswith('FAILED')
+    assert warm.startswith('warm') and 'FAILED' not in warm
+    assert 'failed: cold' in err
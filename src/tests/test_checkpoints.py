@@ -0,0 +1,72 @@
+from scrapy.utils.test import get_crawler
+try:
+    from scrapy.utils.reqser import request_from_dict, request_to_dict
+except ImportError:  # scrapy >= 2.6
+    from scrapy.utils.request import request_from_dict
+
+    def request_to_dict(request, spider):
+        return request.to_dict(spider=spider)
+
+from book_bot import checkpoints
+from book_bot.checkpoints import CheckpointExtension
+from book_bot.items import Book, Subject
+from book_bot.spiders.eva_parser import BookSpider
+from book_bot.spiders.sync_spider import BookDownloaderSpider
+
+
+def _spider(spidercls, jobdir, **kwargs):
+    crawler = get_crawler(spidercls, {'JOBDIR': str(jobdir), 'CHECKPOINT_INTERVAL': 30})
+    spider = spidercls.from_crawler(crawler, **kwargs)
+    crawler.stats.open_spider(spider)
+    return spider
+
+
+def _listing_spider(jobdir, **kwargs):
+    spider = _spider(BookSpider, jobdir, **kwargs)
+    spider.subjects_content = [dict(name=name, class_id=str(i)) for i, name in enumerate('abc')]
+    return spider
+
+
+def test_resume_makes_only_requests_not_scheduled(tmp_path):
+    spider = _listing_spider(tmp_path)
+    extension = CheckpointExtension.from_crawler(spider.crawler)
+    extension.spider_opened(spider)
+    first = next(spider.start_requests())
+    extension.request_scheduled(first, spider)
+    extension.spider_closed(spider, checkpoints.SHUTDOWN)
+    assert spider.state.phases()['book_parser']['status'] == checkpoints.SHUTDOWN
+
+    resumed = _listing_spider(tmp_path, resume=True)
+    urls = [request.url for request in resumed.start_requests()]
+    assert len(urls) == 2 and first.url not in urls
+    assert resumed.state.phases()['book_parser']['queued']
+
+    assert list(_listing_spider(tmp_path, resume=True).start_requests()) == []
+
+
+def test_progress_is_recorded_when_spider_closes(tmp_path):
+    spider = _listing_spider(tmp_path)
+    extension = CheckpointExtension.from_crawler(spider.crawler)
+    extension.spider_opened(spider)
+    spider.crawler.stats.inc_value('response_received_count', 2)
+    extension.spider_closed(spider, checkpoints.FINISHED)
+
+    phase = spider.state.phases()['book_parser']
+    assert phase['status'] == checkpoints.FINISHED
+    assert phase['progress'] == {'response_received_count': 2}
+    assert not extension.loop.running
+
+
+def test_queued_requests_survive_serialization(tmp_path):
+    # JOBDIR keeps requests by the name of their callback, decorators included
+    spider = _spider(BookDownloaderSpider, tmp_path, destination=str(tmp_path))
+    book = Book(name='foo', download_url=f'/bar?{Book.qs_file_arg}=foo.pdf',
+                subject=Subject(name='baz', class_id='1'))
+    serialized = request_to_dict(spider.build_download_request(book), spider=spider)
+    request = request_from_dict(serialized, spider=spider)
+    assert request.callback == spider.handle_download
+
+    listing = _listing_spider(tmp_path)
+    request = next(listing.start_requests())
+    serialized = request_to_dict(request, spider=listing)
+    assert request_from_dict(serialized, spider=listing).callback == listing.parse_books
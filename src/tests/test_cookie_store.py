@@ -0,0 +1,102 @@
+import time
+from http.cookiejar import Cookie
+
+from scrapy.http.cookies import CookieJar
+
+from book_bot.utils.cookie_store import CookieStore
+
+
+def _cookie(name, value, expires=None):
+    return Cookie(version=0, name=name, value=value, port=None, port_specified=False,
+                  domain='www.uaberta.unisul.br', domain_specified=False, domain_initial_dot=False,
+                  path='/eadv4/', path_specified=True, secure=False, expires=expires,
+                  discard=expires is None, comment=None, comment_url=None, rest={'HttpOnly': None})
+
+
+def _jar(*cookies):
+    jar = CookieJar()
+    for cookie in cookies:
+        jar.set_cookie(cookie)
+    return jar
+
+
+def test_jars_are_read_back_by_other_stores(tmp_path):
+    path = str(tmp_path / 'cookies.db')
+    CookieStore(path).save('ana', _jar(_cookie('JSESSIONID', 'abc')))
+
+    cookies = list(CookieStore(path).jar('ana'))
+
+    assert [(c.name, c.value, c.path, c.discard) for c in cookies] == [('JSESSIONID', 'abc', '/eadv4/', True)]
+    assert cookies[0].has_nonstandard_attr('HttpOnly')
+
+
+def test_accounts_do_not_share_cookies(tmp_path):
+    path = str(tmp_path / 'cookies.db')
+    CookieStore(path).save('ana', _jar(_cookie('JSESSIONID', 'abc')))
+    CookieStore(path).save('bia', _jar(_cookie('JSESSIONID', 'xyz')))
+
+    store = CookieStore(path)
+    assert [c.value for c in store.jar('ana')] == ['abc']
+    assert [c.value for c in store.jar('bia')] == ['xyz']
+
+    store.delete('ana')
+    assert list(CookieStore(path).jar('ana')) == []
+    assert store.namespaces() == ['bia']
+
+
+def test_writes_only_changed_cookies():
+    store = CookieStore()
+    jar = _jar(_cookie('JSESSIONID', 'abc'), _cookie('lang', 'pt'))
+    store.save('ana', jar)
+
+    before = store.conn.total_changes
+    store.save('ana', jar)
+    assert store.conn.total_changes == before
+
+    jar.set_cookie(_cookie('JSESSIONID', 'def'))
+    store.save('ana', jar)
+    assert store.conn.total_changes == before + 1
+
+
+def test_expired_cookies_are_dropped_and_not_alive(tmp_path):
+    path = str(tmp_path / 'cookies.db')
+    store = CookieStore(path)
+    store.save('ana', _jar(_cookie('old', '1', expires=int(time.time()) - 10)))
+    store.save('bia', _jar(_cookie('new', '1', expires=int(time.time()) + 60)))
+
+    assert not store.alive('ana', session_ttl=60)
+    assert store.alive('bia', session_ttl=60)
+    assert list(CookieStore(path).jar('ana')) == []
+
+
+def test_session_cookies_live_for_a_while_after_use():
+    store = CookieStore()
+    store.save('ana', _jar(_cookie('JSESSIONID', 'abc')))
+    assert not store.alive('ana', session_ttl=60)
+
+    store.touch('ana')
+    assert store.alive('ana', session_ttl=60)
+    assert not store.alive('ana', session_ttl=-1)
+
+
+def test_moves_pickled_jars_aside(tmp_path):
+    path = tmp_path / 'cookies'
+    path.write_bytes(b'\x80\x03}q\x00.' * 100)
+
+    CookieStore(str(path)).save('ana', _jar(_cookie('JSESSIONID', 'abc')))
+
+    assert (tmp_path / 'cookies.old').exists()
+    assert oct(path.stat().st_mode & 0o777) == '0o600'
+
+
+def test_validated_session_is_fresh_until_refused():
+    store = CookieStore()
+    store.save('ana', _jar(_cookie('JSESSIONID', 'abc')))
+    assert not store.fresh('ana', validation_ttl=60, session_ttl=60)
+
+    store.validated('ana')
+    assert store.fresh('ana', validation_ttl=60, session_ttl=60)
+    assert not store.fresh('ana', validation_ttl=-1, session_ttl=60)
+
+    store.invalidate('ana')
+    assert not store.fresh('ana', validation_ttl=60, session_ttl=60)
@@ -0,0 +1,284 @@
+import os
+import gzip
+
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+from twisted.web import resource, server
+from twisted.web.server import GzipEncoderFactory
+from twisted.web.resource import EncodingResourceWrapper
+from scrapy import Spider
+from scrapy.http import Request
+from scrapy.utils.misc import create_instance
+from scrapy.utils.test import get_crawler
+
+from book_bot.handlers import FairLimiter, StreamingDownloadHandler
+from book_bot.library import Library
+from book_bot.utils import os_files, state
+
+
+DATA = bytes(range(256)) * 400
+
+
+def test_limiter_takes_turns_between_accounts():
+    limiter = FairLimiter(limit=1)
+    started = []
+    limiter.acquire('ana')
+    for account in ['ana', 'ana', 'ana', 'bia']:
+        limiter.acquire(account).addCallback(lambda _, account=account: started.append(account))
+
+    for _ in range(3):
+        limiter.release()
+
+    assert started == ['ana', 'bia', 'ana']
+    assert limiter.active == 1
+
+
+def test_cancelled_wait_leaves_the_queue():
+    limiter = FairLimiter(limit=1)
+    limiter.acquire('ana')
+    waiting = limiter.acquire('bia')
+    waiting.addErrback(lambda _: None)
+
+    waiting.cancel()
+    limiter.release()
+
+    assert limiter.active == 0
+
+
+class FlakyFile(resource.Resource):
+    """Serves DATA with range support, dropping the first transfer halfway."""
+    isLeaf = True
+
+    def __init__(self, etag=b'"v1"'):
+        super().__init__()
+        self.etag = etag
+        self.ranges = []
+        self.drops = 1
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'application/pdf')
+        request.setHeader(b'ETag', self.etag)
+        body, asked = DATA, request.getHeader(b'Range')
+        self.ranges.append(asked)
+        if asked and request.getHeader(b'If-Range') == self.etag:
+            start = int(asked.decode().split('=')[1].rstrip('-'))
+            body = DATA[start:]
+            request.setResponseCode(206)
+            request.setHeader(b'Content-Range', f'bytes {start}-{len(DATA) - 1}/{len(DATA)}'.encode())
+        request.setHeader(b'Content-Length', str(len(body)).encode())
+
+        if self.drops:
+            self.drops -= 1
+            request.write(body[:len(body) // 2])
+            reactor.callLater(0.05, request.channel.transport.abortConnection)
+            return server.NOT_DONE_YET
+        return body
+
+
+class ResumeDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.file = FlakyFile()
+        self.port = reactor.listenTCP(0, server.Site(self.file), interface='127.0.0.1')
+        self.url = f'http://127.0.0.1:{self.port.getHost().port}/book.pdf'
+        self.part = os.path.abspath(os.path.join(self.mktemp(), '.book.part'))
+
+        crawler = get_crawler(Spider, {'STREAM_BUFFER_SIZE': 1024})
+        self.spider = Spider('test')
+        self.handler = create_instance(StreamingDownloadHandler, crawler.settings, crawler)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.handler.close()
+        yield self.port.stopListening()
+
+    def download(self):
+        request = Request(self.url, meta={'download_part': self.part})
+        return self.handler.download_request(request, self.spider)
+
+    @defer.inlineCallbacks
+    def test_resumes_interrupted_download(self):
+        with self.assertRaises(Exception):
+            yield self.download()
+        kept = os.path.getsize(self.part)
+        self.assertTrue(kept > 0)
+
+        response = yield self.download()
+
+        self.assertEqual(response.status, 206)
+        self.assertEqual(self.file.ranges, [None, f'bytes={kept}-'.encode()])
+        self.assertEqual(response.meta['download_resumed_from'], kept)
+        with open(self.part, 'rb') as file:
+            self.assertEqual(file.read(), DATA)
+        self.assertFalse(os.path.exists(os_files.part_info_path(self.part)))
+
+    @defer.inlineCallbacks
+    def test_downloads_again_when_file_changed(self):
+        with self.assertRaises(Exception):
+            yield self.download()
+        self.file.etag = b'"v2"'
+
+        response = yield self.download()
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.meta['download_resumed_from'], 0)
+        with open(self.part, 'rb') as file:
+            self.assertEqual(file.read(), DATA)
+
+
+class NamedFile(resource.Resource):
+    """Serves DATA as an attachment, counting the bytes actually sent."""
+    isLeaf = True
+
+    def __init__(self):
+        super().__init__()
+        self.sent = 0
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'application/pdf')
+        request.setHeader(b'Content-Disposition', b'attachment; filename="real.pdf"')
+        request.setHeader(b'Content-Length', str(len(DATA)).encode())
+        self.calls = []
+        request.notifyFinish().addErrback(lambda _: [c.cancel() for c in self.calls if c.active()])
+        self.send(request, 0)
+        return server.NOT_DONE_YET
+
+    def send(self, request, offset):
+        if offset >= len(DATA):
+            return request.finish()
+        request.write(DATA[offset:offset + 1024])
+        self.sent += 1024
+        self.calls.append(reactor.callLater(0.001, self.send, request, offset + 1024))
+
+
+class SkipExistingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.file = NamedFile()
+        self.port = reactor.listenTCP(0, server.Site(self.file), interface='127.0.0.1')
+        self.url = f'http://127.0.0.1:{self.port.getHost().port}/book?arquivo=other.pdf'
+        self.destination = os.path.abspath(self.mktemp())
+        os.makedirs(self.destination)
+
+        crawler = get_crawler(Spider)
+        self.spider = Spider('test')
+        self.handler = create_instance(StreamingDownloadHandler, crawler.settings, crawler)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.handler.close()
+        yield self.port.stopListening()
+
+    def download(self, **meta):
+        meta.update({'download_part': os.path.join(self.destination, '.book.part'),
+                     'download_destination': self.destination,
+                     'download_filename': 'other.pdf'})
+        return self.handler.download_request(Request(self.url, meta=meta), self.spider)
+
+    @defer.inlineCallbacks
+    def test_cancels_transfer_when_file_exists(self):
+        with open(os.path.join(self.destination, 'real.pdf'), 'wb') as file:
+            file.write(DATA)
+
+        response = yield self.download()
+
+        self.assertIn('skipped', response.flags)
+        self.assertEqual(response.meta['download_avoided'], len(DATA))
+        self.assertTrue(self.file.sent < len(DATA))
+        self.assertFalse(os.path.exists(response.meta['download_part']))
+
+    @defer.inlineCallbacks
+    def test_library_of_the_spider_tells_the_file_exists(self):
+        # indexed but not on disk: the index is trusted, the disk not looked at
+        self.spider.library = Library(state.SyncState(), self.destination).update({'real.pdf': (len(DATA), 0)})
+
+        response = yield self.download()
+
+        self.assertIn('skipped', response.flags)
+
+    @defer.inlineCallbacks
+    def test_file_missing_from_the_library_is_downloaded(self):
+        self.spider.library = Library(state.SyncState(), self.destination).update({})
+
+        response = yield self.download()
+
+        self.assertIn('streamed', response.flags)
+
+    @defer.inlineCallbacks
+    def test_streams_missing_file(self):
+        response = yield self.download()
+
+        self.assertIn('streamed', response.flags)
+        self.assertEqual(response.meta['download_size'], len(DATA))
+
+    @defer.inlineCallbacks
+    def test_defers_large_file(self):
+        response = yield self.download(download_defer_above=len(DATA))
+
+        self.assertIn('deferred', response.flags)
+        self.assertEqual(response.meta['download_size'], len(DATA))
+        self.assertTrue(self.file.sent < len(DATA))
+
+
+TEXT = b'line of a text file\n' * 330
+
+
+class TextFile(resource.Resource):
+    """Serves TEXT, gzip encoded whenever `always_gzip`, as some servers do."""
+    isLeaf = True
+
+    def __init__(self, always_gzip=False):
+        super().__init__()
+        self.always_gzip = always_gzip
+        self.encodings = []
+
+    def render_GET(self, request):
+        self.encodings.append(request.getHeader(b'Accept-Encoding'))
+        request.setHeader(b'Content-Type', b'text/plain')
+        request.setHeader(b'ETag', b'"v1"')
+        if self.always_gzip:
+            request.setHeader(b'Content-Encoding', b'gzip')
+            return gzip.compress(TEXT)
+        return TEXT
+
+
+class ContentEncodingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.part = os.path.abspath(os.path.join(self.mktemp(), '.book.part'))
+        crawler = get_crawler(Spider)
+        self.spider = Spider('test')
+        self.handler = create_instance(StreamingDownloadHandler, crawler.settings, crawler)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.handler.close()
+        yield self.port.stopListening()
+
+    def serve(self, root):
+        self.port = reactor.listenTCP(0, server.Site(root), interface='127.0.0.1')
+        # as HttpCompressionMiddleware leaves every request
+        request = Request(f'http://127.0.0.1:{self.port.getHost().port}/notes.txt',
+                          headers={'Accept-Encoding': 'gzip, deflate'},
+                          meta={'download_part': self.part})
+        return self.handler.download_request(request, self.spider)
+
+    @defer.inlineCallbacks
+    def test_file_is_asked_without_encoding(self):
+        text = TextFile()
+        response = yield self.serve(EncodingResourceWrapper(text, [GzipEncoderFactory()]))
+
+        self.assertEqual(text.encodings, [b'identity'])
+        self.assertEqual(response.meta['download_size'], len(TEXT))
+        with open(self.part, 'rb') as file:
+            self.assertEqual(file.read(), TEXT)
+
+    @defer.inlineCallbacks
+    def test_body_encoded_anyway_is_decoded_and_not_resumable(self):
+        response = yield self.serve(TextFile(always_gzip=True))
+
+        self.assertNotIn(b'Content-Encoding', response.headers)
+        self.assertEqual(response.meta['download_size'], len(TEXT))
+        with open(self.part, 'rb') as file:
+            self.assertEqual(file.read(), TEXT)
+        self.assertFalse(os.path.exists(os_files.part_info_path(self.part)))
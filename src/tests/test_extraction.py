@@ -0,0 +1,77 @@
+import pytest
+
+from book_bot.items import Book, BookLoader, Subject, SubjectLoader
+from book_bot.spiders.max_spider import MaxBook, MaxBookLoader, MaxSubject, MaxSubjectLoader
+from .util import fake_response_from_file
+
+
+# Loaders as they were before the compiled listings, one selector per field.
+# The compiled ones must give the very same items.
+
+def selector_subjects(response):
+    for tree in response.xpath("//div[@id='grad']/div[1]/div[1]/div[1]/div"):
+        s = Subject()
+        s['class_id'] = tree.xpath('.//a/@data-turma_id')
+        s['name'] = tree.xpath('.//p/text()')
+        yield s
+
+
+def selector_books(response, subject):
+    for tree in response.xpath("//div[@id='insereEspaco']/div"):
+        b = Book(subject=subject)
+        b['name'] = tree.xpath('.//small//text()')
+        b['download_url'] = tree.xpath(".//a[@title='Download']/@href")
+        yield b
+
+
+def selector_max_subjects(response):
+    for tree in response.xpath('//table[2]/tbody[1]/tr[last()]/td')[1:]:
+        s = MaxSubject()
+        s['url'] = tree.xpath('.//a[1]/@href')
+        s['name'] = tree.xpath('.//text()')
+        yield s
+
+
+def selector_max_books(response, subject):
+    for tree in response.xpath('/html/body/table/tbody/tr')[1:]:
+        b = MaxBook(subject=subject)
+        b['download_url'] = tree.xpath('.//td[last()]/a[1]/@href')
+        b['name'] = tree.xpath('.//td[last()]/a[1]/text()')
+        if b['download_url']:
+            yield b
+
+
+def load(loader, response):
+    items = (loader(index, row) for index, row in enumerate(loader.get_tree(response)))
+    return [item for item in items if item is not None]
+
+
+@pytest.mark.parametrize('asset, loader, selector', [
+    ('assets/subjects.html', SubjectLoader, selector_subjects),
+    ('assets/max_schedule.html', MaxSubjectLoader, selector_max_subjects),
+])
+def test_subjects_match_selector_loader(asset, loader, selector):
+    response = fake_response_from_file(asset)
+
+    subjects = load(loader(), response)
+
+    assert subjects and subjects == list(selector(response))
+
+
+@pytest.mark.parametrize('asset, loader, selector', [
+    ('assets/books.html', BookLoader, selector_books),
+    ('assets/max_books.html', MaxBookLoader, selector_max_books),
+])
+def test_books_match_selector_loader(asset, loader, selector):
+    response = fake_response_from_file(asset)
+    subject = Subject(name='foo', class_id='1')
+
+    books = load(loader(subject=subject), response)
+
+    assert books and books == list(selector(response, subject))
+
+
+def test_empty_listing_has_no_rows():
+    response = fake_response_from_file('assets/login.html')
+    assert SubjectLoader().get_tree(response) == []
+    assert MaxBookLoader(subject=None).get_tree(response) == []
@@ -0,0 +1,27 @@
+import pytest
+
+from book_bot.items import Book, BookLoader, Subject
+
+
+def test_normalizes_values_once_when_assigned():
+    book = Book(name=['  foo  '], download_url=[f'/bar?{Book.qs_file_arg}=foo.pdf'],
+                subject=Subject(name=['Turma - baz'], class_id=['1']))
+
+    assert dict.__getitem__(book, 'name') == 'foo'
+    assert book.get('filename') == 'foo.pdf'
+    assert book['subject']['name'] == 'baz'
+
+
+def test_loads_clean_values_as_they_are():
+    book = BookLoader.from_dict(dict(name='foo - bar', download_url='/bar?id=1', filename='foo.pdf',
+                                     subject=dict(name='a - b', class_id='1')))
+
+    assert book['filename'] == 'foo.pdf'
+    assert book['subject']['name'] == 'a - b'
+
+
+def test_rejects_unknown_keys():
+    with pytest.raises(KeyError):
+        Book(foo='bar')
+    with pytest.raises(KeyError):
+        Subject.from_clean(foo='bar')
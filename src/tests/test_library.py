@@ -0,0 +1,44 @@
+import os
+
+from book_bot.library import Library
+from book_bot.utils import state
+
+
+def test_walk_indexes_files_but_not_parts(tmp_path):
+    (tmp_path / 'foo').mkdir()
+    (tmp_path / 'foo' / 'a.pdf').write_bytes(b'abc')
+    (tmp_path / 'foo' / '.0123.part').write_bytes(b'ab')
+    library = Library(state.SyncState(), str(tmp_path)).scan()
+
+    assert library.get(str(tmp_path / 'foo' / 'a.pdf'))[0] == 3
+    assert str(tmp_path / 'foo' / '.0123.part') not in library
+    assert str(tmp_path / 'foo' / 'b.pdf') not in library
+
+
+def test_files_deleted_or_truncated_since_the_last_run(tmp_path):
+    sync_state = state.SyncState()
+    (tmp_path / 'foo').mkdir()
+    for name in ('a.pdf', 'b.pdf', 'c.pdf'):
+        (tmp_path / 'foo' / name).write_bytes(b'abc')
+    Library(sync_state, str(tmp_path)).scan()
+
+    os.remove(tmp_path / 'foo' / 'a.pdf')
+    (tmp_path / 'foo' / 'b.pdf').write_bytes(b'a')
+    library = Library(sync_state, str(tmp_path)).scan()
+
+    assert library.deleted == [os.path.join('foo', 'a.pdf')]
+    assert library.truncated(str(tmp_path / 'foo' / 'b.pdf'))
+    assert not library.truncated(str(tmp_path / 'foo' / 'c.pdf'))
+    assert library.truncated(str(tmp_path / 'foo' / 'c.pdf'), size=4)
+
+
+def test_committed_files_are_indexed(tmp_path):
+    sync_state = state.SyncState()
+    library = Library(sync_state, str(tmp_path)).scan()
+    path = tmp_path / 'a.pdf'
+    path.write_bytes(b'abc')
+
+    library.add(str(path), os.stat(path))
+
+    assert str(path) in library
+    assert sync_state.library(library.root) == {'a.pdf': library.get(str(path))}
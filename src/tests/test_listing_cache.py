@@ -0,0 +1,83 @@
+import time
+from email.utils import formatdate
+
+import scrapy
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.utils.test import get_crawler
+
+from book_bot.cache import ListingCachePolicy
+
+
+LISTING = 'http://www.example.com/eadv4/listaMidiatecas.processa?turmaId=1'
+PAGE = b'<html><body><table id="midiateca"></table></body></html>'
+LOGIN = b'<html><body><input id="id_login"><input id="id_senha"></body></html>'
+
+
+def _middleware(tmp_path):
+    crawler = get_crawler(settings_dict={
+        'HTTPCACHE_ENABLED': True,
+        'HTTPCACHE_POLICY': 'book_bot.cache.ListingCachePolicy',
+        'HTTPCACHE_DIR': str(tmp_path / 'httpcache'),
+        'HTTPCACHE_ENDPOINT_TTLS': {'listaMidiatecas.processa': 60},
+    })
+    spider = scrapy.Spider.from_crawler(crawler, 'book_parser')
+    crawler.stats.open_spider(spider)
+    middleware = HttpCacheMiddleware.from_crawler(crawler)
+    middleware.spider_opened(spider)
+    return middleware, spider, crawler.stats
+
+
+def _fetch(middleware, spider, request, response):
+    cached = middleware.process_request(request, spider)
+    if cached is not None:
+        return cached
+    return middleware.process_response(request, response, spider)
+
+
+def _page(url, body=PAGE, status=200, age=0, **headers):
+    headers = {'Content-Type': 'text/html', 'Date': formatdate(time.time() - age, usegmt=True), **headers}
+    return HtmlResponse(url, status=status, body=body, headers=headers)
+
+
+def test_listing_is_served_from_disk_while_fresh(tmp_path):
+    middleware, spider, stats = _middleware(tmp_path)
+    _fetch(middleware, spider, Request(LISTING), _page(LISTING))
+
+    response = middleware.process_request(Request(LISTING), spider)
+    assert response is not None and response.body == PAGE
+    assert stats.get_value('httpcache/hit') == 1
+    assert stats.get_value('httpcache/miss') == 1
+
+
+def test_stale_listing_is_validated(tmp_path):
+    middleware, spider, stats = _middleware(tmp_path)
+    _fetch(middleware, spider, Request(LISTING), _page(LISTING, age=120, ETag='"v1"'))
+
+    request = Request(LISTING)
+    assert middleware.process_request(request, spider) is None
+    assert request.headers['If-None-Match'] == b'"v1"'
+    response = middleware.process_response(request, Response(LISTING, status=304), spider)
+    assert response.body == PAGE
+    assert stats.get_value('httpcache/revalidate') == 1
+
+
+def test_only_listing_pages_are_stored(tmp_path):
+    middleware, spider, stats = _middleware(tmp_path)
+    download = 'http://www.example.com/eadv4/midiateca.download?id=1'
+    _fetch(middleware, spider, Request(download, meta={'download_part': 'a.part'}),
+           Response(download, body=b'%PDF', headers={'Content-Type': 'application/pdf'}))
+    _fetch(middleware, spider, Request(LISTING), _page(LISTING, body=LOGIN))
+    home = 'http://www.example.com/eadv4/'
+    _fetch(middleware, spider, Request(home), _page(home))
+
+    for url in (download, LISTING, home):
+        assert middleware.process_request(Request(url), spider) is None
+    assert not stats.get_value('httpcache/hit')
+
+
+def test_endpoints_without_ttl_are_not_cached():
+    policy = ListingCachePolicy(get_crawler(settings_dict={
+        'HTTPCACHE_ENDPOINT_TTLS': {'horario.htm': 60}}).settings)
+    assert policy.should_cache_request(Request('http://paginas.unisul.br/max.pereira/horario.htm'))
+    assert not policy.should_cache_request(Request(LISTING))
@@ -0,0 +1,58 @@
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.utils.test import get_crawler
+
+from book_bot.login import LOGGED_OUT, LoginDetectionMiddleware, detect_logout
+from .util import fake_response_from_file
+
+
+def _middleware(**settings):
+    crawler = get_crawler(settings_dict={'LOGIN_DETECTION_ENABLED': True,
+                                         'LOGIN_DETECTION_MAX_BYTES': 64 * 1024, **settings})
+    crawler.stats.open_spider(None)
+    return LoginDetectionMiddleware.from_crawler(crawler), crawler.stats
+
+
+def _page(body, url='http://www.example.com/eadv4/', content_type=b'text/html; charset=ISO-8859-1',
+          cls=HtmlResponse, **kwargs):
+    # as seen by middlewares, before the engine ties the response to its request
+    return Request(url, **kwargs), cls(url=url, body=body, headers={'Content-Type': content_type})
+
+
+def test_detects_login_page_from_its_beginning():
+    response = fake_response_from_file('assets/login.html')
+    logged_out, scanned = detect_logout(response)
+    assert logged_out
+    assert 0 < scanned < len(response.body)
+
+
+def test_logged_page_is_not_login():
+    response = fake_response_from_file('assets/logged.html')
+    assert detect_logout(response) == (False, len(response.body))
+
+
+def test_reads_only_a_prefix():
+    body = b' ' * 1024 + b'<input id="id_login"><input id="id_senha">'
+    middleware, stats = _middleware(LOGIN_DETECTION_MAX_BYTES=1024)
+    request, response = _page(body)
+    middleware.process_response(request, response, None)
+    assert request.meta[LOGGED_OUT] is False
+    assert stats.get_value('login_detection/bytes_scanned') == 1024
+    assert stats.get_value('login_detection/checked') == 1
+
+
+def test_redirect_to_login_page_needs_no_body():
+    request, response = _page(b'', meta={'redirect_urls': ['http://www.example.com/eadv4/login/index.jsp']})
+    assert detect_logout(response, meta=request.meta) == (True, 0)
+
+
+def test_never_reads_downloads():
+    middleware, stats = _middleware()
+    body = b'%PDF id_login id_senha'
+    pdf = _page(body, content_type=b'application/pdf', cls=Response)
+    streamed = _page(b'', meta={'download_part': 'book.part'})
+    streamed[1].flags.append('streamed')
+    for request, response in (pdf, streamed):
+        assert middleware.process_response(request, response, None) is response
+        assert LOGGED_OUT not in request.meta
+    assert stats.get_value('login_detection/skipped') == 2
+    assert stats.get_value('login_detection/checked') is None
@@ -0,0 +1,89 @@
+import json
+
+import scrapy
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.utils.test import get_crawler
+
+from book_bot import metrics
+
+
+def _extension(tmp_path):
+    crawler = get_crawler(settings_dict={'METRICS_ENABLED': True,
+                                         'METRICS_DIR': str(tmp_path / 'metrics'),
+                                         'METRICS_ACCOUNT': 'aluno'})
+    spider = scrapy.Spider('books_downloader')
+    extension = metrics.MetricsExtension.from_crawler(crawler)
+    extension.spider_opened(spider)
+    return extension, crawler, spider
+
+
+def _book(subject):
+    return {'name': 'Livro', 'subject': {'name': subject}}
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert metrics.percentile(values, 0.5) == 50
+    assert metrics.percentile(values, 0.99) == 99
+    assert metrics.percentile([3], 0.9) == 3
+    assert metrics.percentile([], 0.5) is None
+
+
+def test_phase_metrics_are_written_as_json_and_textfile(tmp_path):
+    extension, crawler, spider = _extension(tmp_path)
+    listing = Request('http://www.example.com/eadv4/listaMidiatecas.processa?turmaId=1',
+                      meta={'download_latency': 0.2})
+    extension.response_received(HtmlResponse(listing.url, body=b'<html></html>'), listing, spider)
+    download = Request('http://www.example.com/eadv4/midiateca.download?id=1',
+                       meta={'download_part': 'a.part', 'download_size': 1000, 'download_latency': 0.5})
+    extension.response_received(Response(download.url, flags=['streamed']), download, spider)
+    for signal, subject in ((metrics.book_downloaded, 'Cálculo'), (metrics.book_skipped, 'Cálculo'),
+                            (metrics.book_failed, 'Física "B"')):
+        crawler.signals.send_catch_log(signal=signal, book=_book(subject), spider=spider)
+    extension.spider_closed(spider, 'finished')
+
+    run = json.loads((tmp_path / 'metrics' / metrics.JSON_FILE).read_text())
+    phase = run['phases']['books_downloader']
+    assert run['account'] == 'aluno'
+    assert phase['endpoints']['download']['bytes'] == 1000
+    assert phase['endpoints']['listaMidiatecas.processa']['latency']['0.5'] == 0.2
+    assert phase['subjects'] == {'Cálculo': {'downloaded': 1, 'skipped': 1}, 'Física "B"': {'failed': 1}}
+
+    textfile = (tmp_path / 'metrics' / metrics.TEXTFILE).read_text()
+    assert '# TYPE book_bot_books_total counter' in textfile
+    assert ('book_bot_books_total{account="aluno",phase="books_downloader",'
+            'subject="Física \\"B\\"",result="failed"} 1') in textfile
+    assert ('book_bot_response_bytes_total{account="aluno",phase="books_downloader",'
+            'endpoint="download"} 1000') in textfile
+
+
+def test_latency_summary_has_sum_and_count(tmp_path):
+    extension, _, spider = _extension(tmp_path)
+    for latency in (0.25, 0.5, 0.75):
+        request = Request('http://www.example.com/eadv4/listaMidiatecas.processa?turmaId=1',
+                          meta={'download_latency': latency})
+        extension.response_received(HtmlResponse(request.url, body=b'<html></html>'), request, spider)
+    extension.spider_closed(spider, 'finished')
+
+    run = json.loads((tmp_path / 'metrics' / metrics.JSON_FILE).read_text())
+    listing = run['phases']['books_downloader']['endpoints']['listaMidiatecas.processa']
+    assert (listing['latency_sum'], listing['latency_count']) == (1.5, 3)
+
+    lines = (tmp_path / 'metrics' / metrics.TEXTFILE).read_text().splitlines()
+    labels = 'account="aluno",phase="books_downloader",endpoint="listaMidiatecas.processa"'
+    family = lines.index('# TYPE book_bot_response_latency_seconds summary')
+    assert lines[family + 1:family + 6] == [
+        f'book_bot_response_latency_seconds{{{labels},quantile="0.5"}} 0.5',
+        f'book_bot_response_latency_seconds{{{labels},quantile="0.9"}} 0.75',
+        f'book_bot_response_latency_seconds{{{labels},quantile="0.99"}} 0.75',
+        f'book_bot_response_latency_seconds_sum{{{labels}}} 1.5',
+        f'book_bot_response_latency_seconds_count{{{labels}}} 3']
+
+
+def test_phases_of_a_run_are_merged(tmp_path):
+    for name in ('subject_parser', 'book_parser'):
+        extension, _, _ = _extension(tmp_path)
+        extension.spider_closed(scrapy.Spider(name), 'finished')
+
+    run = json.loads((tmp_path / 'metrics' / metrics.JSON_FILE).read_text())
+    assert set(run['phases']) == {'subject_parser', 'book_parser'}
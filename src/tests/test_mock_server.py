@@ -0,0 +1,63 @@
+from io import BytesIO
+from http.cookiejar import CookieJar
+
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+from twisted.web.client import Agent, CookieAgent, FileBodyProducer, readBody
+from twisted.web.http_headers import Headers
+from scrapy.http import HtmlResponse, Request
+
+from benchmarks.mock_server import MockServer, Options
+from book_bot.items import BookLoader, Subject, SubjectLoader
+from book_bot.spiders.eva_auth import LoginSpider
+from book_bot.spiders.max_spider import MaxSubjectLoader
+from book_bot.utils import http
+
+
+def test_web_open_uses_current_base_url(monkeypatch):
+    monkeypatch.setattr(http, 'BASE_URL', 'http://127.0.0.1:8080/eadv4/')
+    assert http.web_open('/login.processa').url == 'http://127.0.0.1:8080/eadv4/login.processa'
+
+
+class MockServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.port = MockServer(Options(subjects=3, books=5)).listen()
+        self.url = f'http://127.0.0.1:{self.port.getHost().port}'
+        self.agent = CookieAgent(Agent(reactor), CookieJar())
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    @defer.inlineCallbacks
+    def get(self, path, method=b'GET', body=None):
+        headers = Headers({b'Content-Type': [b'application/x-www-form-urlencoded']})
+        producer = FileBodyProducer(BytesIO(body)) if body else None
+        response = yield self.agent.request(method, (self.url + path).encode(), headers, producer)
+        content = yield readBody(response)
+        return HtmlResponse(url=self.url + path, status=response.code, body=content,
+                            headers=dict(response.headers.getAllRawHeaders()),
+                            request=Request(self.url + path))
+
+    @defer.inlineCallbacks
+    def test_lists_only_after_login(self):
+        response = yield self.get('/eadv4/listaDisciplina.processa')
+        self.assertTrue(LoginSpider.auth_failed(response))
+
+        response = yield self.get('/eadv4/login.processa', b'POST', b'id_login=aluno&id_senha=senha')
+        self.assertFalse(LoginSpider.auth_failed(response))
+
+        response = yield self.get('/eadv4/listaDisciplina.processa')
+        self.assertEqual(len(SubjectLoader().get_tree(response)), 3)
+        response = yield self.get('/eadv4/listaMidiatecas.processa?turmaIdSessao=1')
+        books = BookLoader(subject=Subject(name='foo', class_id='1')).get_tree(response)
+        self.assertEqual(len(books), 5)
+
+        response = yield self.get('/eadv4/' + books[4][1])
+        self.assertEqual(response.headers[b'Content-Disposition'], b'attachment; filename="material1_4.pdf"')
+
+    @defer.inlineCallbacks
+    def test_serves_max_schedule(self):
+        response = yield self.get('/max.pereira/horario.htm')
+        subjects = MaxSubjectLoader().get_tree(response)
+        self.assertEqual([url for url, _ in subjects], ['disciplina0.htm', 'disciplina1.htm', 'disciplina2.htm'])
@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from book_bot import pipelines
+from book_bot.items import Book, Subject
+from book_bot.pipelines import BookPipeline, SubjectPipeline
+from book_bot.spiders.max_spider import MaxBookParser
+from book_bot.utils import state
+
+
+def _spider(sync_state, kind=state.EVA):
+    return SimpleNamespace(state=sync_state, subject_kind=kind)
+
+
+def _book(name, subject):
+    return Book(name=name, download_url=f'/bar?{Book.qs_file_arg}={name}.pdf', subject=subject)
+
+
+def test_books_are_kept_as_they_are_parsed():
+    sync_state = state.SyncState()
+    subject = Subject(name='foo', class_id='1')
+    sync_state.replace_subjects([subject])
+    spider = _spider(sync_state)
+    pipeline = BookPipeline()
+    pipeline.open_spider(spider)
+
+    pipeline.process_item(_book('a', subject), spider)
+    pipeline.process_item(_book('b', subject), spider)
+
+    # durable before the spider closes
+    assert [b['name'] for b in sync_state.books()] == ['a', 'b']
+
+
+def test_listing_replaces_only_books_of_listed_subjects():
+    sync_state = state.SyncState()
+    listed, stopped = Subject(name='foo', class_id='1'), Subject(name='bar', class_id='2')
+    sync_state.replace_subjects([listed, stopped])
+    sync_state.replace_books(listed, [_book('a', listed), _book('b', listed)])
+    sync_state.replace_books(stopped, [_book('c', stopped)])
+    spider = _spider(sync_state)
+    pipeline = BookPipeline()
+    pipeline.open_spider(spider)
+
+    pipeline.process_item(_book('b', listed), spider)
+    pipeline.close_spider(spider)
+
+    assert [b['name'] for b in sync_state.books()] == ['b', 'c']
+
+
+def test_emptied_subject_loses_its_books():
+    sync_state = state.SyncState()
+    emptied, stopped = Subject(name='foo', class_id='1'), Subject(name='bar', class_id='2')
+    sync_state.replace_subjects([emptied, stopped])
+    sync_state.replace_books(emptied, [_book('a', emptied)])
+    sync_state.replace_books(stopped, [_book('b', stopped)])
+    spider = _spider(sync_state)
+    crawler = get_crawler()
+    pipeline = BookPipeline.from_crawler(crawler)
+    pipeline.open_spider(spider)
+
+    crawler.signals.send_catch_log(signal=pipelines.subject_listed, subject=emptied, spider=spider)
+    pipeline.close_spider(spider)
+
+    assert [b['name'] for b in sync_state.books()] == ['b']
+
+
+def test_max_subject_without_books_is_listed():
+    crawler = get_crawler(MaxBookParser)
+    spider = MaxBookParser.from_crawler(crawler)
+    subject = Subject(name='foo', class_id='1')
+    listed = []
+
+    def subject_listed(subject, spider):
+        listed.append(subject)
+    crawler.signals.connect(subject_listed, signal=pipelines.subject_listed)
+
+    request = Request('http://www.example.com/foo.htm', meta={'subject': subject})
+    response = HtmlResponse(request.url, body=b'<html><body></body></html>', request=request)
+
+    assert list(spider.parse_books(response)) == []
+    assert listed == [subject]
+
+
+def test_subjects_missing_from_listing_are_deleted_on_close():
+    sync_state = state.SyncState()
+    sync_state.replace_subjects([Subject(name='foo', class_id='1')])
+    spider = _spider(sync_state)
+    pipeline = SubjectPipeline()
+    pipeline.open_spider(spider)
+
+    pipeline.process_item(Subject(name='bar', class_id='2'), spider)
+    assert len(sync_state.subjects()) == 2
+    pipeline.close_spider(spider)
+
+    assert sync_state.subjects() == [dict(name='bar', class_id='2')]
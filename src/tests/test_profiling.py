@@ -0,0 +1,88 @@
+import tracemalloc
+from types import SimpleNamespace
+
+import scrapy
+from scrapy.utils.test import get_crawler
+
+from book_bot import profiling
+
+
+class ProfiledSpider(scrapy.Spider):
+    name = 'profiled'
+
+    @profiling.profiled
+    def parse(self, response):
+        return sum(range(1000))
+
+    @profiling.profiled
+    def requests(self):
+        for value in range(3):
+            yield value
+
+
+def test_callbacks_run_as_usual_without_profile():
+    spider = ProfiledSpider()
+    assert spider.parse(None) == 499500
+    assert list(spider.requests()) == [0, 1, 2]
+    assert ProfiledSpider.parse.__name__ == 'parse'
+
+
+def test_generators_are_measured_on_each_item():
+    spider = ProfiledSpider()
+    spider.profiler = profiling.Profiler(profiling.CPU)
+    assert list(spider.requests()) == [0, 1, 2]
+    spider.parse(None)
+
+    stats = spider.profiler.callbacks
+    assert stats['requests'].calls == 5  # the call and every next(), the last one stops it
+    assert stats['parse'].calls == 1
+    assert 'parse' in spider.profiler.report(top=5)
+
+
+def test_stalls_of_the_reactor_are_counted(monkeypatch):
+    clock = iter([100.0, 100.06, 100.31])
+    monkeypatch.setattr(profiling, 'time', SimpleNamespace(monotonic=lambda: next(clock)))
+    probe = profiling.LagProbe(interval=0.05, stall=0.1)
+    probe._last = profiling.time.monotonic()
+    probe._probe()
+    probe._probe()
+
+    assert probe.probes == 2
+    assert probe.stalls == 1  # 0.2s late, the first one only 0.01s
+    assert round(probe.blocked_seconds, 2) == 0.2
+
+
+def test_report_is_written_when_spider_closes(tmp_path):
+    crawler = get_crawler(ProfiledSpider, settings_dict={
+        'PROFILE_DIR': str(tmp_path / 'profiles'), 'PROFILE_LAG_INTERVAL': 0.05,
+        'PROFILE_STALL_SECONDS': 0.1, 'PROFILE_TOP': 5})
+    spider = ProfiledSpider(profile='cpu')
+    extension = profiling.ProfilingExtension.from_crawler(crawler)
+    extension.spider_opened(spider)
+    spider.parse(None)
+    extension.spider_closed(spider)
+
+    report = (tmp_path / 'profiles' / 'profiled.txt').read_text()
+    assert 'profile cpu' in report and 'reactor:' in report
+    assert (tmp_path / 'profiles' / 'profiled.parse.prof').exists()
+
+
+def _profile_memory(tmp_path):
+    crawler = get_crawler(ProfiledSpider, settings_dict={'PROFILE_DIR': str(tmp_path / 'profiles')})
+    spider = ProfiledSpider(profile='mem')
+    extension = profiling.ProfilingExtension.from_crawler(crawler)
+    extension.spider_opened(spider)
+    assert tracemalloc.is_tracing()
+    extension.spider_closed(spider)
+
+
+def test_tracing_is_stopped_only_when_started_by_profiling(tmp_path):
+    _profile_memory(tmp_path)
+    assert not tracemalloc.is_tracing()
+
+    tracemalloc.start()
+    try:
+        _profile_memory(tmp_path)
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
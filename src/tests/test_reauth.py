@@ -0,0 +1,106 @@
+from unittest.mock import MagicMock
+
+import scrapy
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+
+from book_bot.login import LOGGED_OUT
+from book_bot.reauth import ReauthMiddleware
+
+
+HOME = b'<html><body><a href="logout.processa">Sair</a></body></html>'
+LOGIN = b'<html><body><input id="id_login"><input id="id_senha"></body></html>'
+
+
+def _middleware(tmp_path):
+    auth_file = tmp_path / 'auth'
+    auth_file.write_text('aluno\nsenha\n')
+    crawler = get_crawler(settings_dict={'REAUTH_ENABLED': True, 'REAUTH_MAX_LOGINS': 3,
+                                         'EVA_AUTH_FILE': str(auth_file)})
+    crawler.stats.open_spider(None)
+    crawler.engine = MagicMock()
+    fetched = []
+
+    def fetch(request, spider):
+        fetched.append((request, defer.Deferred()))
+        return fetched[-1][1]
+    crawler.engine.downloader.fetch.side_effect = fetch
+    return ReauthMiddleware.from_crawler(crawler), fetched, crawler.stats
+
+
+def _answer(fetched, body):
+    request, deferred = fetched[-1]
+    deferred.callback(HtmlResponse(request.url, body=body))
+
+
+def _send(middleware, url, spider):
+    request = Request(url)
+    assert middleware.process_request(request, spider) is None
+    return request
+
+
+def _logged_out(middleware, request, spider):
+    request.meta[LOGGED_OUT] = True
+    results = []
+    response = HtmlResponse(request.url, body=LOGIN)
+    defer.maybeDeferred(middleware.process_response, request, response, spider) \
+        .addCallback(results.append)
+    return results
+
+
+def test_renews_session_once_and_replays(tmp_path):
+    middleware, fetched, stats = _middleware(tmp_path)
+    spider = scrapy.Spider('books_downloader')
+    first = _send(middleware, 'http://www.example.com/eadv4/midiateca.download?id=1', spider)
+    second = _send(middleware, 'http://www.example.com/eadv4/midiateca.download?id=2', spider)
+
+    first_results = _logged_out(middleware, first, spider)
+    paused = []
+    middleware.process_request(Request('http://www.example.com/eadv4/listaDisciplina.processa'),
+                               spider).addCallback(paused.append)
+    second_results = _logged_out(middleware, second, spider)
+
+    _answer(fetched, LOGIN)  # home page, logged out
+    assert fetched[-1][0].method == 'POST'
+    assert not first_results and not paused
+    _answer(fetched, HOME)
+
+    assert len(fetched) == 2  # a single login for every refused request
+    assert paused == [None]
+    for request, results in ((first, first_results), (second, second_results)):
+        replayed, = results
+        assert replayed.url == request.url
+        assert LOGGED_OUT not in replayed.meta
+    assert stats.get_value('reauth/login_count') == 1
+    assert stats.get_value('reauth/replayed_count') == 2
+
+
+def test_old_session_is_replayed_without_login(tmp_path):
+    middleware, fetched, _ = _middleware(tmp_path)
+    spider = scrapy.Spider('books_downloader')
+    old = _send(middleware, 'http://www.example.com/eadv4/midiateca.download?id=1', spider)
+    _logged_out(middleware, _send(middleware, 'http://www.example.com/eadv4/', spider), spider)
+    _answer(fetched, LOGIN)
+    _answer(fetched, HOME)
+
+    replayed, = _logged_out(middleware, old, spider)
+    assert replayed.url == old.url
+    assert len(fetched) == 2
+
+
+def test_gives_up_when_login_is_refused(tmp_path):
+    middleware, fetched, stats = _middleware(tmp_path)
+    spider = scrapy.Spider('books_downloader')
+    request = _send(middleware, 'http://www.example.com/eadv4/', spider)
+    results = _logged_out(middleware, request, spider)
+    _answer(fetched, LOGIN)
+    _answer(fetched, LOGIN)
+
+    assert isinstance(results[0], HtmlResponse)  # check_login of the spider gives up
+    later = _send(middleware, 'http://www.example.com/eadv4/', spider)
+    later.meta[LOGGED_OUT] = True
+    response = HtmlResponse(later.url, body=LOGIN)
+    assert middleware.process_response(later, response, spider) is response
+    assert len(fetched) == 2
+    assert stats.get_value('reauth/failed_count') == 1
@@ -0,0 +1,136 @@
+import os
+
+import scrapy
+from twisted.internet import defer
+from scrapy.extensions.httpcache import FilesystemCacheStorage
+from scrapy.http import HtmlResponse, Request
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+
+import book_bot.__main__ as cli
+from book_bot import checkpoints
+from book_bot.runner import BatchRunner, SyncRunner
+from book_bot.accounts import Account
+from book_bot.spiders.eva_auth import LoginSpider, LogoutSpider
+from book_bot.spiders.eva_parser import SubjectSpider, BookSpider
+from book_bot.spiders.sync_spider import BookDownloaderSpider
+from book_bot.spiders.max_spider import MaxSubjectParser, MaxBookParser, MaxSyncDownloader
+from book_bot.utils import state
+
+
+LISTING = 'http://www.example.com/eadv4/listaDisciplina.processa'
+
+
+def _settings(**values):
+    return Settings(dict({'HTTPCACHE_ENABLED': True, 'HTTPCACHE_DIR': 'httpcache'}, **values))
+
+
+def _auth_file(tmp_path, username):
+    path = tmp_path / f'{username}.auth'
+    path.write_text(f'{username}\nsecret\n')
+    return str(path)
+
+
+def test_accounts_of_auth_files_never_share_cached_listings(tmp_path):
+    ana, bia = (SyncRunner(_settings(), auth_file=_auth_file(tmp_path, username))
+                for username in ('ana', 'bia'))
+    spider = scrapy.Spider.from_crawler(get_crawler(), 'book_parser')
+    request = Request(LISTING)
+    stored = FilesystemCacheStorage(ana.settings)
+    stored.open_spider(spider)
+    stored.store_response(spider, request, HtmlResponse(LISTING, body=b'<html>ana</html>'))
+
+    other = FilesystemCacheStorage(bia.settings)
+    other.open_spider(spider)
+
+    assert other.retrieve_response(spider, request) is None
+    assert stored.retrieve_response(spider, request).body == b'<html>ana</html>'
+    assert ana.cache_dir.endswith(os.path.join('accounts', 'ana', 'httpcache'))
+
+
+def test_batch_account_keeps_its_own_cache(tmp_path):
+    runner = SyncRunner(_settings(), auth_file=_auth_file(tmp_path, 'ana'), account='bia')
+    assert runner.cache_dir.endswith(os.path.join('accounts', 'bia', 'httpcache'))
+
+
+def test_listings_of_an_unknown_user_are_not_cached():
+    assert not SyncRunner(_settings()).settings.getbool('HTTPCACHE_ENABLED')
+    assert SyncRunner(_settings(), max_run=True).settings.getbool('HTTPCACHE_ENABLED')
+
+
+def _stub_crawls(runner):
+    crawled = []
+
+    def crawl(_, spidercls, kwargs):
+        crawled.append((spidercls, kwargs))
+        return defer.succeed(None)
+    runner._crawl = crawl
+    return crawled
+
+
+def test_phases_run_in_order(tmp_path):
+    runner = SyncRunner(_settings(), auth_file=_auth_file(tmp_path, 'ana'), destination='/books')
+    phases = runner.phases()
+
+    assert [spidercls for spidercls, _ in phases] == [LoginSpider, SubjectSpider, BookSpider,
+                                                      BookDownloaderSpider]
+    assert phases[0][1]['auth_file'] == runner.auth_file
+    assert phases[-1][1]['destination'] == '/books'
+    assert [spidercls for spidercls, _ in SyncRunner(_settings(), max_run=True).phases()] == [
+        MaxSubjectParser, MaxBookParser, MaxSyncDownloader]
+
+
+def test_logout_unless_kept_online_or_max():
+    assert SyncRunner(_settings()).should_logout()
+    assert not SyncRunner(_settings(), keep_online=True).should_logout()
+    assert not SyncRunner(_settings(), max_run=True).should_logout()
+
+
+def test_cli_options_reach_runner_and_settings(tmp_path, monkeypatch):
+    runners = []
+    monkeypatch.setenv('SCRAPY_SETTINGS_MODULE', 'book_bot.settings')  # set by main
+    monkeypatch.setenv('EVA_COOKIEJAR', str(tmp_path / 'cookies.db'))
+    monkeypatch.setattr(cli, '_package_settings', _settings)
+    monkeypatch.setattr(cli, '_run', lambda runner: runners.append(runner) or [])
+    auth_file = _auth_file(tmp_path, 'ana')
+
+    assert cli.main(['sync', '-k', '-c', '-r', '-x', auth_file, '-d', 'books', '--profile', 'cpu']) == 0
+
+    runner, = runners
+    assert (runner.keep_online, runner.clean, runner.resume, runner.max_run) == (True, True, True, False)
+    assert runner.settings.get('EVA_AUTH_FILE') == auth_file
+    assert runner.settings.get('HTTPCACHE_DIR') == runner.cache_dir
+    assert os.path.isabs(runner.settings.get('METRICS_DIR'))
+    assert os.path.isabs(runner.settings.get('PROFILE_DIR'))
+    assert all(kwargs['profile'] == 'cpu' for _, kwargs in runner.phases())
+    assert runner.phases()[-1][1]['destination'] == str(tmp_path / 'books')
+
+
+def test_resume_skips_finished_phases(tmp_path, monkeypatch):
+    monkeypatch.setenv('EVA_COOKIEJAR', str(tmp_path / 'cookies.db'))
+    runner = SyncRunner(_settings(), auth_file=_auth_file(tmp_path, 'ana'), resume=True)
+    sync_state = state.open_state(state.account_directory(None))
+    for spidercls, status in ((LoginSpider, checkpoints.FINISHED), (SubjectSpider, checkpoints.FINISHED),
+                              (BookSpider, checkpoints.SHUTDOWN)):
+        sync_state.start_phase(spidercls.name)
+        sync_state.checkpoint_phase(spidercls.name, {}, status=status)
+    os.makedirs(runner._jobdir(BookSpider))
+    crawled = _stub_crawls(runner)
+
+    runner.run()
+
+    assert [spidercls for spidercls, _ in crawled] == [BookSpider, BookDownloaderSpider, LogoutSpider]
+    assert crawled[0][1]['resume'] is True
+    assert 'resume' not in crawled[1][1]
+
+
+def test_accounts_of_a_batch_have_their_own_directories(tmp_path):
+    batch = BatchRunner(_settings(), [Account('ana', _auth_file(tmp_path, 'ana'), 'a'),
+                                      Account('bia', _auth_file(tmp_path, 'bia'), 'b')])
+    ana, bia = batch.runners
+
+    assert ana._jobdir(BookSpider) == os.path.join('.sync', 'accounts', 'ana', 'jobs', 'book_parser')
+    assert bia._jobdir(BookSpider) == os.path.join('.sync', 'accounts', 'bia', 'jobs', 'book_parser')
+    assert ana.cache_dir == os.path.abspath(os.path.join('.sync', 'accounts', 'ana', 'httpcache'))
+    assert ana.metrics_dir != bia.metrics_dir
+    assert [kwargs['account'] for _, kwargs in bia.phases()] == ['bia'] * 4
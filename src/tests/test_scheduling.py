@@ -0,0 +1,32 @@
+from book_bot.scheduling import LARGE_PRIORITY, plan_downloads
+
+
+def _book(name, subject, size=None, seen=None):
+    return dict(name=name, subject=dict(name=subject, class_id=subject), size=size, subject_seen=seen)
+
+
+def test_takes_books_round_robin_from_subjects():
+    books = [_book('a1', 'a'), _book('a2', 'a'), _book('a3', 'a'), _book('b1', 'b')]
+
+    planned = list(plan_downloads(books, large_size=100))
+
+    assert [book['name'] for book, _ in planned] == ['a1', 'b1', 'a2', 'a3']
+    assert [priority for _, priority in planned] == [0, 0, -1, -2]
+
+
+def test_starts_with_recent_subjects_and_small_files():
+    books = [_book('a1', 'a', size=50, seen=1.0), _book('b1', 'b', size=20, seen=2.0),
+             _book('b2', 'b', size=10, seen=2.0)]
+
+    planned = [book['name'] for book, _ in plan_downloads(books, large_size=100)]
+
+    assert planned == ['b2', 'a1', 'b1']
+
+
+def test_large_files_go_last():
+    books = [_book('huge', 'a', size=800), _book('big', 'a', size=200), _book('a1', 'a'), _book('b1', 'b', size=1)]
+
+    planned = list(plan_downloads(books, large_size=100))
+
+    assert [book['name'] for book, _ in planned] == ['a1', 'b1', 'big', 'huge']
+    assert planned[3][1] < planned[2][1] < LARGE_PRIORITY < planned[1][1]
@@ -0,0 +1,77 @@
+from http.cookiejar import Cookie
+
+from scrapy.http.cookies import CookieJar
+from scrapy.utils.test import get_crawler
+
+from book_bot.spiders.eva_auth import LoginSpider, session_cache
+from book_bot.spiders.max_spider import MaxSyncDownloader
+from book_bot.spiders.sync_spider import BookDownloaderSpider
+from book_bot.items import Book, Subject
+from .util import fake_response_from_file
+
+
+def _spider(spidercls, tmp_path, **kwargs):
+    crawler = get_crawler(spidercls, {'COOKIES_PERSISTENCE': True,
+                                      'COOKIES_PERSISTENCE_DIR': str(tmp_path / 'cookies.db'),
+                                      'COOKIES_SESSION_TTL': 60,
+                                      'SESSION_VALIDATION_TTL': 60})
+    return spidercls.from_crawler(crawler, **kwargs)
+
+
+def _save_cookies(spider):
+    jar = CookieJar()
+    jar.set_cookie(Cookie(0, 'JSESSIONID', 'abc', None, False, 'www.uaberta.unisul.br', False, False,
+                          '/eadv4/', True, False, None, True, None, None, {}))
+    session = session_cache(spider)
+    session.store.save(session.namespace, jar)
+
+
+def _log_in(spider):
+    _save_cookies(spider)
+    spider.after_login(spider.retry_login)(fake_response_from_file('assets/logged.html'))
+
+
+def test_login_is_skipped_while_session_is_fresh(tmp_path):
+    assert len(list(_spider(LoginSpider, tmp_path).start_requests())) == 1
+
+    _log_in(_spider(LoginSpider, tmp_path))
+
+    assert list(_spider(LoginSpider, tmp_path).start_requests()) == []
+    assert len(list(_spider(LoginSpider, tmp_path, account='other').start_requests())) == 1
+
+
+def test_refused_session_is_checked_again(tmp_path):
+    spider = _spider(LoginSpider, tmp_path)
+    _log_in(spider)
+    spider.retry_login = lambda response: iter(())
+
+    spider.after_login(spider.retry_login)(fake_response_from_file('assets/login.html'))
+
+    assert len(list(_spider(LoginSpider, tmp_path).start_requests())) == 1
+
+
+def test_cached_pages_do_not_refresh_the_session(tmp_path):
+    spider = _spider(LoginSpider, tmp_path)
+    _save_cookies(spider)
+    cached = fake_response_from_file('assets/logged.html').replace(flags=['cached'])
+
+    spider.after_login(spider.retry_login)(cached)
+
+    assert len(list(_spider(LoginSpider, tmp_path).start_requests())) == 1
+
+
+def test_downloads_start_without_probe_when_session_is_fresh(tmp_path):
+    _log_in(_spider(LoginSpider, tmp_path))
+    spider = _spider(BookDownloaderSpider, tmp_path, destination=str(tmp_path))
+    subject = Subject(name='baz', class_id='1')
+    spider.state.replace_subjects([subject])
+    spider.state.replace_books(subject, [Book(name='foo', download_url='/bar?arquivo=foo.pdf', subject=subject)])
+
+    requests = list(spider.start_requests())
+
+    assert [r.callback for r in requests] == [spider.handle_download]
+
+
+def test_max_downloads_never_check_a_session(tmp_path):
+    spider = _spider(MaxSyncDownloader, tmp_path, destination=str(tmp_path))
+    assert list(spider.start_requests()) == []
@@ -0,0 +1,283 @@
+from unittest.mock import MagicMock
+
+import pytest
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone, ResponseFailed
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+
+from book_bot import disk
+from book_bot.disk import DiskPool
+from book_bot.handlers import MemoryBudget, _PartWriter
+from book_bot.items import Book, Subject
+from book_bot.spiders.sync_spider import BookDownloaderSpider
+
+
+def test_writes_chunks_when_buffer_is_full(tmp_path):
+    part = tmp_path / 'subject' / '.book.part'
+    writer, results = _writer(part, buffer_size=4)
+
+    writer.dataReceived(b'abc')
+    assert part.read_bytes() == b''
+    writer.dataReceived(b'def')
+    assert part.read_bytes() == b'abcdef'
+
+    writer.connectionLost(Failure(ResponseDone()))
+    assert results == [6]
+
+
+def test_flushes_every_chunk_when_budget_is_exhausted(tmp_path):
+    part = tmp_path / '.book.part'
+    budget = MemoryBudget(limit=2)
+    writer, _ = _writer(part, buffer_size=1024, budget=budget)
+
+    writer.dataReceived(b'abc')
+    assert part.read_bytes() == b'abc'
+    assert budget.used == 0
+
+
+def test_stops_reading_while_the_memory_budget_is_exhausted(tmp_path):
+    part = tmp_path / '.book.part'
+    budget, pool = MemoryBudget(limit=2), SlowDisk()
+    writer, _ = _writer(part, buffer_size=1024, budget=budget, pool=pool)
+    pool.finish()  # opened
+
+    writer.dataReceived(b'abc')
+    writer.transport.pauseProducing.assert_called_once()
+    writer.transport.resumeProducing.assert_not_called()
+
+    pool.finish()  # written, the budget is released
+    writer.transport.resumeProducing.assert_called_once()
+    assert budget.used == 0
+
+
+def test_new_transfers_wait_while_the_disk_is_congested():
+    pool = DiskPool(threads=1, max_pending=10)
+    pool.pending = 10
+    waiting = pool.ready()
+    assert not waiting.called
+    pool.pending = 4
+    pool._wake()
+    assert waiting.called
+    assert pool.ready().called
+
+
+def test_stops_reading_while_the_disk_is_behind(tmp_path):
+    part = tmp_path / '.book.part'
+    pool = SlowDisk()
+    writer, results = _writer(part, buffer_size=2, pool=pool)
+    pool.finish()  # opened
+
+    for chunk in (b'ab', b'cd', b'ef'):
+        writer.dataReceived(chunk)
+    writer.transport.pauseProducing.assert_called_once()
+    pool.finish()
+    writer.transport.resumeProducing.assert_not_called()  # 4 bytes still waiting
+    pool.finish()
+    writer.transport.resumeProducing.assert_called_once()
+
+    writer.connectionLost(Failure(ResponseDone()))
+    pool.finish()
+    pool.finish()
+    assert part.read_bytes() == b'abcdef'
+    assert results == [6]
+
+
+def test_cancels_and_removes_part_larger_than_maxsize(tmp_path):
+    part = tmp_path / '.book.part'
+    writer, results = _writer(part, maxsize=4)
+
+    writer.dataReceived(b'abcde')
+    writer.transport.stopProducing.assert_called_once()
+    writer.connectionLost(Failure(ResponseFailed([])))
+
+    assert not part.exists()
+    assert results[0].check(defer.CancelledError)
+
+
+def test_commits_streamed_part_into_book_path(tmp_path):
+    spider = _spider(tmp_path)
+    book = Book(name='foo', download_url=f'/bar?{Book.qs_file_arg}=foo.pdf',
+                subject=Subject(name='baz', class_id='1'))
+    request = spider.build_download_request(book)
+    part = request.meta['download_part']
+    (tmp_path / 'baz').mkdir()
+    with open(part, 'wb') as h:
+        h.write(b'%PDF')
+
+    response = Response(request.url, request=request, flags=['streamed'])
+    spider.handle_download(response, book=book)
+
+    assert (tmp_path / 'baz' / 'foo.pdf').read_bytes() == b'%PDF'
+    assert not (tmp_path / 'baz' / part).exists()
+
+
+def test_sends_validators_of_synced_books(tmp_path):
+    spider, book = _synced_book(tmp_path, etag='"v1"')
+
+    request = spider._analyze_candidate(book)
+
+    assert request.headers['If-None-Match'] == b'"v1"'
+    assert request.meta['handle_httpstatus_list'] == [304]
+
+
+def test_not_modified_book_does_not_touch_disk(tmp_path):
+    spider, book = _synced_book(tmp_path, etag='"v1"')
+    request = spider._analyze_candidate(book)
+
+    response = Response(request.url, status=304, request=request)
+    spider.handle_download(response, book=book)
+
+    assert (tmp_path / 'baz' / 'foo.pdf').read_bytes() == b'old'
+    assert spider.state.download(book['download_url'])['etag'] == '"v1"'
+
+
+def test_changed_book_is_downloaded_in_place(tmp_path):
+    spider, book = _synced_book(tmp_path, etag='"v1"')
+    request = spider._analyze_candidate(book)
+    with open(request.meta['download_part'], 'wb') as h:
+        h.write(b'new')
+
+    response = Response(request.url, headers={'ETag': '"v2"'}, 
+                        request=request, flags=['streamed'])
+    spider.handle_download(response, book=book)
+
+    assert (tmp_path / 'baz' / 'foo.pdf').read_bytes() == b'new'
+    assert spider.state.download(book['download_url'])['etag'] == '"v2"'
+
+
+def test_truncated_book_is_downloaded_again(tmp_path):
+    spider, book = _synced_book(tmp_path, etag='"v1"')
+    (tmp_path / 'baz' / 'foo.pdf').write_bytes(b'ol')
+    request = spider._analyze_candidate(book)
+    assert 'If-None-Match' not in request.headers and request.meta['replace']
+    with open(request.meta['download_part'], 'wb') as h:
+        h.write(b'new')
+
+    spider.handle_download(Response(request.url, request=request, flags=['streamed']), book=book)
+
+    assert (tmp_path / 'baz' / 'foo.pdf').read_bytes() == b'new'
+    assert not spider.library.truncated(str(tmp_path / 'baz' / 'foo.pdf'), 3)
+
+
+def test_skips_synced_books_without_validators(tmp_path):
+    spider, book = _synced_book(tmp_path)
+    assert spider._analyze_candidate(book) is None
+
+
+def test_skipped_download_is_remembered_and_counted(tmp_path):
+    spider = _spider(tmp_path)
+    crawler = spider.crawler
+    book = Book(name='foo', download_url='/bar?id=1', subject=Subject(name='baz', class_id='1'))
+    request = spider._analyze_candidate(book)
+    request.meta['download_avoided'] = 2048
+
+    response = Response(request.url, request=request, flags=['skipped'], headers={
+        'Content-Disposition': 'attachment; filename="foo.pdf"', 'ETag': '"v1"'})
+    spider.handle_download(response, book=book)
+
+    assert crawler.stats.get_value('download/avoided_bytes') == 2048
+    assert spider.state.download(book['download_url'])['filename'] == 'foo.pdf'
+    assert not (tmp_path / 'baz' / 'foo.pdf').exists()
+
+
+def test_large_download_is_queued_again_after_small_ones(tmp_path):
+    spider = _spider(tmp_path)
+    crawler = spider.crawler
+    book = Book(name='foo', download_url=f'/bar?{Book.qs_file_arg}=foo.pdf',
+                subject=Subject(name='baz', class_id='1'))
+    request = spider._analyze_candidate(book)
+    request.meta.update(download_defer_above=100, download_size=2 ** 30)
+
+    response = Response(request.url, request=request, flags=['deferred'])
+    again = spider.handle_download(response, book=book)
+
+    assert again.priority < request.priority and again.dont_filter
+    assert 'download_defer_above' not in again.meta and 'download_size' not in again.meta
+    assert spider.state.download(book['download_url'])['content_length'] == 2 ** 30
+    assert crawler.stats.get_value('download/first_file_seconds') is None
+
+
+def test_first_and_last_download_times_are_stats(tmp_path):
+    spider = _spider(tmp_path)
+    crawler = spider.crawler
+    book = Book(name='foo', download_url=f'/bar?{Book.qs_file_arg}=foo.pdf',
+                subject=Subject(name='baz', class_id='1'))
+    request = spider._analyze_candidate(book)
+
+    spider.handle_download(Response(request.url, body=b'%PDF', request=request), book=book)
+
+    first = crawler.stats.get_value('download/first_file_seconds')
+    assert first is not None and crawler.stats.get_value('download/completion_seconds') == first
+
+
+def test_resumed_sync_skips_books_synced_before_the_stop(tmp_path):
+    spider, book = _synced_book(tmp_path, etag='"v1"')
+    synced_at = spider.state.download(book['download_url'])['updated_at']
+
+    spider.synced_since = synced_at - 60
+    assert spider._analyze_candidate(book) is None
+    spider.synced_since = synced_at + 60
+    assert spider._analyze_candidate(book) is not None
+
+
+def test_library_is_walked_by_the_disk_pool_before_any_request(tmp_path, monkeypatch):
+    pool = SlowDisk()
+    monkeypatch.setattr(disk, 'pool', pool)
+    spider = _spider(tmp_path)
+    (tmp_path / 'baz').mkdir()
+    (tmp_path / 'baz' / 'foo.pdf').write_bytes(b'old')
+
+    opened = spider.index_library(spider)  # on spider_opened, the engine waits for it
+    assert not opened.called and not spider.library.scanned
+    pool.finish()
+
+    assert opened.called
+    assert str(tmp_path / 'baz' / 'foo.pdf') in spider.library
+    assert spider.crawler.stats.get_value('library/files') == 1
+
+
+def _spider(tmp_path):
+    crawler = get_crawler(BookDownloaderSpider)
+    spider = BookDownloaderSpider.from_crawler(crawler, destination=str(tmp_path))
+    crawler.stats.open_spider(spider)
+    return spider
+
+
+def _synced_book(tmp_path, etag=None):
+    spider = _spider(tmp_path)
+    book = Book(name='foo', download_url=f'/bar?{Book.qs_file_arg}=foo.pdf',
+                subject=Subject(name='baz', class_id='1'))
+    (tmp_path / 'baz').mkdir()
+    (tmp_path / 'baz' / 'foo.pdf').write_bytes(b'old')
+    spider.state.record_download(book['download_url'], filename='foo.pdf', 
+                                 etag=etag, content_length=3)
+    return spider, book
+
+
+def _writer(part, buffer_size=1024, maxsize=0, budget=None, pool=None):
+    results = []
+    finished = defer.Deferred()
+    finished.addBoth(results.append)
+    writer = _PartWriter(finished, str(part), -1, maxsize, buffer_size, 0,
+                         budget=budget or MemoryBudget(), pool=pool or DiskPool())
+    writer.makeConnection(MagicMock())
+    return writer, results
+
+
+class SlowDisk(DiskPool):
+    """Runs each operation only when told to, as a busy disk would."""
+
+    def __init__(self):
+        super().__init__()
+        self.queue = []
+
+    def run(self, fn, *args, size=0, **kwargs):
+        d = defer.Deferred()
+        self.queue.append((d, lambda: fn(*args, **kwargs)))
+        return d
+
+    def finish(self):
+        d, operation = self.queue.pop(0)
+        d.callback(operation())
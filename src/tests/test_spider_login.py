@@ -37,11 +37,10 @@ def test_retry_login_with_default_credentials():
     assert not 'creds' in response.meta
 
 
-def test_fake_authentication_once():
+def test_trust_verdict_of_detection_middleware():
     login_response = fake_response_from_file('assets/login.html')
-    eva_auth.LoginSpider.fake_auth()
+    login_response.meta['logged_out'] = False
     assert not eva_auth.LoginSpider.auth_failed(login_response)
-    assert eva_auth.LoginSpider.auth_failed(login_response)
 
 
 def _do_not_login(file):
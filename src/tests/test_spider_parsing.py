@@ -1,9 +1,11 @@
 from unittest.mock import MagicMock, Mock
+from urllib.parse import parse_qs, urlparse
 
 import pytest
 from book_bot.spiders import eva_parser
 from book_bot.items import Subject, Book 
-from book_bot.utils import http, os_files
+from book_bot.pipelines import SubjectPipeline
+from book_bot.utils import http, state
 from .util import fake_response, fake_response_from_file, mock_http_open
 
 
@@ -17,9 +19,9 @@ def test_request_all_subjects():
     expected_subjects = 2
     fake_loader = fake_subject_loader(expected_subjects)
 
-    spider = mock_parser(fake_loader)
+    _, subjects = mock_parser(fake_loader)
    
-    assert len(spider.subjects) == expected_subjects
+    assert len(subjects) == expected_subjects
 
 
 def test_raises_exception_when_empty():
@@ -28,14 +30,16 @@ def test_raises_exception_when_empty():
     
     with pytest.raises(Exception):
         spider = eva_parser.SubjectSpider()
-        spider.parse_subjects(response)
+        list(spider.parse_subjects(response))
 
 
 def test_subject_parsing_from_file():
     spider = mock_subject_spider()
     response = fake_response_from_file('assets/subjects.html')
     
-    for index, subject_item in enumerate(spider.subjects):
+    subjects = list(spider.parse_subjects(response))
+    assert subjects
+    for index, subject_item in enumerate(subjects):
         assert subject_item['class_id'] == str(index) 
         assert subject_item['name'] == f'subject{index}'
 
@@ -43,13 +47,14 @@ def test_subject_parsing_from_file():
 def fake_subject_loader(size):
     def loader_mock(spider, name, tree, loader):
         for i in range(size):
-            s = Subject(name=name, class_id=str(i))
-            loader.subjects.append(s)
+            yield Subject(name=name, class_id=str(i))
     return loader_mock
 
 
 def mock_parser(loader_fn):
     spider = mock_subject_spider([])
+    pipeline = SubjectPipeline()
+    pipeline.open_spider(spider)
     
     old_loader = eva_parser._display_and_load 
     eva_parser._display_and_load = MagicMock(side_effect=loader_fn)
@@ -57,14 +62,36 @@ def mock_parser(loader_fn):
     response = fake_response()
     response.xpath = MagicMock()
 
-    spider.parse_subjects(response)
+    subjects = [pipeline.process_item(s, spider) for s in spider.parse_subjects(response)]
+    pipeline.close_spider(spider)
     eva_parser._display_and_load = old_loader
-    return spider
+    return spider, subjects
 
 
 def mock_subject_spider(initial_subjects=[]):
-    old_load_sync = os_files.load_sync_data
-    os_files.load_sync_data = MagicMock(side_effect=lambda *all: initial_subjects)
-    spider = eva_parser.SubjectSpider()
-    os_files.load_sync_data = old_load_sync
-    return spider
\ No newline at end of file
+    state.open_state().replace_subjects(initial_subjects)
+    return eva_parser.SubjectSpider()
+
+
+def test_request_all_subject_listings_at_once():
+    subjects = [dict(name=f'subject{i}', class_id=str(i)) for i in range(3)]
+    spider = mock_book_spider(subjects)
+
+    requests = list(spider.start_requests())
+
+    assert len(requests) == len(subjects)
+    class_ids = [parse_qs(urlparse(r.url).query)['turmaIdSessao'][0] for r in requests]
+    assert class_ids == ['0', '1', '2']
+    assert 'turmaIdSessao' not in eva_parser.BookSpider.book_args
+
+
+def test_subjects_are_not_duplicated_between_runs():
+    for run in range(2):
+        spider, _ = mock_parser(fake_subject_loader(2))
+
+    assert len(spider.state.subjects()) == 2
+
+
+def mock_book_spider(initial_subjects):
+    state.open_state().replace_subjects(initial_subjects)
+    return eva_parser.BookSpider()
@@ -0,0 +1,100 @@
+import json
+import sqlite3
+
+from book_bot.items import Book, Subject
+from book_bot.utils import state
+
+
+def test_books_follow_subjects_order():
+    sync_state = state.SyncState()
+    subjects = [Subject(name='foo', class_id='1'), Subject(name='bar', class_id='2')]
+    sync_state.replace_subjects(subjects)
+    sync_state.replace_books(subjects[1], [_book('b', subjects[1])])
+    sync_state.replace_books(subjects[0], [_book('a', subjects[0])])
+
+    assert [b['name'] for b in sync_state.books()] == ['a', 'b']
+    assert next(sync_state.books())['subject'] == dict(name='foo', class_id='1')
+
+
+def test_listing_replaces_old_books_of_subject():
+    sync_state = state.SyncState()
+    subject = Subject(name='foo', class_id='1')
+    sync_state.replace_subjects([subject])
+    sync_state.replace_books(subject, [_book('a', subject), _book('b', subject)])
+    sync_state.replace_books(subject, [_book('b', subject)])
+
+    assert [b['name'] for b in sync_state.books()] == ['b']
+
+
+def test_max_and_eva_subjects_are_kept_apart():
+    sync_state = state.SyncState()
+    sync_state.replace_subjects([Subject(name='foo', class_id='1')])
+    sync_state.replace_subjects([dict(name='bar', url='bar.htm')], kind=state.MAX)
+
+    assert sync_state.subjects() == [dict(name='foo', class_id='1')]
+    assert sync_state.subjects(kind=state.MAX) == [dict(name='bar', url='bar.htm')]
+
+
+def test_books_carry_known_size_and_subject_recency(monkeypatch):
+    sync_state = state.SyncState()
+    subject = Subject(name='foo', class_id='1')
+    monkeypatch.setattr(state.time, 'time', lambda: 10.0)
+    sync_state.replace_subjects([subject])
+    monkeypatch.setattr(state.time, 'time', lambda: 20.0)
+    sync_state.replace_subjects([subject, Subject(name='bar', class_id='2')])
+    sync_state.replace_books(subject, [_book('a', subject), _book('b', subject)])
+    sync_state.record_download('/a?arquivo=a.pdf', filename='a.pdf', content_length=3)
+
+    books = list(sync_state.books())
+    assert [(b['size'], b['subject_seen']) for b in books] == [(3, 10.0), (None, 10.0)]
+    assert sync_state.conn.execute("SELECT first_seen FROM subjects WHERE key = '2'").fetchone()[0] == 20.0
+
+
+def test_resumed_phase_keeps_its_start(monkeypatch):
+    sync_state = state.SyncState()
+    monkeypatch.setattr(state.time, 'time', lambda: 10.0)
+    sync_state.start_phase('books_downloader')
+    sync_state.phase_queued('books_downloader')
+    sync_state.checkpoint_phase('books_downloader', {'response_received_count': 3}, status='shutdown')
+
+    monkeypatch.setattr(state.time, 'time', lambda: 20.0)
+    sync_state.start_phase('books_downloader', resumed=True)
+    phase = sync_state.phases()['books_downloader']
+    assert (phase['status'], phase['queued'], phase['started_at']) == ('running', True, 10.0)
+    assert phase['progress'] == {'response_received_count': 3}
+
+    sync_state.start_phase('books_downloader')
+    assert sync_state.phases()['books_downloader']['queued'] is False
+
+
+def test_adds_columns_of_newer_versions(tmp_path):
+    path = str(tmp_path / 'state.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(state.SCHEMA.replace(',\n    first_seen REAL', ''))
+    conn.close()
+
+    state.SyncState(path).replace_subjects([Subject(name='foo', class_id='1')])
+
+
+def test_imports_legacy_json_files(sync_dir):
+    subject = {'name': ['foo'], 'class_id': ['1']}
+    legacy = {'subjects.json': [subject, subject],
+              'books.json': [{'name': ['a'], 'download_url': ['/a?arquivo=a.pdf'],
+                              'filename': ['a.pdf'], 'subject': subject}],
+              'downloads.json': {'/a?arquivo=a.pdf': {'filename': 'a.pdf', 'etag': '"v1"',
+                                                      'last_modified': None, 
+                                                      'content_length': 3}}}
+    sync_dir.mkdir()
+    for filename, data in legacy.items():
+        (sync_dir / filename).write_text(json.dumps(data))
+
+    sync_state = state.open_state()
+
+    assert sync_state.subjects() == [dict(name='foo', class_id='1')]
+    assert [b['filename'] for b in sync_state.books()] == ['a.pdf']
+    assert sync_state.download('/a?arquivo=a.pdf')['etag'] == '"v1"'
+    assert not (sync_dir / 'subjects.json').exists()
+
+
+def _book(name, subject):
+    return Book(name=name, download_url=f'/{name}?{Book.qs_file_arg}={name}.pdf', subject=subject)
@@ -0,0 +1,107 @@
+import os
+
+from twisted.internet import defer
+from twisted.trial import unittest
+from scrapy import Request, Spider
+from scrapy.crawler import CrawlerRunner
+
+from benchmarks.mock_server import MockServer, Options
+from book_bot import throttle
+from book_bot.throttle import PoolController
+
+
+def test_grows_while_fast_and_healthy():
+    controller = PoolController(4, maximum=6, target_latency=1.0)
+    for _ in range(4 + 5 + 6):
+        controller.observe(latency=0.1)
+    assert controller.concurrency == 6
+
+
+def test_halves_and_backs_off_on_errors():
+    controller = PoolController(8, target_latency=1.0)
+    for i in range(8):
+        controller.observe(latency=0.1, error=i % 2 == 0)
+    assert controller.concurrency == 4
+    assert controller.delay == 0
+
+
+def test_backs_off_delay_at_minimum_concurrency():
+    controller = PoolController(1, target_latency=1.0)
+    for _ in range(4):
+        controller.observe(latency=0.1, error=True)
+    assert controller.concurrency == 1
+    assert controller.delay == 0.25
+
+
+def test_slows_down_when_latency_is_high():
+    controller = PoolController(8, target_latency=1.0)
+    for _ in range(8):
+        controller.observe(latency=3.0)
+    assert controller.concurrency == 7
+
+
+def test_gives_back_growth_without_more_throughput(monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr(throttle.time, 'monotonic', lambda: next(clock))
+    controller = PoolController(4, target_latency=10.0, by_throughput=True)
+    for _ in range(4):
+        controller.observe(latency=0.1, size=100)
+    assert controller.concurrency == 5
+    for _ in range(5):
+        controller.observe(latency=0.1, size=10)
+    assert controller.concurrency == 4
+
+
+class Pages(Spider):
+    name = 'pages'
+
+    def start_requests(self):
+        for i in range(self.listings):
+            yield self.request(f'/max.pereira/disciplina{i}.htm')
+        for i in range(self.downloads):
+            part = os.path.join(self.directory, f'.{i}.part')
+            yield self.request(f'/max.pereira/aula0_{i}.pdf', meta={'download_part': part})
+
+    def request(self, path, meta=None):
+        return Request(self.base_url + path, meta=meta, dont_filter=True, callback=self.parse,
+                       errback=lambda failure: None)
+
+    def parse(self, response):
+        pass
+
+
+class AdaptiveThrottleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = MockServer(Options(books=40, file_size=1024, latency=0.01, error_rate=0.5))
+        self.port = self.mock.listen()
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    @defer.inlineCallbacks
+    def test_downloads_back_off_apart_from_listings(self):
+        runner = CrawlerRunner({
+            'ROBOTSTXT_OBEY': False,
+            'RETRY_ENABLED': False,
+            'LOG_LEVEL': 'ERROR',
+            'THROTTLE_ENABLED': True,
+            'BOOK_LISTING_CONCURRENCY': 4,
+            'THROTTLE_MAX_LISTING_CONCURRENCY': 16,
+            'THROTTLE_DOWNLOAD_CONCURRENCY': 8,
+            'THROTTLE_MAX_DOWNLOAD_CONCURRENCY': 32,
+            'THROTTLE_LISTING_TARGET_LATENCY': 1.0,
+            'THROTTLE_DOWNLOAD_TARGET_LATENCY': 1.0,
+            'THROTTLE_MAX_DELAY': 0.05,
+            'DOWNLOAD_HANDLERS': {'http': 'book_bot.handlers.StreamingDownloadHandler'},
+            'DOWNLOADER_MIDDLEWARES': {'book_bot.throttle.AdaptiveThrottleMiddleware': 950},
+        })
+        crawler = runner.create_crawler(Pages)
+        yield runner.crawl(crawler, listings=20, downloads=40, directory=os.path.abspath(self.mktemp()),
+                           base_url=f'http://127.0.0.1:{self.port.getHost().port}')
+
+        stats = crawler.stats
+        self.assertTrue(stats.get_value('throttle/download/errors') > 0)
+        self.assertTrue(stats.get_value('throttle/download/concurrency') < 8)
+        self.assertFalse(stats.get_value('throttle/listing/errors'))
+        self.assertTrue(stats.get_value('throttle/listing/max_concurrency') > 4)